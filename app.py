@@ -1,10 +1,64 @@
-from flask import Flask, render_template, request, redirect, url_for, session
-from graph_app.flow import run_flow
-import tempfile
+from flask import Flask, Response, render_template, request, url_for, session
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from graph_app.jobs import JobQueue, JOB_SUCCEEDED, create_job_backend, run_flow_job, warm_up_in_background
+from graph_app.events import event_bus
+from graph_app.batch import BATCH_DIR, batch_status, run_batch_job
+from graph_app.tracing import render_metrics
+from utils.uploads import SpoolingRequest, MAX_UPLOAD_TOTAL_BYTES, finalize_uploads, release_uploads, sweep_stale_uploads
+from utils.serving import load_secret_key
+import hashlib
+import time
+import re
+import json
 import os
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
-app.secret_key = os.urandom(24).hex()  # Tạo secret key ngẫu nhiên
+# Key ổn định (FLASK_SECRET_KEY / file key dùng chung) để cookie session hợp lệ trên mọi worker và sau restart
+app.secret_key = load_secret_key()
+# File upload được stream thẳng xuống uploads/<job_id>/ (giới hạn kích thước từng file + cả request)
+app.request_class = SpoolingRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_TOTAL_BYTES
+sweep_stale_uploads()
+
+# Hàng đợi job: /process chỉ enqueue, worker nền chạy LangGraph flow
+# JOB_WORKERS=0 → web chỉ enqueue, worker chạy riêng bằng `python -m graph_app.jobs`
+job_queue = JobQueue(
+    run_flow_job,
+    backend=create_job_backend(),
+    num_workers=int(os.environ.get("JOB_WORKERS", "2"))
+)
+
+# Batch chạy tuần tự từng file trong mỗi process (mỗi batch tự chạy song song nhiều bài bên trong);
+# tiến độ nằm trong checkpoint trên đĩa, trạng thái job cùng backend với job thường
+# (JOB_BACKEND=sqlite → worker gunicorn nào cũng thấy trạng thái batch do worker khác nhận)
+batch_queue = JobQueue(
+    run_batch_job,
+    backend=create_job_backend(db_path=os.environ.get("BATCH_JOB_DB_PATH", "jobs/batches.sqlite")),
+    num_workers=1
+)
+
+
+def start_background_workers():
+    """Khởi động worker của các hàng đợi (gunicorn: gọi trong post_fork của từng worker)"""
+    if job_queue.num_workers > 0:
+        job_queue.start()
+    batch_queue.start()
+
+
+def stop_background_workers(timeout: float = None):
+    """Dừng nhận job mới và chờ các job đang chạy xong (chung một deadline cho cả hai hàng đợi)"""
+    deadline = time.time() + timeout if timeout is not None else None
+    for queue in (job_queue, batch_queue):
+        remaining = None if deadline is None else max(0.0, deadline - time.time())
+        queue.shutdown(wait=True, timeout=remaining)
+
+
+# Chạy thẳng (python app.py / flask run) → khởi động ngay; gunicorn đặt DEFER_BACKGROUND_WORKERS=1
+# để thread không được tạo ở master trước khi fork
+if os.environ.get("DEFER_BACKGROUND_WORKERS") != "1":
+    start_background_workers()
+    if job_queue.num_workers > 0:
+        warm_up_in_background()
 
 @app.route('/')
 def home():
@@ -20,16 +74,10 @@ def process():
         # Lấy dữ liệu từ form
         form_data = request.form.to_dict(flat=True)
         content_types = request.form.getlist('content_type[]')
-        files = request.files.getlist('files[]')
 
-        # Lưu file đính kèm
-        saved_files = []
-
-        for file in files:
-            if file.filename:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                    file.save(tmp.name)
-                    saved_files.append(tmp.name)
+        # File đính kèm đã được stream xuống đĩa trong lúc parse request (kèm SHA-256)
+        uploads = finalize_uploads(request.files.getlist('files[]'))
+        saved_files = [upload['path'] for upload in uploads]
 
         # Tạo JSON từ form
         json_data = {
@@ -46,29 +94,171 @@ def process():
             'timestamp': form_data.get('timestamp', '')
         }
 
+        # ✅ Đưa flow vào hàng đợi, trả job id ngay lập tức
+        # (job id = thư mục upload → worker xóa file khi job kết thúc)
+        job_id = job_queue.submit(json_data, job_id=request.upload_id)
+
         # Lưu vào session
         session['form_data'] = json_data
-        print("Form data saved to session:", json_data)
+        session['job_id'] = job_id
+        print(f"Form data saved to session (job {job_id}):", json_data)
 
-        # ✅ Gọi flow xử lý 1 lần duy nhất
-        run_flow(json_data)
+        return {
+            "job_id": job_id,
+            "status_url": url_for('job_status', job_id=job_id),
+            "result_url": url_for('job_result', job_id=job_id),
+            "events_url": url_for('job_events', job_id=job_id),
+            "chat_url": url_for('chat')
+        }, 202
 
-        # Sau khi xử lý xong, chuyển sang trang chat
-        return redirect(url_for('chat'))
+    except RequestEntityTooLarge as e:
+        release_uploads(request.upload_id)
+        return {"error": "File quá lớn", "details": e.description}, 413
+
+    except UnsupportedMediaType as e:
+        release_uploads(request.upload_id)
+        return {"error": "Định dạng file không được hỗ trợ", "details": e.description}, 415
 
     except Exception as e:
         print("Error in /process:", str(e))
+        release_uploads(request.upload_id)
         return {"error": "Lỗi xử lý form", "details": str(e)}, 500
 
 @app.route('/chat')
 def chat():
     try:
         form_data = session.get('form_data', {})
+        job_id = session.get('job_id', '')
         print("Rendering chat with form_data:", form_data)
-        return render_template('chat.html', form_data=form_data)
+        return render_template('chat.html', form_data=form_data, job_id=job_id)
     except Exception as e:
         print("Error in /chat:", str(e))
         return {"error": "Lỗi render trang chat", "details": str(e)}, 500
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"error": "Không tìm thấy job", "job_id": job_id}, 404
+    return job.to_status_dict()
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"error": "Không tìm thấy job", "job_id": job_id}, 404
+    if not job.finished:
+        # Chưa xong → 202 để client tiếp tục poll
+        return job.to_status_dict(), 202
+    if job.error:
+        return {"error": "Job thất bại", "details": job.error, "job_id": job_id}, 500
+    return {"job_id": job_id, "lesson_plan": job.result}
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events: tiến độ từng node, thời gian chạy và nội dung từng phần bài giảng"""
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        last_seq = 0
+
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"error": "Không tìm thấy job", "job_id": job_id}, 404
+
+    # Job có thể do worker / process khác chạy (sự kiện không tới bus của process này):
+    # mỗi lần rảnh tra trạng thái trong job backend, báo khi đổi trạng thái và
+    # đóng stream khi job xong để client chuyển sang lấy kết quả
+    last_status = {"status": job.status}
+
+    def poll_status():
+        current = job_queue.get(job_id)
+        if current is None:
+            return {"type": "run_failed", "data": {"error": "Job không còn tồn tại"}}
+        if current.finished:
+            event_type = "run_finished" if current.status == JOB_SUCCEEDED else "run_failed"
+            return {"type": event_type, "data": {"status": current.status, "error": current.error or ""}}
+        if current.status != last_status["status"]:
+            last_status["status"] = current.status
+            return {"type": "job_status", "data": {"status": current.status}}
+        return None
+
+    def stream():
+        events = event_bus.subscribe(job_id, last_seq=last_seq, poll=poll_status,
+                                     heartbeat=float(os.environ.get("SSE_POLL_SECONDS", "5")))
+        for event in events:
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            payload = json.dumps({"ts": event["ts"], **event["data"]}, ensure_ascii=False)
+            yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Histogram thời gian / tài nguyên / token theo node, định dạng text của Prometheus"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """
+    Nhận file JSONL (field 'file') hoặc JSON {"lessons": [...]} rồi chạy cả batch ở nền.
+    Gửi lại cùng nội dung (hoặc cùng batch_id) sẽ resume từ checkpoint.
+    """
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            content = upload.read()
+        else:
+            body = request.get_json(silent=True) or {}
+            lessons = body.get('lessons') or []
+            content = "\n".join(json.dumps(lesson, ensure_ascii=False) for lesson in lessons).encode("utf-8")
+        if not content.strip():
+            return {"error": "Batch rỗng"}, 400
+
+        batch_id = request.values.get('batch_id') or hashlib.sha256(content).hexdigest()[:16]
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", batch_id):
+            return {"error": "batch_id không hợp lệ"}, 400
+        status_url = url_for('batch_progress', batch_id=batch_id)
+        existing = batch_queue.get(batch_id)
+        if existing is not None and not existing.finished:
+            # Batch đang chờ / đang chạy (có thể ở worker khác) → không nhận thêm lần nữa
+            return {"batch_id": batch_id, "status_url": status_url, "job": existing.to_status_dict()}, 202
+
+        batch_dir = os.path.join(BATCH_DIR, batch_id)
+        os.makedirs(batch_dir, exist_ok=True)
+        input_path = os.path.join(batch_dir, "input.jsonl")
+        with open(input_path, "wb") as f:
+            f.write(content)
+
+        workers = request.values.get('workers', type=int)
+        batch_queue.submit({"input_path": input_path, "workers": workers}, job_id=batch_id)
+        return {"batch_id": batch_id, "status_url": status_url}, 202
+
+    except Exception as e:
+        print("Error in /batch:", str(e))
+        return {"error": "Lỗi tạo batch", "details": str(e)}, 500
+
+@app.route('/batch/<batch_id>')
+def batch_progress(batch_id):
+    status = batch_status(batch_id)
+    job = batch_queue.get(batch_id)
+    if status is None and job is None:
+        return {"error": "Không tìm thấy batch", "batch_id": batch_id}, 404
+    status = status or {"batch_id": batch_id}
+    if job is not None:
+        status["job"] = job.to_status_dict()
+    return status
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Chỉ dùng khi phát triển; production chạy `gunicorn -c gunicorn.conf.py wsgi:app`.
+    # Reloader tắt: nó chạy app.py hai lần (hai bộ worker nền, load model hai lần)
+    app.run(
+        debug=os.environ.get("FLASK_DEBUG", "1") == "1",
+        use_reloader=False,
+        port=int(os.environ.get("PORT", "5000"))
+    )
\ No newline at end of file
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+from graph_app.semantic_cache import request_scope
+from modules.rag_module.RetrievalMemo import RetrievalMemo, use_memo
+
+BATCH_DIR = os.environ.get("BATCH_DIR", "batches")
+
+
+def load_payloads(path: str) -> List[Dict[str, Any]]:
+    """Đọc file JSONL, mỗi dòng là một form payload giống /process (bỏ dòng trống)"""
+    payloads = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payloads.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Dòng {line_no} không phải JSON hợp lệ: {e}")
+    return payloads
+
+
+def payload_hash(payload: Dict[str, Any]) -> str:
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def lesson_key(index: int, payload: Dict[str, Any]) -> str:
+    """Tên checkpoint của một bài: id trong payload nếu có, ngược lại là số thứ tự"""
+    raw = str(payload.get("id") or payload.get("request_id") or f"{index:04d}")
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in raw)[:80]
+
+
+def _write_json(path: str, data: Any):
+    """Ghi atomic (file tạm + rename) để batch bị dừng giữa chừng không để lại file hỏng"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+class BatchRunner:
+    """
+    Chạy cả một file chương trình (nhiều bài) qua LangGraph flow:
+
+    - Dùng chung graph, model embedding và LLM pool của process
+    - Các bài cùng lớp/môn/bộ sách dùng chung một RetrievalMemo → subtopic và
+      vector search trùng nhau chỉ chạy một lần
+    - Mỗi bài xong được checkpoint ra `<output_dir>/<batch_id>/lessons/<key>.json`;
+      chạy lại cùng batch_id sẽ bỏ qua các bài đã thành công (resume)
+    - Báo cáo thông lượng (bài/phút) vào report.json
+    """
+
+    def __init__(self, batch_id: str, output_dir: str = BATCH_DIR, workers: int = 2,
+                 flow_runner: Callable[[Dict[str, Any], str], Dict[str, Any]] = None):
+        self.batch_id = batch_id
+        self.batch_dir = os.path.join(output_dir, batch_id)
+        self.lessons_dir = os.path.join(self.batch_dir, "lessons")
+        self.workers = max(1, int(workers))
+        self.flow_runner = flow_runner
+        self._memos: Dict[str, RetrievalMemo] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.lessons_dir, exist_ok=True)
+
+    def _memo_for(self, payload: Dict[str, Any]) -> RetrievalMemo:
+        scope = request_scope(payload)
+        with self._lock:
+            if scope not in self._memos:
+                self._memos[scope] = RetrievalMemo(scope)
+            return self._memos[scope]
+
+    def _checkpoint_path(self, key: str) -> str:
+        return os.path.join(self.lessons_dir, f"{key}.json")
+
+    def _is_done(self, key: str, digest: str) -> bool:
+        checkpoint = _read_json(self._checkpoint_path(key))
+        return bool(checkpoint) and checkpoint.get("status") == "succeeded" and checkpoint.get("payload_hash") == digest
+
+    def _run_flow(self, payload: Dict[str, Any], run_id: str) -> Dict[str, Any]:
+        if self.flow_runner is not None:
+            return self.flow_runner(payload, run_id)
+        from graph_app.flow import run_flow, clean_objectid
+        final_state = run_flow(payload, run_id=run_id) or {}
+        return clean_objectid(final_state.get("lesson_plan") or {})
+
+    def _run_lesson(self, index: int, key: str, payload: Dict[str, Any], digest: str) -> Dict[str, Any]:
+        run_id = f"{self.batch_id}-{key}"
+        record = {
+            "index": index, "key": key, "run_id": run_id, "payload_hash": digest,
+            "subject": request_scope(payload), "started_at": time.time(),
+        }
+        print(f"\n📚 [batch {self.batch_id}] Bài {index + 1}: {payload.get('topic') or key}")
+        try:
+            with use_memo(self._memo_for(payload)):
+                lesson_plan = self._run_flow(payload, run_id)
+            if lesson_plan.get("error"):
+                raise RuntimeError(lesson_plan["error"])
+            record.update(status="succeeded", lesson_plan=lesson_plan)
+        except Exception as e:
+            record.update(status="failed", error=str(e))
+            print(f"❌ [batch {self.batch_id}] Bài {key} lỗi: {e}")
+        record["finished_at"] = time.time()
+        record["duration"] = round(record["finished_at"] - record["started_at"], 3)
+        _write_json(self._checkpoint_path(key), record)
+        return record
+
+    def run(self, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+        start_time = time.time()
+        lessons = [(i, lesson_key(i, p), p, payload_hash(p)) for i, p in enumerate(payloads)]
+        keys = [key for _, key, _, _ in lessons]
+        if len(set(keys)) != len(keys):
+            raise ValueError("Trùng id bài học trong batch")
+
+        pending = [lesson for lesson in lessons if not self._is_done(lesson[1], lesson[3])]
+        resumed = len(lessons) - len(pending)
+        # Xếp các bài cùng môn liền nhau để memo được dùng lại sớm
+        pending.sort(key=lambda lesson: (request_scope(lesson[2]), lesson[0]))
+
+        _write_json(os.path.join(self.batch_dir, "manifest.json"), {
+            "batch_id": self.batch_id, "total": len(lessons), "keys": keys,
+            "started_at": start_time, "workers": self.workers,
+        })
+        print(f"\n🗂️ [batch {self.batch_id}] {len(lessons)} bài, {resumed} đã xong trước đó, "
+              f"{len(pending)} cần chạy ({self.workers} luồng)")
+
+        succeeded = failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch-lesson") as executor:
+            futures = [executor.submit(self._run_lesson, *lesson) for lesson in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                if record["status"] == "succeeded":
+                    succeeded += 1
+                else:
+                    failed += 1
+                done = succeeded + failed
+                elapsed = time.time() - start_time
+                print(f"📈 [batch {self.batch_id}] {done}/{len(pending)} bài "
+                      f"({done / elapsed * 60:.2f} bài/phút)")
+
+        elapsed = time.time() - start_time
+        report = {
+            "batch_id": self.batch_id,
+            "total": len(lessons),
+            "resumed": resumed,
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 3),
+            "lessons_per_minute": round(succeeded / elapsed * 60, 3) if elapsed > 0 else 0.0,
+            "memo": {scope: memo.stats() for scope, memo in self._memos.items()},
+            "finished_at": time.time(),
+        }
+        _write_json(os.path.join(self.batch_dir, "report.json"), report)
+        print(f"\n🏁 [batch {self.batch_id}] Xong: {succeeded} thành công, {failed} lỗi, "
+              f"{resumed} resume, {report['lessons_per_minute']} bài/phút")
+        return report
+
+
+def batch_status(batch_id: str, output_dir: str = BATCH_DIR) -> Optional[Dict[str, Any]]:
+    """Tiến độ batch đọc từ checkpoint trên đĩa (còn đúng cả sau khi restart process)"""
+    batch_dir = os.path.join(output_dir, batch_id)
+    manifest = _read_json(os.path.join(batch_dir, "manifest.json"))
+    if manifest is None:
+        return None
+
+    lessons = []
+    for key in manifest.get("keys", []):
+        checkpoint = _read_json(os.path.join(batch_dir, "lessons", f"{key}.json"))
+        status = checkpoint.get("status") if checkpoint else "pending"
+        lessons.append({
+            "key": key, "status": status,
+            "duration": checkpoint.get("duration") if checkpoint else None,
+            "error": checkpoint.get("error") if checkpoint else None,
+        })
+
+    return {
+        "batch_id": batch_id,
+        "total": manifest.get("total", len(lessons)),
+        "succeeded": sum(1 for lesson in lessons if lesson["status"] == "succeeded"),
+        "failed": sum(1 for lesson in lessons if lesson["status"] == "failed"),
+        "lessons": lessons,
+        "report": _read_json(os.path.join(batch_dir, "report.json")),
+    }
+
+
+def run_batch_job(payload: Dict[str, Any], job_id: str = "") -> Dict[str, Any]:
+    """Handler cho JobQueue: payload = {"input_path", "workers"}; job id = batch id"""
+    runner = BatchRunner(job_id, workers=payload.get("workers") or int(os.environ.get("BATCH_WORKERS", "2")))
+    return runner.run(load_payloads(payload["input_path"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sinh kế hoạch bài giảng cho cả một file JSONL các bài học")
+    parser.add_argument("input", help="File JSONL, mỗi dòng là một form payload")
+    parser.add_argument("--batch-id", help="Mặc định: hash nội dung file (chạy lại cùng file sẽ resume)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BATCH_WORKERS", "2")))
+    parser.add_argument("--output-dir", default=BATCH_DIR)
+    args = parser.parse_args()
+
+    with open(args.input, "rb") as f:
+        batch_id = args.batch_id or hashlib.sha256(f.read()).hexdigest()[:16]
+
+    report = BatchRunner(batch_id, output_dir=args.output_dir, workers=args.workers).run(load_payloads(args.input))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List
+
+from bson import ObjectId
+
+from utils.telemetry import record
+from modules.rag_module.UploadStore import file_sha256
+
+# Các trường của form không làm thay đổi kết quả (vd: thời điểm gửi form)
+VOLATILE_FIELDS = ("timestamp",)
+
+
+def _file_digest(path: str) -> str:
+    """Hash nội dung file tải lên (đường dẫn tạm thay đổi mỗi lần upload)"""
+    try:
+        return file_sha256(path)
+    except OSError:
+        return f"missing:{path}"
+
+
+def flow_key(form_data: dict, variant: str = "") -> str:
+    """Key content-addressed của một lần chạy: form (bỏ trường thay đổi) + nội dung file + biến thể graph"""
+    payload = {k: v for k, v in form_data.items() if k not in VOLATILE_FIELDS and k != "files"}
+    payload["files"] = sorted(_file_digest(path) for path in form_data.get("files") or [])
+    payload["__variant__"] = variant
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _json_default(obj: Any):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if hasattr(obj, "tolist"):  # numpy scalar / array
+        return obj.tolist()
+    raise TypeError(f"{type(obj).__name__} không serialize được")
+
+
+def _has_error(update: Any) -> bool:
+    """Node trả về kết quả lỗi (vd: lesson_plan.error) → không lưu để lần sau chạy lại"""
+    return isinstance(update, dict) and any(
+        isinstance(value, dict) and value.get("error") for value in update.values()
+    )
+
+
+class FlowCheckpointStore:
+    """
+    Checkpoint của FlowState sau từng node, lưu trong SQLite theo flow_key.
+    Chạy lại cùng form (retry sau lỗi hoặc gửi lại y hệt) sẽ phát lại update
+    của các node đã xong thay vì parse / embed / gọi LLM lại, và chạy tiếp
+    từ node đầu tiên chưa có checkpoint. Entry quá `ttl` giây bị xóa.
+    """
+
+    def __init__(self, db_path: str = "cache/flow_checkpoints.sqlite", ttl: float = 24 * 3600):
+        self.ttl = ttl
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS node_checkpoints (
+                flow_key TEXT NOT NULL,
+                node TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (flow_key, node)
+            )
+            """
+        )
+        self.hits = 0
+        self.misses = 0
+        self.prune()
+
+    def prune(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM node_checkpoints WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+        return cursor.rowcount
+
+    def load(self, key: str, node: str):
+        """Update đã lưu của node, None nếu chưa có / hết hạn"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, created_at FROM node_checkpoints WHERE flow_key = ? AND node = ?", (key, node)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def save(self, key: str, node: str, update: Any) -> bool:
+        try:
+            data = json.dumps(update if update is not None else {}, ensure_ascii=False, default=_json_default)
+        except (TypeError, ValueError) as e:
+            print(f"⚠️ Không checkpoint được node {node}: {e}")
+            return False
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO node_checkpoints (flow_key, node, payload, created_at) VALUES (?, ?, ?, ?)",
+                (key, node, zlib.compress(data.encode("utf-8")), time.time())
+            )
+        return True
+
+    def completed_nodes(self, key: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT node FROM node_checkpoints WHERE flow_key = ? AND created_at >= ? ORDER BY created_at",
+                (key, time.time() - self.ttl)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def clear(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM node_checkpoints WHERE flow_key = ?", (key,))
+
+    def wrap(self, name: str, node: Callable[[dict], dict]) -> Callable[[dict], dict]:
+        """Bọc node: có checkpoint → trả lại update đã lưu, chưa có → chạy node rồi lưu"""
+
+        def wrapped(state: dict):
+            key = state.get("checkpoint_key", "")
+            if not key:
+                return node(state)
+
+            saved = self.load(key, name)
+            if saved is not None:
+                self.hits += 1
+                record("cache", cache="checkpoint", hit=True)
+                print(f"\n♻️ [{name}] phát lại từ checkpoint")
+                return saved
+
+            self.misses += 1
+            record("cache", cache="checkpoint", hit=False)
+            update = node(state)
+            if not _has_error(update):
+                self.save(key, name, update)
+            return update
+
+        wrapped.__name__ = name
+        return wrapped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            flows, entries = self._conn.execute(
+                "SELECT COUNT(DISTINCT flow_key), COUNT(*) FROM node_checkpoints"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "flows": flows,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
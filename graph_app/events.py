@@ -0,0 +1,186 @@
+import time
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Sự kiện kết thúc một lần chạy flow → subscriber ngừng stream
+TERMINAL_EVENTS = ("run_finished", "run_failed")
+
+
+class _Channel:
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.condition = threading.Condition()
+        self.next_seq = 1
+        self.closed = False
+        self.updated_at = time.time()
+
+
+class EventBus:
+    """
+    Pub/sub trong tiến trình cho tiến độ từng lần chạy flow (theo run_id).
+    Mỗi kênh giữ lại lịch sử để client kết nối muộn (hoặc reconnect với
+    Last-Event-ID) vẫn nhận đủ sự kiện.
+    """
+
+    def __init__(self, history_limit: int = 5000, channel_ttl: float = 3600,
+                 idle_ttl: float = 6 * 3600, evict_interval: float = 60):
+        self.history_limit = history_limit
+        self.channel_ttl = channel_ttl
+        self.idle_ttl = idle_ttl
+        self.evict_interval = evict_interval
+        self._channels: Dict[str, _Channel] = {}
+        self._lock = threading.Lock()
+        self._last_evict = time.time()
+
+    def _get_channel(self, run_id: str) -> _Channel:
+        with self._lock:
+            channel = self._channels.get(run_id)
+            if channel is None:
+                channel = self._channels[run_id] = _Channel()
+            if time.time() - self._last_evict >= self.evict_interval:
+                self._evict_expired()
+            return channel
+
+    def _evict_expired(self):
+        """
+        Bỏ kênh đã kết thúc quá `channel_ttl` giây và kênh không có sự kiện mới quá
+        `idle_ttl` giây (run chết giữa chừng / kênh tạo bởi subscriber của run ở process khác)
+        """
+        now = time.time()
+        self._last_evict = now
+        expired = [
+            run_id for run_id, channel in self._channels.items()
+            if now - channel.updated_at > (self.channel_ttl if channel.closed else self.idle_ttl)
+        ]
+        for run_id in expired:
+            del self._channels[run_id]
+
+    def has_channel(self, run_id: str) -> bool:
+        """Run đã phát sự kiện trong process này (và kênh chưa bị dọn)"""
+        with self._lock:
+            return run_id in self._channels
+
+    def publish(self, run_id: str, event_type: str, **data) -> Optional[Dict[str, Any]]:
+        if not run_id:
+            return None
+
+        channel = self._get_channel(run_id)
+        with channel.condition:
+            event = {
+                "seq": channel.next_seq,
+                "type": event_type,
+                "ts": time.time(),
+                "data": data,
+            }
+            channel.next_seq += 1
+            channel.events.append(event)
+            if len(channel.events) > self.history_limit:
+                del channel.events[: len(channel.events) - self.history_limit]
+            if event_type in TERMINAL_EVENTS:
+                channel.closed = True
+            channel.updated_at = event["ts"]
+            channel.condition.notify_all()
+        return event
+
+    def subscribe(self, run_id: str, last_seq: int = 0, heartbeat: float = 15.0,
+                  poll: Callable[[], Optional[Dict[str, Any]]] = None) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Generator trả về các sự kiện có seq > last_seq theo thứ tự.
+        Yield None mỗi `heartbeat` giây khi không có gì mới (để giữ kết nối SSE).
+        Kết thúc sau khi đã gửi sự kiện kết thúc run.
+
+        `poll()` được gọi mỗi lần rảnh, dùng khi run có thể chạy ở process khác (sự
+        kiện không tới bus này): trả về {"type", "data"} để gửi thêm một sự kiện
+        (loại trong TERMINAL_EVENTS thì kết thúc stream), None nếu không có gì.
+        """
+        channel = self._get_channel(run_id)
+        while True:
+            with channel.condition:
+                pending = [e for e in channel.events if e["seq"] > last_seq]
+                if not pending and not channel.closed:
+                    channel.condition.wait(timeout=heartbeat)
+                    pending = [e for e in channel.events if e["seq"] > last_seq]
+                closed = channel.closed
+
+            if not pending:
+                if closed:
+                    return
+                polled = poll() if poll is not None else None
+                if polled is None:
+                    yield None
+                    continue
+                terminal = polled["type"] in TERMINAL_EVENTS
+                with channel.condition:
+                    # Run xong ngay trong process này giữa hai lần kiểm tra → gửi sự kiện thật
+                    if terminal and any(e["seq"] > last_seq for e in channel.events):
+                        continue
+                # Sự kiện tổng hợp không vào lịch sử kênh, giữ nguyên seq để Last-Event-ID vẫn đúng
+                yield {"seq": last_seq, "type": polled["type"], "ts": time.time(), "data": polled.get("data", {})}
+                if terminal:
+                    return
+                continue
+
+            for event in pending:
+                last_seq = event["seq"]
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+
+    def history(self, run_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            channel = self._channels.get(run_id)
+        if channel is None:
+            return []
+        with channel.condition:
+            return list(channel.events)
+
+
+event_bus = EventBus()
+
+
+def emit(run_id: str, event_type: str, **data):
+    """Gửi sự kiện lên bus dùng chung (bỏ qua nếu không có run_id)"""
+    return event_bus.publish(run_id, event_type, **data)
+
+
+def _summarize_update(update: Any) -> Dict[str, Any]:
+    """Tóm tắt output của node để gửi cho UI: text rút gọn, list chuỗi ngắn giữ nguyên, còn lại chỉ đếm"""
+    if not isinstance(update, dict):
+        return {}
+
+    summary = {}
+    for key, value in update.items():
+        if key.startswith("__"):
+            continue
+        if isinstance(value, str):
+            summary[key] = value[:500]
+        elif isinstance(value, list):
+            if len(value) <= 20 and all(isinstance(v, str) for v in value):
+                summary[key] = value
+            else:
+                summary[f"{key}_count"] = len(value)
+        elif isinstance(value, dict):
+            summary[f"{key}_keys"] = list(value.keys())[:20]
+    return summary
+
+
+def with_events(name: str, node: Callable[[dict], dict]) -> Callable[[dict], dict]:
+    """Bọc một node LangGraph: phát node_started / node_finished (kèm thời gian) / node_failed"""
+
+    def wrapped(state: dict):
+        run_id = state.get("run_id", "")
+        emit(run_id, "node_started", node=name)
+        start_time = time.time()
+        try:
+            update = node(state)
+        except Exception as e:
+            emit(run_id, "node_failed", node=name, error=str(e),
+                 duration=round(time.time() - start_time, 3))
+            raise
+        emit(run_id, "node_finished", node=name,
+             duration=round(time.time() - start_time, 3),
+             partial=_summarize_update(update))
+        return update
+
+    wrapped.__name__ = name
+    return wrapped
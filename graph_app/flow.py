@@ -6,28 +6,52 @@ sys.path.insert(0, project_root)
 
 import os
 import json
-import datetime
+import threading
+import contextvars
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from langgraph.graph import StateGraph, END
 from typing import TypedDict
 from bson import ObjectId
 from dotenv import load_dotenv
 
+from contextlib import nullcontext
 from utils.GPTClient import GPTClient
 from utils.GeminiClient import GeminiClient
+from utils.AsyncGPTClient import AsyncGPTClient
+from utils.AsyncGeminiClient import AsyncGeminiClient
+from utils.async_llm import llm_deadline
+from utils.LLMRouter import LLMRouter
+from utils.ArtifactWriter import ArtifactWriter
 from modules.agents.ChatAgent import ChatAgent
 from modules.agents.SubtopicGeneratorAgent import SubtopicGeneratorAgent
 from modules.rag_module.SemanticChunkFilter import SemanticChunkFilter
-from modules.rag_module.documents_processing.main_processor import EduMateDocumentProcessor
+from utils.ModelRegistry import LazySentenceTransformer, VIETNAMESE_SBERT, get_document_processor, get_shared, warm_up
 from modules.rag_module.data_chunking.processor import IntelligentVietnameseChunkingProcessor
 from modules.rag_module.data_embedding.embedding_processor import VietnameseEmbeddingProcessor
 from modules.rag_module.query_db.MongoDBClient import MongoDBClient
+from modules.rag_module.query_db.VectorStore import get_local_vector_store
 from modules.rag_module.DeepRetrieval import OptimizedDeepRetrieval, DeepRetrieval
-from modules.rag_module.SemanticChunkFilter import SemanticChunkFilter
+from modules.rag_module.RetrievalMemo import memoized
+from modules.rag_module.NearDuplicateDetector import dedupe_near_duplicates
+from modules.rag_module.UploadStore import UploadStore, file_sha256
 from modules.lesson_plan.LessonPlanPipeline import LessonPlanPipeline
+from graph_app.events import emit, with_events
+from graph_app.tracing import with_tracing, start_run, finish_run
+from graph_app.semantic_cache import SemanticFlowCache, REUSABLE_FIELDS
+from graph_app.speculation import Speculator
+from graph_app.checkpoints import FlowCheckpointStore, flow_key
 
 load_dotenv()
 
+# CHUNK_ARTIFACTS: off (mặc định) | msgpack | json — lưu chunks đã embedding vào output_chunks/ để debug
+_artifact_format = os.environ.get("CHUNK_ARTIFACTS", "off").lower()
+chunk_artifacts = ArtifactWriter(
+    output_dir=os.environ.get("CHUNK_ARTIFACTS_DIR", "output_chunks"),
+    fmt=_artifact_format
+) if _artifact_format in ("msgpack", "json") else None
+
 # ✅ Hàm lọc ObjectId
 def clean_objectid(obj):
     if isinstance(obj, dict):
@@ -41,6 +65,8 @@ def clean_objectid(obj):
 
 # ✅ 1. Khai báo trạng thái
 class FlowState(TypedDict):
+    run_id: str            # ✅ Dùng làm kênh sự kiện tiến độ (job id)
+    checkpoint_key: str    # ✅ Key content-addressed (form + file) của checkpoint từng node
     form_data: dict
     user_prompt: str
     subtopics: list
@@ -48,9 +74,12 @@ class FlowState(TypedDict):
     uploaded_chunks: list
     search_chunks: list
     all_chunks: list
+    merged_chunks: list    # ✅ Kết quả node gộp của biến thể song song (upload + DB + search)
+    coverage: dict         # ✅ Đánh giá coverage dùng để giữ / bỏ kết quả search ngoài
     embedded_chunks: list
     filtered_chunks: list  # ✅ THÊM
     lesson_plan: dict      # ✅ THÊM
+    cache_hit: dict        # ✅ Kết quả tra semantic cache (similarity, các trường tái sử dụng)
     output_path: str
     __skip__: bool
 
@@ -68,6 +97,40 @@ class PromptGenerator:
             "user_prompt": result
         }
     
+# ✅ 2b. Tra semantic cache: yêu cầu gần giống trước đó → tái sử dụng kết quả
+class SemanticCacheLookup:
+    def __init__(self, cache: SemanticFlowCache):
+        self.cache = cache
+
+    def __call__(self, state: FlowState):
+        form = state["form_data"]
+        # File đính kèm làm nội dung khác hẳn → không dùng cache
+        if self.cache is None or form.get("files"):
+            return {"cache_hit": {}}
+
+        hit = self.cache.lookup(state.get("user_prompt", ""), form)
+        if not hit:
+            print("\n🔎 Semantic cache: không có yêu cầu tương tự")
+            return {"cache_hit": {}}
+
+        reused = [field for field in REUSABLE_FIELDS if hit.get(field)]
+        print(f"\n♻️ Semantic cache hit (similarity={hit['similarity']:.3f}), tái sử dụng: {', '.join(reused)}")
+        print(f"   Prompt gốc: {hit['source_prompt']}")
+
+        if "lesson_plan" in reused or "filtered_chunks" in reused:
+            # Không cần retrieval nữa → hủy search / parse file đã chạy trước
+            speculation = current_speculation(state)
+            if speculation:
+                speculation.cancel()
+
+        update = {field: hit[field] for field in reused}
+        update["cache_hit"] = {
+            "similarity": hit["similarity"],
+            "source_prompt": hit["source_prompt"],
+            "reused": reused
+        }
+        return update
+
 # ✅ 3. Step: Sinh các subtopics từ prompt
 class SubtopicGenerator:
     def __init__(self, llm: GPTClient):
@@ -75,7 +138,7 @@ class SubtopicGenerator:
 
     def __call__(self, state: FlowState):
         prompt = state["user_prompt"]
-        subtopics = self.agent.run(prompt)
+        subtopics = memoized("subtopics", prompt, lambda: self.agent.run(prompt))
 
         print(f"\n📌 Đã sinh {len(subtopics)} subtopics:")
         for i, topic in enumerate(subtopics, 1):
@@ -85,13 +148,163 @@ class SubtopicGenerator:
 
 # ✅ 4. Step: Xử lý file người dùng
 class FileProcessor:
-    def __init__(self):
-        self.document_processor = EduMateDocumentProcessor.create_balanced()
+    # Flow tuần tự: có file thì không truy vấn DB → search chạy trước không còn cần
+    uploads_replace_search = True
+
+    def __init__(self, parse_workers: int = None, upload_store: UploadStore = None):
+        self.upload_store = upload_store
         self.chunking_processor = IntelligentVietnameseChunkingProcessor(
             output_dir="temp_langgraph_chunking",
             min_quality=0.65
         )
+        # Số file parse đồng thời (OCR / PDF nặng I/O + CPU)
+        self.parse_workers = parse_workers or int(os.environ.get("UPLOAD_PARSE_WORKERS", "4"))
         
+    @property
+    def document_processor(self):
+        # Dùng chung với DeepRetrieval, chỉ tạo khi có file cần xử lý
+        return get_document_processor()
+
+    def parse(self, file_path: str, sha: str = ""):
+        """Step 1: Document processing → ProcessingResult (None nếu lỗi); sha: digest đã tính sẵn"""
+        print(f"\n📂 Đang xử lý file: {file_path}")
+        try:
+            doc_result = self.document_processor.process_file(Path(file_path), sha256=sha or None)
+        except Exception as e:
+            print(f"⚠️ Failed to process {file_path}: {e}")
+            return None
+
+        if not doc_result.success:
+            print(f"Document processing failed: {doc_result.error_message}")
+            return None
+        return doc_result
+
+    def chunk(self, file_path: str, doc_result) -> list:
+        """Step 2 + 3: chunking nội dung đã parse → chunks chuẩn hóa ([] nếu lỗi)"""
+        if doc_result is None:
+            return []
+
+        standardized_chunks = []
+        try:
+            import tempfile
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False, encoding='utf-8') as temp_file:
+                temp_file.write(doc_result.content)
+                temp_md_path = temp_file.name
+            
+            # Step 2: Intelligent chunking
+            chunking_result = self.chunking_processor.run(
+                Path(temp_md_path),
+                strategy=None,
+                save_json=False,
+                print_report=False
+            )
+            
+            chunks_data = chunking_result['result']['chunking_results']['chunks_data']
+            
+            # Step 3: Convert to standardized format
+            for i, chunk_data in enumerate(chunks_data):
+                standardized_chunks.append({
+                    "chunk_id": f"{Path(file_path).stem}_chunk_{i+1:02d}",  # Thêm tên file vào chunk_id
+                    "content": chunk_data["content"],
+                    "token_count": chunk_data.get("word_count", 0),
+                    "method": chunk_data.get("chunking_strategy", "intelligent"),
+                    "source_file": file_path,
+                    "retrieved_from": "upload",
+                    "char_count": chunk_data.get("char_count", 0),
+                    "keywords": chunk_data.get("keywords", []),
+                    "coherence_score": chunk_data.get("semantic_coherence_score", 0.0),
+                    "completeness_score": chunk_data.get("completeness_score", 0.0),
+                    "language_confidence": chunk_data.get("language_confidence", 0.0)
+                })
+            
+            print(f"✅ Processed {file_path}: {len(chunks_data)} chunks created")
+            
+            # Cleanup temp file
+            try:
+                os.unlink(temp_md_path)
+            except:
+                pass
+                
+        except Exception as e:
+            print(f"⚠️ Failed to process {file_path}: {e}")
+            return []
+
+        return standardized_chunks
+
+    def digest(self, file_path: str) -> str:
+        try:
+            return file_sha256(file_path)
+        except OSError:
+            return ""
+
+    def _from_store(self, file_path: str, sha: str):
+        """Chunks của file trùng nội dung đã xử lý trước đó (None nếu chưa có)"""
+        if self.upload_store is None or not sha:
+            return None
+        chunks = self.upload_store.get_chunks(sha)
+        if chunks is None:
+            return None
+        print(f"\n♻️ {file_path}: dùng lại {len(chunks)} chunks (sha256 {sha[:12]}), bỏ qua parse + chunking")
+        return [{**chunk, "source_file": file_path, "content_sha256": sha} for chunk in chunks]
+
+    def _to_store(self, file_path: str, sha: str, doc_result, chunks: list) -> list:
+        if self.upload_store is not None and sha and doc_result is not None and chunks:
+            self.upload_store.put_parsed(sha, Path(file_path).name, doc_result.content, chunks)
+        return [{**chunk, "content_sha256": sha} for chunk in chunks] if sha else chunks
+
+    def process_one(self, file_path: str) -> list:
+        """Parse + chunk một file tải lên → chunks chuẩn hóa ([] nếu lỗi); speculation cũng gọi hàm này"""
+        sha = self.digest(file_path)
+        cached = self._from_store(file_path, sha)
+        if cached is not None:
+            return cached
+        doc_result = self.parse(file_path, sha)
+        return self._to_store(file_path, sha, doc_result, self.chunk(file_path, doc_result))
+
+    def process_many(self, files: list) -> dict:
+        """
+        Pipeline nhiều file: parse đồng thời (tối đa parse_workers), file nào parse
+        xong thì chunking ngay trong lúc các file khác vẫn đang parse → {file: chunks}.
+        File trùng nội dung (với lần trước hoặc trong cùng lần tải) chỉ xử lý một lần.
+        """
+        results = {}
+        pending = {}  # sha (hoặc path nếu không đọc được) → file đại diện
+        digests = {file_path: self.digest(file_path) for file_path in files}
+        for file_path in files:
+            sha = digests[file_path]
+            cached = self._from_store(file_path, sha)
+            if cached is not None:
+                results[file_path] = cached
+            else:
+                pending.setdefault(sha or file_path, file_path)
+
+        todo = list(pending.values())
+        if len(todo) <= 1 or self.parse_workers <= 1:
+            for file_path in todo:
+                doc_result = self.parse(file_path, digests[file_path])
+                results[file_path] = self._to_store(file_path, digests[file_path], doc_result,
+                                                    self.chunk(file_path, doc_result))
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.parse_workers, len(todo)),
+                                    thread_name_prefix="upload-parse") as executor:
+                futures = {
+                    executor.submit(contextvars.copy_context().run, self.parse, file_path,
+                                    digests[file_path]): file_path
+                    for file_path in todo
+                }
+                for future in as_completed(futures):
+                    file_path = futures[future]
+                    doc_result = future.result()
+                    results[file_path] = self._to_store(file_path, digests[file_path], doc_result,
+                                                        self.chunk(file_path, doc_result))
+
+        # Bản trùng trong cùng lần tải dùng lại kết quả của file đại diện
+        for file_path in files:
+            if file_path not in results:
+                source = pending[digests[file_path] or file_path]
+                results[file_path] = [{**chunk, "source_file": file_path} for chunk in results.get(source, [])]
+        return results
+
     def __call__(self, state: FlowState):
         form = state["form_data"]
         files = form.get("files", [])
@@ -99,68 +312,24 @@ class FileProcessor:
             print("\nKhông có file đính kèm. Sẽ gọi agent truy vấn sau...")
             return {"__skip__": True, "search_chunks": [], "db_chunks": [], "all_chunks": []}
 
-        all_standardized_chunks = []
-
+        # File đã được parse trước trong lúc sinh prompt / subtopics (speculation)
+        speculation = current_speculation(state)
+        parsed = {}
         for file_path in files:
-            print(f"\n📂 Đang xử lý file: {file_path}")
+            chunks, ok = speculation.take(f"upload:{file_path}") if speculation else (None, False)
+            if ok:
+                parsed[file_path] = chunks
+        parsed.update(self.process_many([f for f in files if f not in parsed]))
 
-            try:
-                file_path_obj = Path(file_path)
-                
-                # Step 1: Document processing
-                doc_result = self.document_processor.process_file(file_path_obj)
-                
-                if not doc_result.success:
-                    print(f"Document processing failed: {doc_result.error_message}")
-                    continue  # Bỏ qua file này và chuyển sang file tiếp theo
-
-                import tempfile
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False, encoding='utf-8') as temp_file:
-                    temp_file.write(doc_result.content)
-                    temp_md_path = temp_file.name
-                
-                # Step 2: Intelligent chunking
-                chunking_result = self.chunking_processor.run(
-                    Path(temp_md_path),
-                    strategy=None,
-                    save_json=False,
-                    print_report=False
-                )
-                
-                chunks_data = chunking_result['result']['chunking_results']['chunks_data']
-                
-                # Step 3: Convert to standardized format
-                for i, chunk_data in enumerate(chunks_data):
-                    all_standardized_chunks.append({
-                        "chunk_id": f"{Path(file_path).stem}_chunk_{i+1:02d}",  # Thêm tên file vào chunk_id
-                        "content": chunk_data["content"],
-                        "token_count": chunk_data.get("word_count", 0),
-                        "method": chunk_data.get("chunking_strategy", "intelligent"),
-                        "source_file": file_path,
-                        "retrieved_from": "upload",
-                        "char_count": chunk_data.get("char_count", 0),
-                        "keywords": chunk_data.get("keywords", []),
-                        "coherence_score": chunk_data.get("semantic_coherence_score", 0.0),
-                        "completeness_score": chunk_data.get("completeness_score", 0.0),
-                        "language_confidence": chunk_data.get("language_confidence", 0.0)
-                    })
-                
-                print(f"✅ Processed {file_path}: {len(chunks_data)} chunks created")
-                
-                # Cleanup temp file
-                try:
-                    import os
-                    os.unlink(temp_md_path)
-                except:
-                    pass
-                    
-            except Exception as e:
-                print(f"⚠️ Failed to process {file_path}: {e}")
-                continue  # Tiếp tục với file tiếp theo
+        # Giữ thứ tự file như người dùng tải lên
+        all_standardized_chunks = [chunk for file_path in files for chunk in parsed.get(file_path, [])]
         
         if not all_standardized_chunks:
             print("\n❌ Không có file nào được xử lý thành công")
             return {"__skip__": True, "search_chunks": [], "db_chunks": [], "all_chunks": []}
+
+        if speculation and self.uploads_replace_search:
+            speculation.cancel("search:")
             
         print(f"\n🎉 Tổng cộng đã xử lý: {len(all_standardized_chunks)} chunks từ {len(files)} files")
         
@@ -175,8 +344,8 @@ class FileProcessor:
 
 # ✅ 5. Nếu không có file → truy vấn DB + search ngoài
 class AgentBasedRetrieval:
-    def __init__(self):
-        self.retriever = OptimizedDeepRetrieval()
+    def __init__(self, llm=None, retriever: OptimizedDeepRetrieval = None):
+        self.retriever = retriever or OptimizedDeepRetrieval(llm_client=llm)
 
     def __call__(self, state: FlowState):
         print("🧠 [agent_retrieval] ĐÃ ĐƯỢC GỌI")
@@ -186,8 +355,9 @@ class AgentBasedRetrieval:
             print("\nThiếu prompt hoặc subtopics.")
             return {}
 
+        speculation = current_speculation(state)
         if hasattr(self, 'retriever'):
-            chunks = self.retriever.retrieve(prompt, subtopics)
+            chunks = self.retriever.retrieve(prompt, subtopics, speculation.take_searches() if speculation else None)
         else:
             chunks = DeepRetrieval(prompt, subtopics)
 
@@ -203,18 +373,98 @@ class AgentBasedRetrieval:
             "all_chunks": all_chunks
         }
 
+# ✅ 5b. Biến thể song song (FLOW_VARIANT=parallel): upload, DB và search ngoài chạy cùng lúc,
+# node gộp quyết định giữ kết quả search ngoài hay không → độ trễ = nhánh chậm nhất thay vì tổng
+class ParallelFileProcessor(FileProcessor):
+    uploads_replace_search = False
+
+    def __call__(self, state: FlowState):
+        # Chỉ ghi uploaded_chunks: các key khác do nhánh DB / search ghi trong cùng bước
+        update = super().__call__(state)
+        return {"uploaded_chunks": update.get("uploaded_chunks", [])}
+
+
+class DBRetrieval:
+    def __init__(self, retriever: OptimizedDeepRetrieval):
+        self.retriever = retriever
+
+    def __call__(self, state: FlowState):
+        subtopics = state.get("subtopics", [])
+        if not subtopics:
+            return {"db_chunks": []}
+        speculation = current_speculation(state)
+        return {"db_chunks": self.retriever.retrieve_db(subtopics, speculation.take_searches() if speculation else None)}
+
+
+class WebRetrieval:
+    def __init__(self, retriever: OptimizedDeepRetrieval):
+        self.retriever = retriever
+
+    def __call__(self, state: FlowState):
+        prompt = state.get("user_prompt", "")
+        subtopics = state.get("subtopics", [])
+        if not prompt or not subtopics:
+            return {"search_chunks": []}
+        return {"search_chunks": self.retriever.retrieve_external(prompt, subtopics)}
+
+
+class MergeRetrieval:
+    def __init__(self, retriever: OptimizedDeepRetrieval):
+        self.retriever = retriever
+
+    def __call__(self, state: FlowState):
+        result = self.retriever.merge_branches(
+            state.get("user_prompt", ""),
+            state.get("subtopics", []),
+            state.get("uploaded_chunks", []),
+            state.get("db_chunks", []),
+            state.get("search_chunks", [])
+        )
+        return {
+            "merged_chunks": result["chunks"],
+            "all_chunks": result["chunks"],
+            "search_chunks": result["search_chunks"],
+            "coverage": result["coverage"]
+        }
+
 # ✅ 6. Embedding + lưu CSDL (chỉ cho chunks search hoặc upload)
 class EmbedAndStoreUploaded:
+    def __init__(self, upload_store: UploadStore = None):
+        self.upload_store = upload_store
+
     def __call__(self, state: FlowState):
         chunks = state.get("uploaded_chunks", [])
         if not chunks:
             print("\n Không có chunks để embedding (uploaded).")
             return {}
 
+        # File đã embedding + lưu Mongo ở lần tải trước → không embedding / insert lại
+        if self.upload_store is not None:
+            embedded = {}
+            for chunk in chunks:
+                sha = chunk.get("content_sha256")
+                if sha and sha not in embedded:
+                    embedded[sha] = self.upload_store.embedding_ids(sha) is not None
+            new_chunks = [c for c in chunks if not embedded.get(c.get("content_sha256"))]
+            if len(new_chunks) < len(chunks):
+                print(f"\n♻️ Bỏ qua embedding {len(chunks) - len(new_chunks)} chunks đã có trong MongoDB")
+            chunks = new_chunks
+            if not chunks:
+                return {}
+
         file_path = state.get("source_file", "upload")
         source_name = os.path.basename(file_path)
 
-        return embed_and_store_chunks(chunks, source_name)
+        result = embed_and_store_chunks(chunks, source_name)
+
+        if self.upload_store is not None:
+            ids_by_file = {}
+            for chunk in result["embedded_chunks"]:
+                if chunk.get("content_sha256") and "_id" in chunk:
+                    ids_by_file.setdefault(chunk["content_sha256"], []).append(chunk["_id"])
+            for sha, ids in ids_by_file.items():
+                self.upload_store.set_embedding_ids(sha, ids)
+        return result
 
 
 class EmbedAndStoreSearched:
@@ -228,15 +478,20 @@ class EmbedAndStoreSearched:
 
 # ✅ Hỗ trợ: chia sẻ logic embedding & lưu
 def embed_and_store_chunks(chunks, source_files):
-    print("\n📄 Chunks:")
-    print(json.dumps(chunks[:3], ensure_ascii=False, indent=2))
-    if len(chunks) > 3:
-        print(f"... (còn {len(chunks) - 3} chunks nữa)\n")
+    # Không embedding / lưu Mongo các bản gần trùng trong cùng lượt (vd: cùng đoạn từ nhiều trang web)
+    unique_chunks = dedupe_near_duplicates(chunks)
+    if len(unique_chunks) < len(chunks):
+        print(f"\n🧹 Bỏ {len(chunks) - len(unique_chunks)} chunk gần trùng trước khi embedding")
+    chunks = unique_chunks
+    if not chunks:
+        return {"embedded_chunks": [], "output_path": ""}
+    print(f"\n📄 Embedding {len(chunks)} chunks ({source_files})")
 
     chunks_with_metadata = []
     for chunk in chunks:
-        if "metadata" not in chunk:
-            chunk["metadata"] = {}
+        # Bản sao: ở biến thể song song, filter_chunks đọc cùng các chunk này trong lúc embedding
+        chunk = dict(chunk)
+        chunk["metadata"] = dict(chunk.get("metadata") or {})
         
         # Thêm source file info vào metadata
         chunk["metadata"]["source_file"] = chunk.get("source_file", "unknown")
@@ -245,35 +500,20 @@ def embed_and_store_chunks(chunks, source_files):
         
         chunks_with_metadata.append(chunk)
 
-    os.makedirs("temp_embedding", exist_ok=True)
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    temp_path = os.path.join("temp_embedding", f"temp_chunks_{timestamp}.json")
-
-    with open(temp_path, "w", encoding="utf-8") as f:
-        json.dump(chunks_with_metadata, f, ensure_ascii=False, indent=2)
-
-    embedder = VietnameseEmbeddingProcessor()
-    result = embedder.run(temp_path, save_results=False)
+    # Embedding trực tiếp trong bộ nhớ (không ghi / đọc lại file JSON tạm)
+    embedder = get_shared("embedding_processor", VietnameseEmbeddingProcessor)
+    result = embedder.embed_chunks(chunks_with_metadata)
     embedded_chunks = result["chunks"]
 
-    try:
-        os.remove(temp_path)
-    except:
-        pass
-
     db = MongoDBClient()
     db.insert_many("lectures", embedded_chunks)
     print(f"\n✅ Đã lưu {len(embedded_chunks)} chunks vào MongoDB")
+    # Store local: thêm ngay (không chờ lượt sync định kỳ) để search trong process thấy chunk mới
+    if os.environ.get("VECTOR_STORE", "atlas").lower() == "local":
+        get_local_vector_store().add(embedded_chunks)
 
-    os.makedirs("output_chunks", exist_ok=True)
-    os.makedirs("output_chunks", exist_ok=True)
-    out_path = os.path.join("output_chunks", f"chunks_{timestamp}.json")
-
-    cleaned = clean_objectid(embedded_chunks)
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(cleaned, f, ensure_ascii=False, indent=2)
-
-    print(f"\n📦 Đã lưu vào: {out_path}")
+    # Artefact để debug: tùy chọn (CHUNK_ARTIFACTS), ghi ở luồng nền
+    out_path = chunk_artifacts.submit("chunks", embedded_chunks) if chunk_artifacts is not None else ""
     return {
         "embedded_chunks": embedded_chunks, 
         "output_path": out_path,
@@ -287,10 +527,14 @@ class FilterChunks:
     def __call__(self, state: FlowState):
         uploaded_chunks = state.get("uploaded_chunks", [])
         all_chunks = state.get("all_chunks", [])
+        merged_chunks = state.get("merged_chunks", [])
         subtopics = state.get("subtopics", [])
 
-        # Ưu tiên lọc uploaded nếu có
-        if uploaded_chunks:
+        # Biến thể song song: lọc trên kết quả đã gộp; còn lại ưu tiên lọc uploaded nếu có
+        if merged_chunks:
+            chunks = merged_chunks
+            print(f"\n🔀 Lọc {len(chunks)} merged (upload + db + search) chunks theo {len(subtopics)} subtopics...")
+        elif uploaded_chunks:
             chunks = uploaded_chunks
             print(f"\n📂 Lọc {len(chunks)} uploaded chunks theo {len(subtopics)} subtopics...")
         else:
@@ -305,8 +549,7 @@ class FilterChunks:
             print(f"\nℹ️ Chỉ có {len(chunks)} chunks — bỏ qua bước lọc semantic.")
             return {"filtered_chunks": chunks}
 
-        engine = SemanticChunkFilter()
-        filtered = engine.filter(chunks, subtopics)
+        filtered = self.engine.filter(chunks, subtopics)
 
         print(f"✅ Đã lọc còn {len(filtered)} chunks liên quan")
         return {"filtered_chunks": filtered}
@@ -315,19 +558,28 @@ class FilterChunks:
 class GenerateLessonPlan:
     def __init__(self, llm: GPTClient):
     # def __init__(self, llm: GeminiClient):
-        self.pipeline = LessonPlanPipeline(llm)
+        self.pipeline = LessonPlanPipeline(
+            llm,
+            max_concurrency=int(os.environ.get("LESSON_SECTION_CONCURRENCY", "4")),
+            section_timeout=float(os.environ.get("LESSON_SECTION_TIMEOUT", "120"))
+        )
         
     def __call__(self, state: FlowState):
         print("\n🎓 Bắt đầu tạo kế hoạch bài giảng...")
         
         prompt = state.get("user_prompt", "")
         filtered_chunks = state.get("filtered_chunks", [])
+        run_id = state.get("run_id", "")
         
         if not prompt:
             return {"lesson_plan": {"error": "Không có prompt để tạo bài giảng"}}
         
-        # Tạo kế hoạch bài giảng đầy đủ
-        lesson_plan = self.pipeline.create_full_lesson_plan(prompt, filtered_chunks)
+        # Tạo kế hoạch bài giảng đầy đủ (gửi outline / từng phần lên UI ngay khi xong)
+        lesson_plan = self.pipeline.create_full_lesson_plan(
+            prompt,
+            filtered_chunks,
+            progress_callback=lambda event, data: emit(run_id, event, **data)
+        )
         
         print(f"✅ Hoàn thành tạo kế hoạch bài giảng!")
         if "output_path" in lesson_plan:
@@ -335,74 +587,249 @@ class GenerateLessonPlan:
         
         return {"lesson_plan": lesson_plan}
 
+# ✅ 8. Lưu kết quả vào semantic cache cho các yêu cầu tương tự sau này
+class SemanticCacheStore:
+    def __init__(self, cache: SemanticFlowCache):
+        self.cache = cache
+
+    def __call__(self, state: FlowState):
+        form = state["form_data"]
+        lesson_plan = state.get("lesson_plan") or {}
+        if self.cache is None or form.get("files") or not lesson_plan or lesson_plan.get("error"):
+            return {}
+
+        self.cache.store(
+            state.get("user_prompt", ""),
+            form,
+            clean_objectid({field: state.get(field) for field in REUSABLE_FIELDS})
+        )
+        return {}
+
 # ✅ Điều kiện rẽ nhánh
 
+def route_after_cache(state: FlowState):
+    reused = (state.get("cache_hit") or {}).get("reused", [])
+    if "lesson_plan" in reused:
+        return "done"
+    if "filtered_chunks" in reused:
+        return "generate_lesson_plan"
+    if "subtopics" in reused:
+        return "process_file"
+    return "generate_subtopics"
+
 def should_call_agent(state: FlowState):
     return "agent_retrieval" if state.get("__skip__") else "embed_store_uploaded"
 
-llm = GPTClient(
+# Client async dùng chung connection pool + rate limiter cho mọi job trong process
+llm = AsyncGPTClient(
     api_key=os.environ.get("AZURE_API_KEY"),
     endpoint=os.environ.get("AZURE_ENDPOINT"),
     model=os.environ.get("AZURE_MODEL"),
     api_version=os.environ.get("AZURE_API_VERSION")
 )
 
-gemini_llm = GeminiClient(
+gemini_llm = AsyncGeminiClient(
     api_key=os.environ.get("GEMINI_API_KEY"),
     model="gemini-2.5-flash"
 )
 
-# ✅ Build LangGraph
-builder = StateGraph(FlowState)
-builder.add_node("generate_prompt", PromptGenerator(llm))
-builder.add_node("generate_subtopics", SubtopicGenerator(llm))
-builder.add_node("process_file", FileProcessor())
-builder.add_node("agent_retrieval", AgentBasedRetrieval())
-builder.add_node("embed_store_uploaded", EmbedAndStoreUploaded())
-builder.add_node("embed_store_searched", EmbedAndStoreSearched())
-builder.add_node("filter_chunks", FilterChunks())
-builder.add_node("generate_lesson_plan", GenerateLessonPlan(llm))
-# builder.add_node("generate_lesson_plan", GenerateLessonPlan(gemini_llm))
-
-builder.set_entry_point("generate_prompt")
-builder.add_edge("generate_prompt", "generate_subtopics")
-builder.add_edge("generate_subtopics", "process_file")
-builder.add_conditional_edges("process_file", should_call_agent, {
-    "embed_store_uploaded": "embed_store_uploaded",
-    "agent_retrieval": "agent_retrieval"
-})
-builder.add_edge("agent_retrieval", "embed_store_searched")
-builder.add_edge("embed_store_uploaded", "filter_chunks")
-builder.add_edge("embed_store_searched", "filter_chunks")
-builder.add_edge("filter_chunks", "generate_lesson_plan")  # ✅ SỬA
-builder.add_edge("generate_lesson_plan", END)              # ✅ THÊM
-
-
-graph = builder.compile()
-
-def run_flow(form_data: dict):
-    graph.invoke({"form_data": form_data})
-
-
-try:
-    graph.get_graph().draw_png("langgraph_flow.png")
-    print("Đã tạo sơ đồ flow tại: langgraph_flow.png")
-except Exception as e:
-    print(f"Không thể tạo sơ đồ trực tiếp (lỗi: {e}). Đảm bảo bạn đã cài đặt 'pygraphviz' hoặc 'pydot' và 'graphviz'.")
-    print("\nĐang thử xuất cấu trúc đồ thị sang định dạng JSON để bạn có thể trực quan hóa thủ công.")
+# LLM_PROVIDER: azure (mặc định) | gemini | router
+# router chọn provider nhanh + khỏe nhất theo từng agent; LLM_ROUTER_HEDGE=1 để hedge
+# request chậm sang provider còn lại (tốn thêm token)
+llm_provider = os.environ.get("LLM_PROVIDER", "azure").lower()
+if llm_provider == "router":
+    llm = LLMRouter(
+        {"azure": llm, "gemini": gemini_llm},
+        latency_budget=float(os.environ.get("LLM_ROUTER_LATENCY_BUDGET", "20")),
+        hedge=os.environ.get("LLM_ROUTER_HEDGE", "0") == "1",
+        error_threshold=float(os.environ.get("LLM_ROUTER_ERROR_THRESHOLD", "0.5")),
+        cooldown=float(os.environ.get("LLM_ROUTER_COOLDOWN", "60"))
+    )
+elif llm_provider == "gemini":
+    llm = gemini_llm
+
+# FLOW_VARIANT: sequential (mặc định) | parallel
+# parallel luôn chạy search ngoài song song với DB (tốn thêm lượt search khi DB đã đủ) để giảm độ trễ
+FLOW_VARIANT = os.environ.get("FLOW_VARIANT", "sequential").lower()
+
+# ✅ Build LangGraph (lazy: chỉ build khi chạy flow lần đầu, model chỉ load khi node cần)
+_graph = None
+_graph_lock = threading.Lock()
+semantic_cache = None
+speculator = None
+checkpoints = None
+upload_store = None
+
+def current_speculation(state: FlowState):
+    """Các việc chạy trước của run hiện tại (None nếu tắt FLOW_SPECULATION)"""
+    return speculator.get(state.get("run_id", "")) if speculator is not None else None
+
+def build_graph():
+    global semantic_cache, speculator, checkpoints, upload_store
+    builder = StateGraph(FlowState)
+
+    # Checkpoint FlowState sau từng node: retry / gửi lại cùng form chạy tiếp từ node chưa xong
+    if os.environ.get("FLOW_CHECKPOINTS", "1") != "0":
+        checkpoints = FlowCheckpointStore(
+            db_path=os.environ.get("FLOW_CHECKPOINT_PATH", "cache/flow_checkpoints.sqlite"),
+            ttl=float(os.environ.get("FLOW_CHECKPOINT_TTL", str(24 * 3600)))
+        )
+
+    def add_node(name: str, node):
+        """Thêm node vào graph, kèm sự kiện tiến độ (node_started / node_finished), tracing (thời gian, token, cache) và checkpoint"""
+        if checkpoints is not None:
+            node = checkpoints.wrap(name, node)
+        builder.add_node(name, with_events(name, with_tracing(name, node)))
+
+    # Semantic cache dùng chung model vietnamese-sbert với bước lọc chunk (qua registry)
+    if os.environ.get("SEMANTIC_CACHE_ENABLED", "1") != "0":
+        semantic_cache = SemanticFlowCache(
+            LazySentenceTransformer(VIETNAMESE_SBERT),
+            db_path=os.environ.get("SEMANTIC_CACHE_PATH", "cache/semantic_flow_cache.sqlite"),
+            threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+            plan_threshold=float(os.environ.get("SEMANTIC_CACHE_PLAN_THRESHOLD", "0.97")),
+            ttl=float(os.environ.get("SEMANTIC_CACHE_TTL", str(3 * 24 * 3600))),
+            max_entries=int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+        )
+
+    add_node("generate_prompt", PromptGenerator(llm))
+    add_node("semantic_cache_lookup", SemanticCacheLookup(semantic_cache))
+    add_node("generate_subtopics", SubtopicGenerator(llm))
+    retriever = OptimizedDeepRetrieval(llm_client=llm)
+    # File trùng nội dung (SHA-256) với lần tải trước → bỏ qua parse, chunking và embedding
+    if os.environ.get("UPLOAD_STORE_ENABLED", "1") != "0":
+        upload_store = UploadStore(os.environ.get("UPLOAD_STORE_PATH", "cache/upload_store.sqlite"))
+    file_processor = (ParallelFileProcessor if FLOW_VARIANT == "parallel" else FileProcessor)(upload_store=upload_store)
+    add_node("process_file", file_processor)
+    if FLOW_VARIANT == "parallel":
+        add_node("start_retrieval", lambda state: {})
+        add_node("db_retrieval", DBRetrieval(retriever))
+        add_node("web_retrieval", WebRetrieval(retriever))
+        add_node("merge_retrieval", MergeRetrieval(retriever))
+    else:
+        add_node("agent_retrieval", AgentBasedRetrieval(llm, retriever=retriever))
+
+    # Search theo chủ đề + parse file chạy trước trong lúc generate_prompt / generate_subtopics gọi LLM
+    if os.environ.get("FLOW_SPECULATION", "1") != "0":
+        searcher = retriever.vector_searcher
+        speculator = Speculator(
+            search=lambda query: memoized("db_search", query, lambda: searcher.search(query)),
+            parse_file=file_processor.process_one
+        )
+    add_node("embed_store_uploaded", EmbedAndStoreUploaded(upload_store))
+    add_node("embed_store_searched", EmbedAndStoreSearched())
+    add_node("filter_chunks", FilterChunks())
+    add_node("generate_lesson_plan", GenerateLessonPlan(llm))
+    # add_node("generate_lesson_plan", GenerateLessonPlan(gemini_llm))
+    add_node("semantic_cache_store", SemanticCacheStore(semantic_cache))
+
+    builder.set_entry_point("generate_prompt")
+    builder.add_edge("generate_prompt", "semantic_cache_lookup")
+    retrieval_entry = "start_retrieval" if FLOW_VARIANT == "parallel" else "process_file"
+    builder.add_conditional_edges("semantic_cache_lookup", route_after_cache, {
+        "generate_subtopics": "generate_subtopics",
+        "process_file": retrieval_entry,
+        "generate_lesson_plan": "generate_lesson_plan",
+        "done": END
+    })
+    builder.add_edge("generate_subtopics", retrieval_entry)
+    if FLOW_VARIANT == "parallel":
+        # Fan-out 3 nhánh, join tại merge_retrieval; embedding chạy song song với bước lọc
+        for branch in ("process_file", "db_retrieval", "web_retrieval"):
+            builder.add_edge("start_retrieval", branch)
+        builder.add_edge(["process_file", "db_retrieval", "web_retrieval"], "merge_retrieval")
+        builder.add_edge("merge_retrieval", "embed_store_uploaded")
+        builder.add_edge("embed_store_uploaded", "embed_store_searched")
+        builder.add_edge("merge_retrieval", "filter_chunks")
+        builder.add_edge(["embed_store_searched", "filter_chunks"], "generate_lesson_plan")
+    else:
+        builder.add_conditional_edges("process_file", should_call_agent, {
+            "embed_store_uploaded": "embed_store_uploaded",
+            "agent_retrieval": "agent_retrieval"
+        })
+        builder.add_edge("agent_retrieval", "embed_store_searched")
+        builder.add_edge("embed_store_uploaded", "filter_chunks")
+        builder.add_edge("embed_store_searched", "filter_chunks")
+        builder.add_edge("filter_chunks", "generate_lesson_plan")  # ✅ SỬA
+    builder.add_edge("generate_lesson_plan", "semantic_cache_store")
+    builder.add_edge("semantic_cache_store", END)
+
+    return builder.compile()
+
+def get_graph():
+    """Graph đã compile, dùng chung cho cả process (thread-safe)"""
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = build_graph()
+    return _graph
+
+def warm_up_flow(models=None) -> dict:
+    """Build graph + load trước model (MODEL_WARMUP) khi worker khởi động"""
+    get_graph()
+    return warm_up(models)
+
+def run_flow(form_data: dict, run_id: str = "") -> dict:
+    run_id = run_id or uuid.uuid4().hex
+    start_run(run_id)
+    emit(run_id, "run_started")
+    graph = get_graph()
+    checkpoint_key = flow_key(form_data, FLOW_VARIANT) if checkpoints is not None else ""
+    resumed = checkpoints.completed_nodes(checkpoint_key) if checkpoint_key else []
+    if resumed:
+        print(f"\n♻️ Resume từ checkpoint: {len(resumed)} node đã xong ({', '.join(resumed)})")
+        emit(run_id, "run_resumed", nodes=resumed)
+    # Deadline cho toàn bộ lời gọi LLM của một lần chạy (FLOW_DEADLINE_SECONDS, 0 = không giới hạn)
+    deadline_seconds = float(os.environ.get("FLOW_DEADLINE_SECONDS", "0"))
+    try:
+        with llm_deadline(deadline_seconds) if deadline_seconds > 0 else nullcontext():
+            # Resume thì các bước đầu được phát lại ngay → không cần chạy trước
+            if speculator is not None and not resumed:
+                speculator.start(run_id, form_data)
+            final_state = graph.invoke({"form_data": form_data, "run_id": run_id, "checkpoint_key": checkpoint_key})
+    except Exception as e:
+        finish_run(run_id, status="failed")
+        emit(run_id, "run_failed", error=str(e))
+        raise
+    finally:
+        if speculator is not None:
+            speculator.finish(run_id)
+
+    lesson_plan = final_state.get("lesson_plan") or {}
+    finish_run(run_id, status="failed" if lesson_plan.get("error") else "succeeded")
+    emit(run_id, "run_finished",
+         output_path=lesson_plan.get("output_path", ""),
+         markdown_path=lesson_plan.get("markdown_path", ""),
+         error=lesson_plan.get("error", ""))
+    return final_state
+
+
+def export_graph_diagram(png_path: str = "langgraph_flow.png", json_path: str = "langgraph_flow.json"):
+    """Xuất sơ đồ flow (PNG nếu có graphviz, ngược lại JSON / DOT) — chỉ chạy khi được gọi"""
+    graph = get_graph()
     try:
-        graph_json = graph.get_graph().to_json()
-        output_json_path = "langgraph_flow.json"
-        with open(output_json_path, "w", encoding="utf-8") as f:
-            json.dump(graph_json, f, ensure_ascii=False, indent=2)
-        print(f"✅ Đã xuất cấu trúc đồ thị thành công sang: {output_json_path}")
-        print("   Bạn có thể dùng các công cụ trực tuyến như 'Mermaid Live Editor' (https://mermaid.live/)")
-        print("   hoặc 'GraphvizOnline' (https://dreampuf.github.io/GraphvizOnline/) để dán nội dung JSON và xem.")
-    except Exception as json_e:
-        print(f"Không thể xuất đồ thị sang JSON: {json_e}")
-        print("\nDưới đây là định dạng DOT của đồ thị (có thể không đầy đủ nếu có lỗi):")
-        # Fallback cuối cùng là in ra DOT nếu mọi thứ khác thất bại
+        graph.get_graph().draw_png(png_path)
+        print(f"Đã tạo sơ đồ flow tại: {png_path}")
+    except Exception as e:
+        print(f"Không thể tạo sơ đồ trực tiếp (lỗi: {e}). Đảm bảo bạn đã cài đặt 'pygraphviz' hoặc 'pydot' và 'graphviz'.")
+        print("\nĐang thử xuất cấu trúc đồ thị sang định dạng JSON để bạn có thể trực quan hóa thủ công.")
         try:
-            print(graph.get_graph().get_graph().to_string())
-        except Exception as dot_e:
-            print(f"Không thể lấy chuỗi DOT: {dot_e}")
\ No newline at end of file
+            graph_json = graph.get_graph().to_json()
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(graph_json, f, ensure_ascii=False, indent=2)
+            print(f"✅ Đã xuất cấu trúc đồ thị thành công sang: {json_path}")
+            print("   Bạn có thể dùng các công cụ trực tuyến như 'Mermaid Live Editor' (https://mermaid.live/)")
+            print("   hoặc 'GraphvizOnline' (https://dreampuf.github.io/GraphvizOnline/) để dán nội dung JSON và xem.")
+        except Exception as json_e:
+            print(f"Không thể xuất đồ thị sang JSON: {json_e}")
+            print("\nDưới đây là định dạng DOT của đồ thị (có thể không đầy đủ nếu có lỗi):")
+            # Fallback cuối cùng là in ra DOT nếu mọi thứ khác thất bại
+            try:
+                print(graph.get_graph().get_graph().to_string())
+            except Exception as dot_e:
+                print(f"Không thể lấy chuỗi DOT: {dot_e}")
+
+
+if __name__ == "__main__":
+    export_graph_diagram()
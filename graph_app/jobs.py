@@ -0,0 +1,443 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import logging
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field, asdict
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+# Job RUNNING không có heartbeat quá JOB_LEASE_SECONDS coi như worker đã chết (SQLite backend)
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "2"))
+
+
+@dataclass
+class Job:
+    id: str
+    payload: Dict[str, Any]
+    status: str = JOB_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_status_dict(self) -> Dict[str, Any]:
+        """Trạng thái job, không kèm payload/result (dùng cho /jobs/<id>)"""
+        data = asdict(self)
+        data.pop("payload", None)
+        data.pop("result", None)
+        data["finished"] = self.finished
+        return data
+
+
+class JobBackend(ABC):
+    """Nơi lưu job + hàng đợi. Worker chỉ nói chuyện với backend qua interface này."""
+
+    @abstractmethod
+    def put(self, job: Job) -> None:
+        ...
+
+    @abstractmethod
+    def claim(self, timeout: float = 1.0) -> Optional[Job]:
+        """Lấy job tiếp theo đang chờ và đánh dấu RUNNING (None nếu hết timeout)"""
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    def heartbeat(self, job_ids: List[str]) -> None:
+        """Báo các job đang chạy vẫn còn sống (backend không có lease thì bỏ qua)"""
+
+
+class InMemoryJobBackend(JobBackend):
+    """
+    Backend trong tiến trình: queue.Queue + dict, chỉ dùng cho 1 process.
+    Job đã xong được giữ tối đa `finished_ttl` giây và `max_finished` job (cũ nhất bị bỏ trước).
+    """
+
+    def __init__(self, max_finished: int = 1000, finished_ttl: float = 3600):
+        self._queue = queue.Queue()
+        self._jobs: Dict[str, Job] = {}
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        self._lock = threading.Lock()
+
+    def _evict_finished(self):
+        now = time.time()
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if len(self._finished) <= self.max_finished and now - finished_at <= self.finished_ttl:
+                break
+            del self._finished[job_id]
+            self._jobs.pop(job_id, None)
+
+    def put(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            self._finished.pop(job.id, None)
+            self._evict_finished()
+        self._queue.put(job.id)
+
+    def claim(self, timeout: float = 1.0) -> Optional[Job]:
+        try:
+            job_id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            job.attempts += 1
+            return job
+
+    def update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            for key, value in fields.items():
+                setattr(job, key, value)
+            if job.finished:
+                self._finished[job_id] = job.finished_at or time.time()
+                self._finished.move_to_end(job_id)
+                self._evict_finished()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+class SQLiteJobBackend(JobBackend):
+    """
+    Backend dùng file SQLite, chia sẻ được giữa nhiều process trên cùng máy
+    (web workers chỉ enqueue, `python -m graph_app.jobs` chạy worker riêng).
+
+    Job RUNNING giữ lease: worker cập nhật heartbeat_at định kỳ; quá `lease` giây
+    không có heartbeat (process chết / bị kill giữa chừng) thì job được đưa lại
+    hàng đợi, hoặc đánh dấu FAILED nếu đã chạy `max_attempts` lần.
+    Job đã xong quá `finished_ttl` giây bị xóa.
+    """
+
+    def __init__(self, db_path: str = "jobs/jobs.sqlite", poll_interval: float = 0.5,
+                 lease: float = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 finished_ttl: float = 7 * 24 * 3600):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.finished_ttl = finished_ttl
+        self._last_reap = 0.0
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT,
+                    heartbeat_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            # File job tạo trước khi có lease
+            if "heartbeat_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+            if "attempts" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            payload=json.loads(row["payload"]),
+            status=row["status"],
+            created_at=row["created_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"],
+            result=json.loads(row["result"]) if row["result"] is not None else None,
+            error=row["error"],
+            attempts=row["attempts"],
+        )
+
+    def put(self, job: Job) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                # Cùng id (vd: gửi lại batch đã xong để resume) → chạy lại từ đầu
+                "INSERT OR REPLACE INTO jobs (id, payload, status, created_at) VALUES (?, ?, ?, ?)",
+                (job.id, json.dumps(job.payload, ensure_ascii=False), job.status, job.created_at),
+            )
+
+    def claim(self, timeout: float = 1.0) -> Optional[Job]:
+        deadline = time.time() + timeout
+        while True:
+            conn = self._connect()
+            try:
+                # BEGIN IMMEDIATE khóa ghi → hai worker không thể nhận cùng một job
+                conn.execute("BEGIN IMMEDIATE")
+                self._reap(conn)
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (JOB_QUEUED,),
+                ).fetchone()
+                if row is not None:
+                    started_at = time.time()
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1 "
+                        "WHERE id = ?",
+                        (JOB_RUNNING, started_at, started_at, row["id"]),
+                    )
+                    conn.execute("COMMIT")
+                    job = self._row_to_job(row)
+                    job.status = JOB_RUNNING
+                    job.started_at = started_at
+                    job.attempts += 1
+                    return job
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+
+            if time.time() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def _reap(self, conn: sqlite3.Connection):
+        """
+        Trong transaction của claim(): job RUNNING hết lease → đưa lại hàng đợi (hoặc FAILED
+        khi đã hết số lần thử); job đã xong quá finished_ttl → xóa. Chạy tối đa mỗi poll_interval
+        """
+        now = time.time()
+        if now - self._last_reap < max(self.poll_interval, 1.0):
+            return
+        self._last_reap = now
+        expired = now - self.lease
+        failed = conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = ? "
+            "WHERE status = ? AND COALESCE(heartbeat_at, started_at, 0) < ? AND attempts >= ?",
+            (JOB_FAILED, now, f"Worker mất kết nối (không có heartbeat {self.lease:.0f}s)",
+             JOB_RUNNING, expired, self.max_attempts),
+        ).rowcount
+        requeued = conn.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL, heartbeat_at = NULL "
+            "WHERE status = ? AND COALESCE(heartbeat_at, started_at, 0) < ?",
+            (JOB_QUEUED, JOB_RUNNING, expired),
+        ).rowcount
+        if failed or requeued:
+            logger.warning(f"SQLiteJobBackend: {requeued} job hết lease được chạy lại, {failed} job bị đánh dấu lỗi")
+        if self.finished_ttl:
+            conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+                (*FINISHED_STATUSES, now - self.finished_ttl),
+            )
+
+    def heartbeat(self, job_ids: List[str]) -> None:
+        if not job_ids:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?",
+                [(time.time(), job_id, JOB_RUNNING) for job_id in job_ids],
+            )
+
+    def update(self, job_id: str, **fields) -> None:
+        if not fields:
+            return
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+
+def create_job_backend(kind: str = None, db_path: str = None) -> JobBackend:
+    """Chọn backend theo JOB_BACKEND=memory|sqlite (file mặc định JOB_DB_PATH)"""
+    kind = (kind or os.environ.get("JOB_BACKEND", "memory")).lower()
+    if kind == "memory":
+        return InMemoryJobBackend()
+    if kind == "sqlite":
+        return SQLiteJobBackend(db_path or os.environ.get("JOB_DB_PATH", "jobs/jobs.sqlite"))
+    raise ValueError(f"Unknown JOB_BACKEND: {kind}")
+
+
+class JobQueue:
+    """Pool worker nền chạy `handler(payload, job_id)` cho từng job lấy từ backend"""
+
+    def __init__(self, handler: Callable[[Dict[str, Any], str], Any],
+                 backend: JobBackend = None, num_workers: int = 2, heartbeat_interval: float = None):
+        self.handler = handler
+        self.backend = backend or InMemoryJobBackend()
+        self.num_workers = num_workers
+        # Mặc định 1/4 lease của backend: lỡ vài nhịp heartbeat vẫn chưa bị coi là chết
+        self.heartbeat_interval = heartbeat_interval or getattr(self.backend, "lease", JOB_LEASE_SECONDS) / 4
+        self._workers: List[threading.Thread] = []
+        self._running: set = set()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> "JobQueue":
+        with self._lock:
+            if self._workers:
+                return self
+            self._stop.clear()
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+            heartbeat.start()
+        logger.info(f"JobQueue started with {self.num_workers} workers")
+        return self
+
+    def submit(self, payload: Dict[str, Any], job_id: str = None) -> str:
+        job = Job(id=job_id or uuid.uuid4().hex, payload=payload)
+        self.backend.put(job)
+        return job.id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.backend.get(job_id)
+
+    def shutdown(self, wait: bool = True, timeout: float = None):
+        """Dừng nhận job mới; nếu wait=True thì chờ các job đang chạy xong"""
+        self._stop.set()
+        if wait:
+            deadline = time.time() + timeout if timeout is not None else None
+            for worker in self._workers:
+                remaining = None if deadline is None else max(0.0, deadline - time.time())
+                worker.join(remaining)
+        self._workers = []
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            job = self.backend.claim(timeout=1.0)
+            if job is None:
+                continue
+            with self._lock:
+                self._running.add(job.id)
+            try:
+                self._run_job(job)
+            finally:
+                with self._lock:
+                    self._running.discard(job.id)
+
+    def _heartbeat_loop(self):
+        # Chạy cả khi đang shutdown(wait=True): job đang chạy vẫn giữ lease tới khi xong
+        while True:
+            with self._lock:
+                running = list(self._running)
+                if self._stop.is_set() and not running and not any(w.is_alive() for w in self._workers):
+                    return
+            try:
+                self.backend.heartbeat(running)
+            except Exception as e:
+                logger.warning(f"Job heartbeat failed: {e}")
+            time.sleep(self.heartbeat_interval)
+
+    def _run_job(self, job: Job):
+        print(f"\n🚚 [job {job.id}] Bắt đầu xử lý")
+        try:
+            result = self.handler(job.payload, job.id)
+            self.backend.update(job.id, status=JOB_SUCCEEDED, result=result, finished_at=time.time())
+            print(f"✅ [job {job.id}] Hoàn thành")
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            self.backend.update(job.id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+            print(f"❌ [job {job.id}] Lỗi: {e}")
+
+
+def run_flow_job(payload: Dict[str, Any], job_id: str = "") -> Dict[str, Any]:
+    """Handler mặc định: chạy LangGraph flow và trả về kế hoạch bài giảng (job id = run id của sự kiện)"""
+    from graph_app.flow import run_flow, clean_objectid
+    from utils.uploads import release_uploads, sweep_stale_uploads
+
+    try:
+        final_state = run_flow(payload, run_id=job_id) or {}
+    finally:
+        # File upload chỉ cần trong lúc chạy (nội dung đã nằm trong UploadStore)
+        release_uploads(job_id)
+        sweep_stale_uploads()
+    return clean_objectid(final_state.get("lesson_plan") or {})
+
+
+def warm_up_in_background() -> Optional[threading.Thread]:
+    """Nếu đặt MODEL_WARMUP: build graph + load model ở luồng nền ngay khi worker khởi động"""
+    if not os.environ.get("MODEL_WARMUP", "").strip():
+        return None
+
+    def run():
+        from graph_app.flow import warm_up_flow
+        loaded = warm_up_flow()
+        print(f"🔥 Warm-up xong: {', '.join(loaded) or 'không có model'}")
+
+    thread = threading.Thread(target=run, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy worker xử lý job từ SQLite backend")
+    parser.add_argument("--db", default=os.environ.get("JOB_DB_PATH", "jobs/jobs.sqlite"))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("JOB_WORKERS", "2")))
+    args = parser.parse_args()
+
+    warm_up_in_background()
+    job_queue = JobQueue(run_flow_job, SQLiteJobBackend(args.db), num_workers=args.workers).start()
+    print(f"👷 {args.workers} worker đang chờ job tại {args.db} (Ctrl+C để dừng)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\n⏹️ Đang dừng, chờ các job đang chạy hoàn thành...")
+        job_queue.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils.telemetry import record
+
+# Các trường của FlowState có thể tái sử dụng, theo thứ tự ưu tiên (bỏ qua nhiều bước nhất trước)
+REUSABLE_FIELDS = ("lesson_plan", "filtered_chunks", "subtopics")
+
+
+def _normalize(text: Any) -> str:
+    return " ".join(str(text or "").lower().split())
+
+
+def request_scope(form_data: dict) -> str:
+    """Chỉ so sánh các yêu cầu cùng lớp / môn / bộ sách"""
+    return "|".join(_normalize(form_data.get(k)) for k in ("grade", "subject", "textbook"))
+
+
+def plan_signature(form_data: dict) -> str:
+    """Những trường làm thay đổi kế hoạch bài giảng dù prompt gần giống nhau"""
+    content_types = sorted(_normalize(c) for c in form_data.get("content_types", []) or [])
+    return "|".join([_normalize(form_data.get("duration")), ",".join(content_types)])
+
+
+class _LSHIndex:
+    """
+    ANN index cho vector đã chuẩn hóa: random-hyperplane LSH (nhiều bảng),
+    lấy ứng viên theo bucket rồi tính cosine chính xác để xếp hạng
+    """
+
+    def __init__(self, dim: int, num_tables: int = 8, num_bits: int = 12, seed: int = 42):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((num_tables, num_bits, dim)).astype(np.float32)
+        self.weights = (1 << np.arange(num_bits)).astype(np.int64)
+        self.tables: List[Dict[int, set]] = [{} for _ in range(num_tables)]
+        self.vectors: Dict[int, np.ndarray] = {}
+
+    def _bucket_keys(self, vector: np.ndarray) -> List[int]:
+        bits = (np.einsum("tbd,d->tb", self.planes, vector) > 0).astype(np.int64)
+        return (bits @ self.weights).tolist()
+
+    def add(self, item_id: int, vector: np.ndarray):
+        self.vectors[item_id] = vector
+        for table, key in zip(self.tables, self._bucket_keys(vector)):
+            table.setdefault(key, set()).add(item_id)
+
+    def remove(self, item_id: int):
+        vector = self.vectors.pop(item_id, None)
+        if vector is None:
+            return
+        for table, key in zip(self.tables, self._bucket_keys(vector)):
+            bucket = table.get(key)
+            if bucket:
+                bucket.discard(item_id)
+                if not bucket:
+                    del table[key]
+
+    def query(self, vector: np.ndarray, top_k: int = 5) -> List[tuple]:
+        candidates = set()
+        for table, key in zip(self.tables, self._bucket_keys(vector)):
+            candidates |= table.get(key, set())
+        if not candidates:
+            return []
+        ids = list(candidates)
+        matrix = np.stack([self.vectors[i] for i in ids])
+        scores = matrix @ vector
+        order = np.argsort(-scores)[:top_k]
+        return [(ids[i], float(scores[i])) for i in order]
+
+
+class SemanticFlowCache:
+    """
+    Cache cấp request trước toàn bộ flow: embed `user_prompt` và tìm kết quả
+    FlowState trước đó có prompt gần giống (cosine >= threshold).
+
+    - Cùng lớp/môn/bộ sách mới được so sánh (scope)
+    - `lesson_plan` chỉ tái sử dụng khi cùng thời lượng + loại nội dung và
+      độ tương đồng >= plan_threshold (chặt hơn)
+    - Entry quá `ttl` giây bị bỏ qua (freshness), vượt `max_entries` thì xóa LRU
+    """
+
+    def __init__(self, embedder, db_path: str = "cache/semantic_flow_cache.sqlite",
+                 threshold: float = 0.92, plan_threshold: float = 0.97,
+                 ttl: float = 3 * 24 * 3600, max_entries: int = 2000):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.plan_threshold = plan_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS semantic_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL,
+                plan_signature TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+
+        # Mỗi scope một index: prompt gần giống của lớp / bộ sách khác không chiếm chỗ trong top_k
+        self._indexes: Dict[str, _LSHIndex] = {}
+        self._meta: Dict[int, Dict[str, Any]] = {}
+        self._max_seen_id = 0
+        self.hits = 0
+        self.misses = 0
+        cutoff = time.time() - self.ttl
+        self._conn.execute("DELETE FROM semantic_cache WHERE created_at < ?", (cutoff,))
+        self._load()
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embedder.encode([text], convert_to_numpy=True)[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _add(self, item_id: int, vector: np.ndarray, meta: Dict[str, Any]):
+        index = self._indexes.get(meta["scope"])
+        if index is None:
+            index = self._indexes[meta["scope"]] = _LSHIndex(vector.shape[0])
+        index.add(item_id, vector)
+        self._meta[item_id] = meta
+
+    def _load(self):
+        """
+        Nạp các entry còn hạn mới hơn lần nạp trước từ SQLite vào index trong bộ nhớ
+        (gọi mỗi lần lookup để thấy entry do worker khác ghi)
+        """
+        cutoff = time.time() - self.ttl
+        rows = self._conn.execute(
+            "SELECT id, scope, plan_signature, embedding, created_at, last_access FROM semantic_cache "
+            "WHERE id > ? AND created_at >= ? ORDER BY id",
+            (self._max_seen_id, cutoff)
+        ).fetchall()
+        for item_id, scope, signature, blob, created_at, last_access in rows:
+            self._max_seen_id = max(self._max_seen_id, item_id)
+            if item_id in self._meta:
+                continue
+            self._add(item_id, np.frombuffer(blob, dtype=np.float32).copy(), {
+                "scope": scope, "plan_signature": signature,
+                "created_at": created_at, "last_access": last_access,
+            })
+
+    def _forget(self, item_id: int):
+        meta = self._meta.pop(item_id, None)
+        index = self._indexes.get(meta["scope"]) if meta is not None else None
+        if index is not None:
+            index.remove(item_id)
+
+    def _delete(self, item_id: int):
+        self._conn.execute("DELETE FROM semantic_cache WHERE id = ?", (item_id,))
+        self._forget(item_id)
+
+    def lookup(self, prompt: str, form_data: dict) -> Optional[Dict[str, Any]]:
+        """Trả về {"similarity", "source_prompt", <các trường tái sử dụng được>} hoặc None"""
+        if not prompt:
+            return None
+
+        vector = self._embed(prompt)
+        scope = request_scope(form_data)
+        signature = plan_signature(form_data)
+        now = time.time()
+
+        with self._lock:
+            self._load()
+            index = self._indexes.get(scope)
+            candidates = index.query(vector, top_k=10) if index is not None else []
+
+            for item_id, similarity in candidates:
+                meta = self._meta.get(item_id)
+                if meta is None:
+                    continue
+                if now - meta["created_at"] > self.ttl:
+                    self._delete(item_id)
+                    continue
+                if similarity < self.threshold:
+                    break
+
+                row = self._conn.execute(
+                    "SELECT prompt, payload FROM semantic_cache WHERE id = ?", (item_id,)
+                ).fetchone()
+                if row is None:
+                    # Worker khác đã xóa (LRU / hết hạn)
+                    self._forget(item_id)
+                    continue
+                payload = json.loads(row[1])
+                if similarity < self.plan_threshold or meta["plan_signature"] != signature:
+                    payload.pop("lesson_plan", None)
+                if not any(payload.get(field) for field in REUSABLE_FIELDS):
+                    continue
+
+                meta["last_access"] = now
+                self._conn.execute(
+                    "UPDATE semantic_cache SET last_access = ?, hits = hits + 1 WHERE id = ?", (now, item_id)
+                )
+                self.hits += 1
+                record("cache", cache="semantic", hit=True)
+                return {"similarity": similarity, "source_prompt": row[0], **payload}
+
+            self.misses += 1
+            record("cache", cache="semantic", hit=False)
+            return None
+
+    def store(self, prompt: str, form_data: dict, state: dict):
+        payload = {}
+        for field in REUSABLE_FIELDS:
+            value = state.get(field)
+            if not value:
+                continue
+            if field == "filtered_chunks":
+                # Bỏ vector embedding của chunk cho nhẹ, bước sinh bài giảng chỉ cần nội dung
+                value = [{k: v for k, v in chunk.items() if k != "embedding"} for chunk in value]
+            payload[field] = value
+        if not prompt or not payload:
+            return
+
+        vector = self._embed(prompt)
+        now = time.time()
+        meta = {
+            "scope": request_scope(form_data),
+            "plan_signature": plan_signature(form_data),
+            "created_at": now,
+            "last_access": now,
+        }
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO semantic_cache (scope, plan_signature, prompt, embedding, payload, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (meta["scope"], meta["plan_signature"], prompt, vector.tobytes(),
+                 json.dumps(payload, ensure_ascii=False, default=str), now, now),
+            )
+            self._add(cursor.lastrowid, vector, meta)
+
+            # Eviction: xóa entry lâu không dùng nhất khi vượt giới hạn
+            overflow = len(self._meta) - self.max_entries
+            if overflow > 0:
+                oldest = sorted(self._meta, key=lambda i: self._meta[i]["last_access"])[:overflow]
+                for old_id in oldest:
+                    self._delete(old_id)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._meta),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
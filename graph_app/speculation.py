@@ -0,0 +1,146 @@
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from modules.rag_module.RetrievalMemo import normalize_key
+from utils.telemetry import record
+
+# Thời gian tối đa node chờ một việc chạy trước chưa xong (quá hạn → tự làm lại)
+SPECULATION_WAIT_SECONDS = float(os.environ.get("SPECULATION_WAIT_SECONDS", "300"))
+
+
+def speculative_query(form_data: dict) -> str:
+    """Câu truy vấn dựng thẳng từ form (chủ đề, môn, khối lớp) khi chưa có subtopics"""
+    parts = [str(form_data.get("topic") or "").strip(), str(form_data.get("subject") or "").strip()]
+    grade = str(form_data.get("grade") or "").strip()
+    if grade:
+        parts.append(f"lớp {grade}")
+    return " ".join(part for part in parts if part)
+
+
+class Speculation:
+    """Các việc chạy trước của một run: "search:<query>" và "upload:<file>" → Future"""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self._futures: Dict[str, Future] = {}
+        self._used = set()
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def add(self, key: str, future: Future):
+        with self._lock:
+            self._futures[key] = future
+
+    def take(self, key: str, timeout: float = None) -> Tuple[Any, bool]:
+        """Lấy kết quả đã chạy trước (chờ nếu đang chạy); (None, False) nếu không có / lỗi / bị hủy"""
+        with self._lock:
+            future = self._futures.get(key)
+        if future is None or future.cancelled():
+            return None, False
+
+        kind = key.split(":", 1)[0]
+        try:
+            value = future.result(timeout=SPECULATION_WAIT_SECONDS if timeout is None else timeout)
+        except FutureTimeout:
+            print(f"⚠️ Speculation {key} chưa xong sau {SPECULATION_WAIT_SECONDS}s, tự chạy lại")
+            record("cache", cache=f"speculation:{kind}", hit=False)
+            return None, False
+        except Exception as e:
+            print(f"⚠️ Speculation {key} lỗi: {e}")
+            record("cache", cache=f"speculation:{kind}", hit=False)
+            return None, False
+
+        with self._lock:
+            self._used.add(key)
+        record("cache", cache=f"speculation:{kind}", hit=True)
+        return value, True
+
+    def take_searches(self) -> Dict[str, List]:
+        """Kết quả các vector search đã chạy trước: {query: results}"""
+        with self._lock:
+            keys = [key for key in self._futures if key.startswith("search:")]
+        results = {}
+        for key in keys:
+            value, ok = self.take(key)
+            if ok:
+                results[key.split(":", 1)[1]] = list(value or [])
+        return results
+
+    def cancel(self, prefix: str = "") -> int:
+        """Hủy các việc chưa dùng tới (việc đang chạy dở không dừng được, kết quả bị bỏ)"""
+        cancelled = 0
+        with self._lock:
+            for key, future in self._futures.items():
+                if key.startswith(prefix) and key not in self._used and key not in self._cancelled:
+                    self._cancelled.add(key)
+                    if future.cancel():
+                        cancelled += 1
+        return cancelled
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            launched = len(self._futures)
+            used = len(self._used)
+            wasted = sum(1 for key, f in self._futures.items() if key not in self._used and not f.cancelled())
+        return {"launched": launched, "used": used, "cancelled": launched - used - wasted, "wasted": wasted}
+
+
+class Speculator:
+    """
+    Chạy trước phần retrieval ngay khi có form_data (trong lúc ChatAgent và
+    SubtopicGeneratorAgent còn đang gọi LLM): vector search theo chủ đề / môn /
+    khối lớp và parse các file tải lên. Các node lấy kết quả qua take(), việc
+    không còn cần thì bị hủy.
+    """
+
+    def __init__(self, search: Callable[[str], List], parse_file: Callable[[str], List[dict]],
+                 max_workers: int = None):
+        self.search = search
+        self.parse_file = parse_file
+        self.max_workers = max_workers or int(os.environ.get("SPECULATION_WORKERS", "4"))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._runs: Dict[str, Speculation] = {}
+        self._lock = threading.Lock()
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="speculation")
+            executor = self._executor
+        # Giữ context của caller (memo của batch, deadline LLM...)
+        return executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def start(self, run_id: str, form_data: dict) -> Speculation:
+        speculation = Speculation(run_id)
+        with self._lock:
+            self._runs[run_id] = speculation
+
+        query = speculative_query(form_data)
+        if query:
+            speculation.add(f"search:{normalize_key(query)}", self._submit(self.search, query))
+        for file_path in form_data.get("files") or []:
+            speculation.add(f"upload:{file_path}", self._submit(self.parse_file, file_path))
+
+        launched = speculation.summary()["launched"]
+        if launched:
+            print(f"\n🏃 Speculation: chạy trước {launched} việc (query: '{query}')")
+        return speculation
+
+    def get(self, run_id: str) -> Optional[Speculation]:
+        with self._lock:
+            return self._runs.get(run_id)
+
+    def finish(self, run_id: str) -> Dict[str, int]:
+        with self._lock:
+            speculation = self._runs.pop(run_id, None)
+        if speculation is None:
+            return {}
+        speculation.cancel()
+        summary = speculation.summary()
+        if summary["launched"]:
+            print(f"🏁 Speculation: {summary['used']}/{summary['launched']} dùng được, "
+                  f"{summary['cancelled']} hủy, {summary['wasted']} bỏ phí")
+        return summary
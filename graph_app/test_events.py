@@ -0,0 +1,67 @@
+import threading
+import time
+
+from graph_app.events import EventBus
+
+
+def test_subscribe_replays_history_and_stops_at_terminal_event():
+    bus = EventBus()
+    bus.publish("run", "node_started", node="a")
+    bus.publish("run", "node_finished", node="a")
+    bus.publish("run", "run_finished")
+    events = list(bus.subscribe("run", last_seq=1, heartbeat=0.01))
+    assert [e["type"] for e in events] == ["node_finished", "run_finished"]
+    assert [e["seq"] for e in events] == [2, 3]
+
+
+def test_subscribe_receives_live_events():
+    bus = EventBus()
+
+    def producer():
+        time.sleep(0.05)
+        bus.publish("run", "node_started", node="a")
+        bus.publish("run", "run_failed", error="x")
+
+    threading.Thread(target=producer).start()
+    events = [e for e in bus.subscribe("run", heartbeat=0.01) if e is not None]
+    assert [e["type"] for e in events] == ["node_started", "run_failed"]
+
+
+def test_poll_ends_stream_for_run_in_other_process():
+    bus = EventBus()
+    statuses = iter([None, {"type": "job_status", "data": {"status": "running"}},
+                     None, {"type": "run_finished", "data": {"status": "succeeded"}}])
+    events = list(bus.subscribe("remote", heartbeat=0.01, poll=lambda: next(statuses)))
+    assert [e and e["type"] for e in events] == [None, "job_status", None, "run_finished"]
+    # Sự kiện tổng hợp không vào lịch sử kênh
+    assert bus.history("remote") == []
+
+
+def test_poll_prefers_real_terminal_event_published_meanwhile():
+    bus = EventBus()
+    bus.publish("run", "node_started", node="a")
+
+    def poll():
+        # Run kết thúc trong process này ngay trước khi backend báo xong
+        bus.publish("run", "run_finished", output_path="out.json")
+        return {"type": "run_finished", "data": {"status": "succeeded"}}
+
+    events = [e for e in bus.subscribe("run", last_seq=1, heartbeat=0.01, poll=poll) if e is not None]
+    assert [e["type"] for e in events] == ["run_finished"]
+    assert events[0]["data"] == {"output_path": "out.json"}
+
+
+def test_idle_and_finished_channels_are_evicted():
+    bus = EventBus(channel_ttl=10, idle_ttl=100, evict_interval=0)
+    bus.publish("done", "run_finished")
+    bus.publish("idle", "node_started", node="a")
+    bus.publish("active", "node_started", node="a")
+    now = time.time()
+    bus._channels["done"].updated_at = now - 20
+    bus._channels["idle"].updated_at = now - 200
+
+    bus.publish("other", "node_started", node="a")
+    assert not bus.has_channel("done")
+    assert not bus.has_channel("idle")
+    assert bus.has_channel("active")
+    assert bus.history("missing") == [] and not bus.has_channel("missing")
@@ -0,0 +1,103 @@
+import time
+
+from graph_app.jobs import (
+    JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED,
+    InMemoryJobBackend, Job, JobQueue, SQLiteJobBackend,
+)
+
+
+def _wait_finished(queue, job_id, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job is not None and job.finished:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} not finished")
+
+
+def _handler(payload, job_id):
+    if payload.get("fail"):
+        raise ValueError("boom")
+    return {"echo": payload["value"], "job_id": job_id}
+
+
+def test_queue_runs_jobs_and_records_failures(tmp_path):
+    for backend in (InMemoryJobBackend(), SQLiteJobBackend(str(tmp_path / "jobs.sqlite"), poll_interval=0.05)):
+        queue = JobQueue(_handler, backend, num_workers=2).start()
+        try:
+            ok = queue.submit({"value": 1})
+            bad = queue.submit({"fail": True})
+            job = _wait_finished(queue, ok)
+            assert job.status == JOB_SUCCEEDED and job.result == {"echo": 1, "job_id": ok}
+            job = _wait_finished(queue, bad)
+            assert job.status == JOB_FAILED and job.error == "boom"
+            assert "payload" not in job.to_status_dict()
+        finally:
+            queue.shutdown(wait=True, timeout=5)
+
+
+def test_in_memory_backend_evicts_finished_jobs():
+    backend = InMemoryJobBackend(max_finished=2, finished_ttl=60)
+    for i in range(4):
+        backend.put(Job(id=f"j{i}", payload={}))
+        backend.claim(timeout=0)
+        backend.update(f"j{i}", status=JOB_SUCCEEDED, finished_at=time.time())
+    assert backend.get("j0") is None and backend.get("j1") is None
+    assert backend.get("j2") is not None and backend.get("j3") is not None
+
+    backend.put(Job(id="pending", payload={}))
+    backend._finished["j2"] = time.time() - 120
+    backend.put(Job(id="another", payload={}))
+    assert backend.get("j2") is None
+    # Job chưa xong không bao giờ bị bỏ
+    assert backend.get("pending").status == JOB_QUEUED
+
+
+def test_sqlite_claim_is_exclusive(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    first, second = SQLiteJobBackend(path), SQLiteJobBackend(path)
+    first.put(Job(id="only", payload={}))
+    claimed = [first.claim(timeout=0), second.claim(timeout=0)]
+    assert [job.id for job in claimed if job is not None] == ["only"]
+
+
+def test_sqlite_requeues_stale_running_job_then_fails_it(tmp_path):
+    backend = SQLiteJobBackend(str(tmp_path / "jobs.sqlite"), lease=10, max_attempts=2)
+    backend.put(Job(id="job", payload={"x": 1}))
+    assert backend.claim(timeout=0).attempts == 1
+
+    # Worker chết: không còn heartbeat quá lease → job được nhận lại
+    with backend._connect() as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = ?", (time.time() - 60,))
+    backend._last_reap = 0
+    job = backend.claim(timeout=0)
+    assert job is not None and job.id == "job" and job.attempts == 2
+
+    # Hết số lần thử → FAILED thay vì chạy lại mãi
+    with backend._connect() as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = ?", (time.time() - 60,))
+    backend._last_reap = 0
+    assert backend.claim(timeout=0) is None
+    job = backend.get("job")
+    assert job.status == JOB_FAILED and "heartbeat" in job.error
+
+
+def test_sqlite_heartbeat_keeps_lease(tmp_path):
+    backend = SQLiteJobBackend(str(tmp_path / "jobs.sqlite"), lease=10)
+    backend.put(Job(id="job", payload={}))
+    backend.claim(timeout=0)
+    with backend._connect() as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = ?", (time.time() - 60,))
+    backend.heartbeat(["job"])
+    backend._last_reap = 0
+    assert backend.claim(timeout=0) is None
+    assert backend.get("job").status == JOB_RUNNING
+
+
+def test_sqlite_deletes_old_finished_jobs(tmp_path):
+    backend = SQLiteJobBackend(str(tmp_path / "jobs.sqlite"), finished_ttl=60)
+    backend.put(Job(id="old", payload={}))
+    backend.update("old", status=JOB_SUCCEEDED, finished_at=time.time() - 120)
+    backend.claim(timeout=0)
+    assert backend.get("old") is None
@@ -0,0 +1,48 @@
+import numpy as np
+
+from graph_app.semantic_cache import SemanticFlowCache
+
+
+class _Embedder:
+    """Prompt → vector cố định (không cần model thật)"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def encode(self, texts, convert_to_numpy=True):
+        return np.stack([self.vectors[text] for text in texts])
+
+
+def _vectors():
+    rng = np.random.default_rng(0)
+    base = rng.standard_normal(64).astype(np.float32)
+    vectors = {"query": base, "grade7": base + 0.03 * rng.standard_normal(64).astype(np.float32)}
+    for i in range(12):
+        vectors[f"grade8-{i}"] = base + 0.001 * rng.standard_normal(64).astype(np.float32)
+    return vectors
+
+
+def _form(grade):
+    return {"grade": grade, "subject": "Toán", "textbook": "KNTT", "duration": "45", "content_types": []}
+
+
+def test_lookup_is_not_crowded_out_by_other_scopes(tmp_path):
+    cache = SemanticFlowCache(_Embedder(_vectors()), db_path=str(tmp_path / "cache.sqlite"))
+    cache.store("grade7", _form("7"), {"subtopics": ["lớp 7"]})
+    for i in range(12):
+        cache.store(f"grade8-{i}", _form("8"), {"subtopics": ["lớp 8"]})
+
+    hit = cache.lookup("query", _form("7"))
+    assert hit is not None and hit["subtopics"] == ["lớp 7"]
+    assert hit["similarity"] > 0.99
+
+
+def test_lookup_sees_entries_stored_by_other_workers(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite")
+    embedder = _Embedder(_vectors())
+    reader = SemanticFlowCache(embedder, db_path=db_path)
+    assert reader.lookup("query", _form("7")) is None
+
+    SemanticFlowCache(embedder, db_path=db_path).store("grade7", _form("7"), {"subtopics": ["lớp 7"]})
+    hit = reader.lookup("query", _form("7"))
+    assert hit is not None and hit["subtopics"] == ["lớp 7"]
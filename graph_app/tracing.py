@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.telemetry import telemetry_recorder
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TRACE_DIR = os.environ.get("TRACE_DIR", "traces")
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(2 ** i * 1024 * 1024 for i in range(0, 12))  # 1MB → 2GB
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+COUNT_BUCKETS = (0, 1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _peak_rss_bytes() -> int:
+    """Peak RSS của process (ru_maxrss: KB trên Linux, bytes trên macOS)"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except Exception:
+        return 0
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Histogram kiểu Prometheus (bucket cộng dồn + _sum + _count) theo bộ label"""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [count theo từng bucket..., +Inf, sum]
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _labels_text(self.labels, label_values, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, label_values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values: str):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_labels_text(self.labels, label_values)} {value}")
+        return lines
+
+
+class FlowMetrics:
+    """Các metric tổng hợp của flow, xuất ra dạng text Prometheus cho /metrics"""
+
+    def __init__(self):
+        self.node_seconds = Histogram("edumate_node_duration_seconds", "Wall time của từng node", ("node",))
+        self.node_cpu_seconds = Histogram("edumate_node_cpu_seconds", "CPU time của process trong lúc chạy node", ("node",))
+        self.node_rss_growth = Histogram("edumate_node_peak_rss_growth_bytes", "Mức tăng peak RSS trong lúc chạy node",
+                                         ("node",), buckets=(0,) + BYTES_BUCKETS)
+        self.node_tokens = Histogram("edumate_node_llm_tokens", "Token LLM mỗi lần chạy node",
+                                     ("node", "direction"), buckets=TOKEN_BUCKETS)
+        self.node_chunks = Histogram("edumate_node_chunks", "Số chunk node trả về", ("node", "field"),
+                                     buckets=COUNT_BUCKETS)
+        self.phase_seconds = Histogram("edumate_phase_duration_seconds", "Thời gian các phase bên trong node", ("phase",))
+        self.run_seconds = Histogram("edumate_run_duration_seconds", "Thời gian của cả lần chạy flow", ("status",),
+                                     buckets=DURATION_BUCKETS + (600, 1200))
+        self.llm_calls = Counter("edumate_llm_calls_total", "Số lời gọi LLM", ("node", "provider"))
+        self.llm_tokens = Counter("edumate_llm_tokens_total", "Tổng token LLM", ("provider", "direction"))
+        self.cache_events = Counter("edumate_cache_events_total", "Hit/miss của các cache", ("cache", "result"))
+        self.node_errors = Counter("edumate_node_errors_total", "Số lần node lỗi", ("node",))
+
+    def render(self) -> str:
+        lines = []
+        for metric in vars(self).values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = FlowMetrics()
+
+
+class NodeSpan:
+    """Số liệu của một lần chạy node; nhận sự kiện telemetry (có thể từ nhiều luồng)"""
+
+    def __init__(self, node: str):
+        self.node = node
+        self.llm_calls = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.tokens_estimated = False
+        self.cache: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hit": 0, "miss": 0})
+        self.phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, kind: str, data: dict):
+        with self._lock:
+            if kind == "llm_usage":
+                provider = data.get("provider", "unknown")
+                self.llm_calls += 1
+                self.tokens_in += int(data.get("tokens_in") or 0)
+                self.tokens_out += int(data.get("tokens_out") or 0)
+                self.tokens_estimated |= bool(data.get("estimated"))
+                metrics.llm_calls.inc(1, self.node, provider)
+                metrics.llm_tokens.inc(data.get("tokens_in") or 0, provider, "in")
+                metrics.llm_tokens.inc(data.get("tokens_out") or 0, provider, "out")
+            elif kind == "cache":
+                result = "hit" if data.get("hit") else "miss"
+                self.cache[data.get("cache", "unknown")][result] += 1
+                metrics.cache_events.inc(1, data.get("cache", "unknown"), result)
+            elif kind == "timing":
+                name = data.get("name", "unknown")
+                self.phases[name] = self.phases.get(name, 0.0) + float(data.get("seconds") or 0.0)
+                metrics.phase_seconds.observe(float(data.get("seconds") or 0.0), name)
+
+
+class RunTrace:
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.started_at = time.time()
+        self.nodes: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, entry: Dict[str, Any]):
+        with self._lock:
+            self.nodes.append(entry)
+
+    def to_dict(self, status: str, duration: float) -> Dict[str, Any]:
+        with self._lock:
+            nodes = list(self.nodes)
+        return {
+            "run_id": self.run_id,
+            "status": status,
+            "started_at": self.started_at,
+            "duration": round(duration, 4),
+            "llm_tokens_in": sum(n["llm"]["tokens_in"] for n in nodes),
+            "llm_tokens_out": sum(n["llm"]["tokens_out"] for n in nodes),
+            "nodes": nodes,
+        }
+
+
+_runs: Dict[str, RunTrace] = {}
+_runs_lock = threading.Lock()
+
+
+def _chunk_counts(update: Any) -> Dict[str, int]:
+    if not isinstance(update, dict):
+        return {}
+    return {key: len(value) for key, value in update.items() if "chunks" in key and isinstance(value, list)}
+
+
+def start_run(run_id: str) -> RunTrace:
+    trace = RunTrace(run_id)
+    with _runs_lock:
+        _runs[run_id] = trace
+    return trace
+
+
+def finish_run(run_id: str, status: str = "succeeded") -> Optional[Dict[str, Any]]:
+    """Kết thúc trace của run: ghi histogram thời gian run và file trace (TRACE_FILES=0 để tắt)"""
+    with _runs_lock:
+        trace = _runs.pop(run_id, None)
+    if trace is None:
+        return None
+
+    duration = time.time() - trace.started_at
+    metrics.run_seconds.observe(duration, status)
+    data = trace.to_dict(status, duration)
+
+    if os.environ.get("TRACE_FILES", "1") != "0":
+        try:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            with open(os.path.join(TRACE_DIR, f"{run_id}.json"), "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"⚠️ Không ghi được trace {run_id}: {e}")
+    return data
+
+
+def with_tracing(name: str, node: Callable[[dict], dict]) -> Callable[[dict], dict]:
+    """Bọc một node: đo wall/CPU time, mức tăng peak RSS, token LLM, cache hit và số chunk"""
+
+    def wrapped(state: dict):
+        span = NodeSpan(name)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        rss_start = _peak_rss_bytes()
+        status = "succeeded"
+        update = None
+        try:
+            with telemetry_recorder(span):
+                update = node(state)
+            return update
+        except Exception:
+            status = "failed"
+            metrics.node_errors.inc(1, name)
+            raise
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            rss_growth = max(0, _peak_rss_bytes() - rss_start)
+            chunks = _chunk_counts(update)
+
+            metrics.node_seconds.observe(wall, name)
+            metrics.node_cpu_seconds.observe(cpu, name)
+            metrics.node_rss_growth.observe(rss_growth, name)
+            if span.llm_calls:
+                metrics.node_tokens.observe(span.tokens_in, name, "in")
+                metrics.node_tokens.observe(span.tokens_out, name, "out")
+            for field, count in chunks.items():
+                metrics.node_chunks.observe(count, name, field)
+
+            with _runs_lock:
+                trace = _runs.get(state.get("run_id", ""))
+            if trace is not None:
+                trace.add({
+                    "node": name,
+                    "status": status,
+                    "wall_seconds": round(wall, 4),
+                    "cpu_seconds": round(cpu, 4),
+                    "peak_rss_growth_bytes": rss_growth,
+                    "llm": {"calls": span.llm_calls, "tokens_in": span.tokens_in,
+                            "tokens_out": span.tokens_out, "estimated": span.tokens_estimated},
+                    "cache": dict(span.cache),
+                    "phases": {k: round(v, 4) for k, v in span.phases.items()},
+                    "chunks": chunks,
+                })
+
+    wrapped.__name__ = name
+    return wrapped
+
+
+def render_metrics() -> str:
+    return metrics.render()
@@ -0,0 +1,48 @@
+"""
+Cấu hình gunicorn cho production: `gunicorn -c gunicorn.conf.py wsgi:app`
+
+- preload_app: master import app + load model embedding một lần, các worker fork
+  ra dùng chung bộ nhớ model (copy-on-write) thay vì mỗi worker tự load
+- post_fork: mỗi worker tạo lại runtime LLM, khởi động job queue, warm-up
+  inference và connection pool LLM
+- worker_exit: chờ các flow đang chạy xong (tối đa FLOW_DRAIN_SECONDS) trước khi thoát
+"""
+import os
+
+os.environ.setdefault("DEFER_BACKGROUND_WORKERS", "1")
+# Job và batch nằm trong SQLite để worker nào cũng tra được trạng thái (/jobs, /batch) của
+# worker khác; SSE của job chạy ở worker khác đọc trạng thái từ backend thay cho tiến độ từng node
+os.environ.setdefault("JOB_BACKEND", "sqlite")
+os.environ.setdefault("MODEL_WARMUP", "keepitreal/vietnamese-sbert,all-MiniLM-L6-v2")
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+if os.environ["JOB_BACKEND"].lower() != "sqlite" and workers > 1:
+    # Backend trong bộ nhớ: trạng thái job chỉ có ở worker đã nhận request → chỉ chạy 1 worker
+    print(f"⚠️ JOB_BACKEND={os.environ['JOB_BACKEND']} không chia sẻ giữa các process: dùng 1 worker thay vì {workers}")
+    workers = 1
+# gthread: request SSE (/jobs/<id>/events) giữ kết nối lâu mà không chặn cả worker
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.environ.get("FLOW_DRAIN_SECONDS", "300"))
+keepalive = 5
+accesslog = "-"
+
+
+def when_ready(server):
+    from utils.serving import preload
+    preload()
+
+
+def post_fork(server, worker):
+    import app
+    from utils.serving import init_worker
+    init_worker(app.start_background_workers)
+
+
+def worker_exit(server, worker):
+    import app
+    from utils.serving import drain
+    drain(app.stop_background_workers, graceful_timeout)
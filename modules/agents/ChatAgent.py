@@ -1,6 +1,8 @@
+from utils.LLMCache import cached_llm
+
 class ChatAgent:
-    def __init__(self, llm):
-        self.client = llm
+    def __init__(self, llm, use_cache: bool = True):
+        self.client = cached_llm(llm, "ChatAgent") if use_cache else llm
         self.system_prompt = """
             Bạn là **EduMate** – một trợ lý ảo AI được thiết kế đặc biệt để hỗ trợ giáo viên trong việc tạo, chỉnh sửa và tinh chỉnh nội dung giảng dạy như bài giảng, giáo án, đề kiểm tra, kế hoạch học tập và các hoạt động học tập khác. 
 
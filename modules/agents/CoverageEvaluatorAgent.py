@@ -5,11 +5,16 @@ from typing import List, Set, Dict
 from functools import lru_cache
 from modules.rag_module.datatypes.CoverageAssessment import CoverageAssessment
 from modules.rag_module.datatypes.CoverageLevel import CoverageLevel
+from utils.LLMCache import cached_llm, _model_name
+from utils.TokenBudgeter import TokenBudgeter
+import textwrap
 
 class CoverageEvaluatorAgent:
-    def __init__(self, llm, max_content_length: int = 4000):
-        self.llm = llm
-        self.max_content_length = max_content_length
+    def __init__(self, llm, use_cache: bool = True, max_content_tokens: int = 1500):
+        self.llm = cached_llm(llm, "CoverageEvaluatorAgent") if use_cache else llm
+        # Nội dung đưa vào prompt đánh giá được đóng gói theo token
+        self.max_content_tokens = max_content_tokens
+        self.budgeter = TokenBudgeter(_model_name(llm))
         self.logger = logging.getLogger(__name__)
         
         # Fast heuristic weights
@@ -26,7 +31,7 @@ class CoverageEvaluatorAgent:
         self.fast_decisions = 0
         self.llm_calls = 0
         
-        self.prompt = """
+        self.prompt = textwrap.dedent("""
         Bạn là một chuyên gia giáo dục, có nhiệm vụ **đánh giá nội dung bài giảng** với thái độ khuyến khích, linh hoạt và mang tính xây dựng.
 
         ## MỤC TIÊU
@@ -68,7 +73,7 @@ class CoverageEvaluatorAgent:
         ```
 
         CHỈ trả về JSON hợp lệ, không thêm văn bản khác.
-    """
+    """).strip()
 
     @lru_cache(maxsize=100)
     def extract_keywords(self, text: str) -> frozenset:
@@ -157,48 +162,18 @@ class CoverageEvaluatorAgent:
         
         return decision, composite_score, reason
 
-    def optimize_content_fast(self, chunks: List, target_length: int = None) -> str:
-        """🚀 Optimized content preparation với early termination"""
+    def pack_content(self, chunks: List, target_tokens: int = None):
+        """🚀 Đóng gói nội dung theo ngân sách token: chunk điểm cao trước, bỏ trùng lặp (trả về kết quả pack của lần gọi này)"""
+        packed = self.budgeter.pack(chunks or [], target_tokens or self.max_content_tokens)
+        self.logger.info(f"📏 Coverage content: {packed.tokens}/{packed.budget} tokens, "
+                         f"{packed.included} chunks ({packed.duplicates} trùng, {packed.truncated} cắt, {packed.dropped} bỏ)")
+        return packed
+
+    def optimize_content_fast(self, chunks: List, target_tokens: int = None) -> str:
+        """Như pack_content() nhưng chỉ trả về text"""
         if not chunks:
             return ""
-        
-        target_length = target_length or self.max_content_length
-        
-        # Sort by score (không thay đổi original list)
-        sorted_chunks = sorted(chunks, key=lambda x: getattr(x, 'score', 0) 
-                              if hasattr(x, 'score') else x.get('score', 0), reverse=True)
-        
-        content_parts = []
-        total_length = 0
-        sources_seen = set()
-        
-        for chunk in sorted_chunks:
-            content = chunk.content if hasattr(chunk, 'content') else chunk.get('content', '')
-            source = chunk.source_file if hasattr(chunk, 'source_file') else chunk.get('source_file', 'Unknown')
-            
-            if not content:
-                continue
-                
-            # Diversify sources - prefer chunks from different sources
-            source_bonus = 0 if source in sources_seen else 200
-            
-            text_snippet = f"[Nguồn: {source}] {content}"
-            
-            # Check if adding this chunk would exceed limit
-            if total_length + len(text_snippet) + source_bonus <= target_length:
-                content_parts.append(text_snippet)
-                total_length += len(text_snippet)
-                sources_seen.add(source)
-            else:
-                # Try to fit a truncated version
-                remaining_space = target_length - total_length - 50  # Buffer
-                if remaining_space > 200:  # Worth truncating
-                    truncated = content[:remaining_space] + "..."
-                    text_snippet = f"[Nguồn: {source}] {truncated}"
-                    content_parts.append(text_snippet)
-                break
-        
-        return "\n\n".join(content_parts)
+        return self.pack_content(chunks, target_tokens).text
 
     def run(self, request: str, subtopics: List[str], chunks: List) -> CoverageAssessment:
         """🚀 OPTIMIZED coverage evaluation với fast path"""
@@ -236,7 +211,8 @@ class CoverageEvaluatorAgent:
             self.llm_calls += 1
             self.logger.info(f"🤔 Uncertain case, using LLM (heuristic_score={heuristic_score:.2f})")
             
-            content = self.optimize_content_fast(chunks)
+            packed = self.pack_content(chunks)
+            content = packed.text
             
             if not content.strip():
                 self.logger.warning("No valid content for LLM assessment")
@@ -254,6 +230,7 @@ class CoverageEvaluatorAgent:
             )
             
             messages = [{"role": "user", "content": prompt}]
+            self.budgeter.record(self.budgeter.count_messages(messages), packed.tokens)
             result = self.llm.chat(messages, temperature=0.2, max_tokens=1500)
 
             # Parse LLM response
@@ -350,7 +327,8 @@ class CoverageEvaluatorAgent:
             "fast_decisions": self.fast_decisions,
             "llm_calls": self.llm_calls,
             "fast_decision_rate": fast_decision_rate,
-            "avg_speedup": f"{(1 - fast_decision_rate) * 100:.1f}% calls avoided LLM"
+            "avg_speedup": f"{(1 - fast_decision_rate) * 100:.1f}% calls avoided LLM",
+            "token_usage": dict(self.budgeter.usage)
         }
 
     def reset_stats(self):
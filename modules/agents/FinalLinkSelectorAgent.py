@@ -4,10 +4,11 @@ import logging
 from urllib.parse import urlparse
 from typing import List
 from modules.rag_module.datatypes.SearchResult import SearchResult
+from utils.LLMCache import cached_llm
 
 class FinalLinkSelectorAgent:
-    def __init__(self, llm_client):
-        self.llm = llm_client
+    def __init__(self, llm_client, use_cache: bool = True):
+        self.llm = cached_llm(llm_client, "FinalLinkSelectorAgent") if use_cache else llm_client
         self.logger = logging.getLogger(__name__)
 
     def run(self, top_results: List[SearchResult], user_input: str,
@@ -1,12 +1,26 @@
 from utils.GPTClient import GPTClient
 from utils.GeminiClient import GeminiClient
-from typing import Dict, Any, List
+from utils.LLMCache import cached_llm, _model_name
+from utils.TokenBudgeter import TokenBudgeter, context_budget
+from typing import Dict, Any, List, Callable, Optional
+import textwrap
+import os
 
 class LessonContentWriterAgent:
-    def __init__(self, llm: GPTClient):
+    def __init__(self, llm: GPTClient, use_cache: bool = True, context_tokens: int = None, outline_tokens: int = None):
     # def __init__(self, llm: GeminiClient):
-        self.llm = llm
-        self.system_prompt = """
+        """
+        context_tokens: ngân sách token cho tài liệu tham khảo mỗi lần gọi (None → LLM_CONTEXT_TOKENS hoặc DEFAULT_CONTEXT_TOKENS)
+        outline_tokens: số token tối đa của outline đưa vào prompt (None → WRITER_OUTLINE_TOKENS, 0 = không giới hạn);
+            outline dài hơn thì giữ đoạn của phần đang viết thay vì cắt cụt phần cuối
+        """
+        self.llm = cached_llm(llm, "LessonContentWriterAgent") if use_cache else llm
+        model = _model_name(llm)
+        self.budgeter = TokenBudgeter(model)
+        self.context_tokens = context_tokens or context_budget()
+        self.outline_tokens = outline_tokens if outline_tokens is not None else int(
+            os.environ.get("WRITER_OUTLINE_TOKENS", "1500"))
+        self.system_prompt = textwrap.dedent("""
             Bạn là giáo viên chuyên nghiệp, nhiều kinh nghiệm giảng dạy theo chương trình GDPT 2018. Nhiệm vụ của bạn là viết nội dung chi tiết cho từng phần cụ thể trong kế hoạch bài giảng.
 
             YÊU CẦU VIẾT CHI TIẾT:
@@ -66,25 +80,48 @@ class LessonContentWriterAgent:
             - Phù hợp với chương trình và SGK Việt Nam
             - Tránh lan man, tập trung vào mục tiêu của phần
             - Bao gồm cả hoạt động dự phòng nếu có thời gian thừa
-        """
+        """).strip()
+        self.system_tokens = self.budgeter.count(self.system_prompt)
 
-    def run(self, section_name: str, outline: str, chunks: List[Dict], mon_hoc: str = "", lop: str = "", ten_bai: str = "") -> str:
+    def _fit_outline(self, outline: str, section_name: str) -> str:
+        """
+        Outline vừa ngân sách thì giữ nguyên. Dài hơn thì giữ đoạn của phần đang viết
+        (từ dòng có tên phần, tối đa nửa ngân sách) và phần đầu outline cho đủ ngân sách,
+        để phần nằm cuối outline không bị cắt mất
+        """
+        outline = outline or ""
+        if not self.outline_tokens or self.budgeter.count(outline) <= self.outline_tokens:
+            return outline
+        start = outline.lower().find(section_name.lower()) if section_name else -1
+        if start > 0:
+            start = outline.rfind("\n", 0, start) + 1
+        if start <= 0:
+            return self.budgeter.truncate(outline, self.outline_tokens)
+        section_part = self.budgeter.truncate(outline[start:], self.outline_tokens // 2)
+        head = self.budgeter.truncate(outline[:start], self.outline_tokens - self.budgeter.count(section_part) - 4)
+        return f"{head.rstrip()}\n...\n{section_part}"
+
+    def run(self, section_name: str, outline: str, chunks: List[Dict], mon_hoc: str = "", lop: str = "", ten_bai: str = "",
+            on_token: Optional[Callable[[str], None]] = None, timeout: Optional[float] = None) -> str:
         """
         Viết nội dung chi tiết cho một phần cụ thể của bài giảng
+
+        Nếu có on_token và LLM hỗ trợ chat_stream, nội dung được stream:
+        on_token(delta) được gọi cho từng đoạn text ngay khi model sinh ra.
+        timeout: timeout (giây) cho lời gọi LLM, None → mặc định của client.
         """
         try:
             print(f"🔄 Đang gọi LLM để viết phần {section_name}...")
             
-            # Chuẩn bị context từ chunks
-            chunks_content = ""
-            if chunks:
-                chunks_content = "\n".join([
-                    f"Chunk {i+1}: {chunk.get('content', '')[:500]}..."
-                    for i, chunk in enumerate(chunks[:3])  # Chỉ lấy 3 chunks đầu
-                ])
+            # Chuẩn bị context từ chunks: chunk điểm cao trước, bỏ trùng lặp, cắt đúng ngân sách token
+            packed = self.budgeter.pack(
+                chunks or [], self.context_tokens,
+                format_chunk=lambda chunk, content: f"Chunk ({chunk.get('source_file', 'Unknown')}): {content}"
+            )
+            outline_text = self._fit_outline(outline, section_name)
             
-            # Tạo prompt
-            prompt = f"""
+            # Tạo prompt (dedent template trước khi chèn outline/tài liệu nhiều dòng)
+            prompt = textwrap.dedent("""
                 THÔNG TIN ĐẦU VÀO:
                 **Môn học:** {mon_hoc}
                 **Lớp:** {lop}
@@ -95,17 +132,35 @@ class LessonContentWriterAgent:
                 {outline}
 
                 **Tài liệu tham khảo:**
-                {chunks_content}
+                {chunks}
 
                 Hãy viết nội dung chi tiết cho phần "{section_name}" theo đúng mục tiêu và yêu cầu.
-            """
+            """).strip().format(mon_hoc=mon_hoc, lop=lop, ten_bai=ten_bai, section_name=section_name,
+                                outline=outline_text, chunks=packed.text)
 
             messages = [
                 {"role": "system", "content": self.system_prompt},
                 {"role": "user", "content": prompt}
             ]
             
-            response = self.llm.chat(messages, temperature=0.7)
+            prompt_tokens = self.budgeter.count_messages(messages)
+            self.budgeter.record(prompt_tokens, packed.tokens)
+            print(f"📏 [{section_name}] Input {prompt_tokens} tokens "
+                  f"(system {self.system_tokens}, tài liệu {packed.tokens}/{packed.budget}: "
+                  f"{packed.included} chunks, {packed.duplicates} trùng, {packed.truncated} cắt, {packed.dropped} bỏ)")
+            
+            llm_kwargs = {"temperature": 0.7}
+            if timeout is not None:
+                llm_kwargs["timeout"] = timeout
+            
+            if on_token is not None and hasattr(self.llm, "chat_stream"):
+                parts = []
+                for delta in self.llm.chat_stream(messages, **llm_kwargs):
+                    parts.append(delta)
+                    on_token(delta)
+                response = "".join(parts).strip()
+            else:
+                response = self.llm.chat(messages, **llm_kwargs)
             
             print(f"✅ LLM đã trả về nội dung phần {section_name} ({len(response)} ký tự)")
             print(f"📄 CONTENT PREVIEW ({section_name}):")
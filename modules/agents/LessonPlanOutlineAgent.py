@@ -1,11 +1,12 @@
 from utils.GPTClient import GPTClient
 from utils.GeminiClient import GeminiClient
+from utils.LLMCache import cached_llm
 from typing import Dict, Any
 
 class LessonPlanOutlineAgent:
-    def __init__(self, llm: GPTClient):
+    def __init__(self, llm: GPTClient, use_cache: bool = True):
     # def __init__(self, llm: GeminiClient):
-        self.llm = llm
+        self.llm = cached_llm(llm, "LessonPlanOutlineAgent") if use_cache else llm
         self.system_prompt = """
             Bạn là một chuyên gia giáo dục Việt Nam, thành thạo chương trình giáo dục phổ thông 2018 từ Tiểu học đến THPT. Nhiệm vụ của bạn là tạo ra **khung kế hoạch bài giảng** (outline) hoàn chỉnh, chi tiết, phù hợp với chuẩn giáo dục Việt Nam.
 
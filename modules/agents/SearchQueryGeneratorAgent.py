@@ -1,10 +1,11 @@
 import json
 import logging
 from typing import List, Tuple
+from utils.LLMCache import cached_llm
 
 class SearchQueryGeneratorAgent:
-    def __init__(self, llm_client):
-        self.llm = llm_client
+    def __init__(self, llm_client, use_cache: bool = True):
+        self.llm = cached_llm(llm_client, "SearchQueryGeneratorAgent") if use_cache else llm_client
         self.logger = logging.getLogger(__name__)
 
     def run(self, user_input: str) -> Tuple[str, str, List[str], str, List[str], List[str]]:
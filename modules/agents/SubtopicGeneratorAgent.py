@@ -1,10 +1,11 @@
 import json
 import re
 import logging
+from utils.LLMCache import cached_llm
 
 class SubtopicGeneratorAgent:
-    def __init__(self, llm):
-        self.llm = llm
+    def __init__(self, llm, use_cache: bool = True):
+        self.llm = cached_llm(llm, "SubtopicGeneratorAgent") if use_cache else llm
         self.prompt = """
         Bạn là chuyên gia phân tích giáo dục với kinh nghiệm thiết kế chương trình học.
         Phân tích yêu cầu và xác định các chủ đề con cần thiết để đảm bảo nội dung học tập đầy đủ.
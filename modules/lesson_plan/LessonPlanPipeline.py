@@ -2,20 +2,39 @@ import os
 import json
 import datetime
 import re
-from typing import Dict, Any, List
+import time
+import math
+import contextvars
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, List, Callable, Optional
 from utils.GPTClient import GPTClient
+from utils.async_llm import llm_deadline
 from modules.agents.LessonPlanOutlineAgent import LessonPlanOutlineAgent
 from modules.agents.LessonContentWriterAgent import LessonContentWriterAgent
 
 class LessonPlanPipeline:
-    def __init__(self, llm: GPTClient):
+    def __init__(self, llm: GPTClient, max_concurrency: int = 4, section_timeout: float = None):
+        """
+        max_concurrency: số phần được viết song song (<= 1 → viết tuần tự như cũ)
+        section_timeout: thời gian tối đa (giây) để viết một phần — deadline LLM cho cả lần
+            viết (retry, chờ rate limit, stream), không chỉ timeout của từng request
+        """
         self.outline_agent = LessonPlanOutlineAgent(llm)
         self.content_agent = LessonContentWriterAgent(llm)
+        self.max_concurrency = max(1, int(max_concurrency or 1))
+        self.section_timeout = section_timeout
         
-    def create_full_lesson_plan(self, user_prompt: str, chunks: List[Dict]) -> Dict[str, Any]:
+    def create_full_lesson_plan(self, user_prompt: str, chunks: List[Dict],
+                                progress_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """
         Tạo kế hoạch bài giảng hoàn chỉnh từ prompt và chunks
+
+        progress_callback(event, data) nhận kết quả từng phần ngay khi có
+        ("outline_ready", "section_started", "section_delta", "section_completed")
+        để UI hiển thị sớm; "section_delta" là text được stream theo token.
         """
+        notify = progress_callback or (lambda event, data: None)
         print(f"\n🎓 Bắt đầu tạo kế hoạch bài giảng...")
         print(f"📝 Prompt: {user_prompt}")
         print(f"📚 Có {len(chunks)} chunks tài liệu")
@@ -28,6 +47,7 @@ class LessonPlanPipeline:
             return {"error": f"Lỗi tạo outline: {outline}"}
         
         print("✅ Đã tạo xong outline")
+        notify("outline_ready", {"outline": outline})
         
         # Trích xuất thông tin từ outline
         mon_hoc, lop, ten_bai = self._extract_info_from_outline(outline)
@@ -43,16 +63,17 @@ class LessonPlanPipeline:
             "VẬN DỤNG/MỞ RỘNG"
         ]
         
-        detailed_content = {}
+        # Mỗi phần chỉ phụ thuộc vào outline chung → có thể viết song song
+        stream = progress_callback is not None
+        write_args = (outline, chunks, mon_hoc, lop, ten_bai, notify, stream)
         
-        for section in sections_to_write:
-            print(f"\n   ✍️ Đang viết phần: {section}")
-            content = self.content_agent.run(section, outline, chunks, mon_hoc, lop, ten_bai)
-            detailed_content[section] = content
-            print(f"   ✅ Hoàn thành phần {section}")
-            # In preview của content
-            preview = content[:200] + "..." if len(content) > 200 else content
-            print(f"   📝 Preview: {preview}")
+        if self.max_concurrency > 1:
+            detailed_content = self._write_sections_concurrently(sections_to_write, *write_args)
+        else:
+            detailed_content = {
+                section: self._write_section(section, *write_args)
+                for section in sections_to_write
+            }
         
         # Bước 3: Merge thành markdown hoàn chỉnh
         print("\n📄 Bước 3: Tạo file markdown hoàn chỉnh...")
@@ -90,6 +111,93 @@ class LessonPlanPipeline:
         
         return full_lesson_plan
     
+    def _write_section(self, section: str, outline: str, chunks: List[Dict], mon_hoc: str, lop: str, ten_bai: str,
+                       notify: Callable[[str, Dict[str, Any]], None], stream: bool) -> str:
+        """
+        Viết một phần bài giảng (dùng chung cho chế độ tuần tự và song song)
+        """
+        print(f"\n   ✍️ Đang viết phần: {section}")
+        notify("section_started", {"section": section})
+        on_token = self._token_forwarder(section, notify) if stream else None
+        with llm_deadline(self.section_timeout) if self.section_timeout else nullcontext():
+            content = self.content_agent.run(section, outline, chunks, mon_hoc, lop, ten_bai,
+                                             on_token=on_token, timeout=self.section_timeout)
+        if on_token is not None:
+            on_token.flush()
+        notify("section_completed", {"section": section, "content": content})
+        print(f"   ✅ Hoàn thành phần {section}")
+        # In preview của content
+        preview = content[:200] + "..." if len(content) > 200 else content
+        print(f"   📝 Preview: {preview}")
+        return content
+
+    def _write_sections_concurrently(self, sections: List[str], *write_args) -> Dict[str, str]:
+        """
+        Viết các phần song song (tối đa max_concurrency luồng), kết quả vẫn
+        được ghép theo đúng thứ tự của `sections`
+        """
+        start_time = time.time()
+        workers = min(self.max_concurrency, len(sections))
+        print(f"   ⚡ Viết song song {len(sections)} phần ({workers} luồng)")
+        
+        # Một deadline chung cho cả lượt: mỗi phần tự dừng theo deadline LLM của nó,
+        # số "đợt" = số phần / số luồng, thêm khoảng dư để deadline của phần xảy ra trước
+        wait_timeout = None
+        if self.section_timeout:
+            wait_timeout = self.section_timeout * math.ceil(len(sections) / workers) + 10
+        
+        detailed_content = {}
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lesson-section")
+        try:
+            futures = {
+                # copy_context: giữ deadline LLM (và các contextvar khác) của luồng gọi
+                section: executor.submit(contextvars.copy_context().run, self._write_section, section, *write_args)
+                for section in sections
+            }
+            wait(futures.values(), timeout=wait_timeout)
+            for section, future in futures.items():
+                if not future.done():
+                    future.cancel()
+                    detailed_content[section] = f"Lỗi khi viết nội dung: quá thời gian chờ ({self.section_timeout}s)"
+                    print(f"   ⏰ Phần {section} vượt quá {self.section_timeout}s")
+                    continue
+                try:
+                    detailed_content[section] = future.result()
+                except Exception as e:
+                    detailed_content[section] = f"Lỗi khi viết nội dung: {str(e)}"
+                    print(f"   ❌ Lỗi khi viết phần {section}: {e}")
+        finally:
+            # Không chờ các luồng bị timeout, tránh treo cả pipeline
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        print(f"   ⏱️ Đã viết {len(sections)} phần trong {time.time() - start_time:.2f}s")
+        return detailed_content
+
+    def _token_forwarder(self, section: str, notify: Callable[[str, Dict[str, Any]], None],
+                         min_chars: int = 40, max_delay: float = 0.25):
+        """
+        Gom các token stream thành đoạn nhỏ rồi mới gửi "section_delta",
+        tránh phát một sự kiện cho mỗi token
+        """
+        buffer = []
+        state = {"size": 0, "last_flush": time.time()}
+
+        def flush():
+            if buffer:
+                notify("section_delta", {"section": section, "text": "".join(buffer)})
+                buffer.clear()
+            state["size"] = 0
+            state["last_flush"] = time.time()
+
+        def on_token(delta: str):
+            buffer.append(delta)
+            state["size"] += len(delta)
+            if state["size"] >= min_chars or time.time() - state["last_flush"] >= max_delay:
+                flush()
+
+        on_token.flush = flush
+        return on_token
+
     def _extract_info_from_outline(self, outline: str) -> tuple:
         """
         Trích xuất thông tin môn học, lớp, tên bài từ outline
@@ -2,17 +2,22 @@ import os
 import hashlib
 import asyncio
 import time
+import threading
 from pathlib import Path
-from typing import List, Dict, Generator
+from typing import List, Dict, Generator, Optional
 from concurrent.futures import ThreadPoolExecutor
 
-from utils.GPTClient import GPTClient
+from utils.AsyncGPTClient import AsyncGPTClient
+from modules.rag_module.RetrievalMemo import memoized_many, normalize_key
+from modules.rag_module.NearDuplicateDetector import dedupe_near_duplicates
+from utils.telemetry import record
+from utils.TokenBudgeter import chunk_content, chunk_score
 from modules.rag_module.query_db.VectorSearcher import VectorSearcher
 from modules.agents.CoverageEvaluatorAgent import CoverageEvaluatorAgent
 from modules.rag_module.deepsearch.DeepSearchPipeline import DeepSearchPipeline
 from modules.rag_module.deepsearch.SearchManager import SearchManager
 from modules.rag_module.deepsearch.ContentExtractor import ContentExtractor
-from modules.rag_module.documents_processing.main_processor import EduMateDocumentProcessor
+from utils.ModelRegistry import get_document_processor
 from modules.rag_module.data_chunking.processor import IntelligentVietnameseChunkingProcessor
 from modules.rag_module.datatypes.CoverageLevel import CoverageLevel
 
@@ -38,10 +43,18 @@ BATCH_SIZE = 32
 MAX_CONCURRENT_EXTRACTIONS = 5
 CONTENT_PROCESSING_TIMEOUT = 60
 
+# Các phase được đo thời gian trong một lần retrieve
+PHASES = ("db_search_time", "coverage_eval_time", "external_search_time", "content_extraction_time", "total_time")
+
+# Điểm cộng theo nguồn khi gộp các nhánh song song: tài liệu người dùng tải lên luôn đứng trước
+SOURCE_PRIORITY = {"upload": 1.0, "db": 0.0, "search": 0.0}
+
 class OptimizedDeepRetrieval:
-    def __init__(self):
+    def __init__(self, llm_client=None):
         """Initialize optimized components with caching and batching"""
-        self.llm_client = GPTClient(**AZURE_CONFIG)
+        # Client async dùng chung pool + rate limiter với các agent khác trong process
+        # (flow truyền vào client/router dùng chung; mặc định là Azure)
+        self.llm_client = llm_client or AsyncGPTClient(**AZURE_CONFIG)
         
         # Use optimized components
         self.vector_searcher = VectorSearcher(
@@ -66,48 +79,49 @@ class OptimizedDeepRetrieval:
         
         self.searcher = SearchManager(api_key=CSE_API_KEY, cse_id=CSE_ID)
 
-        self.document_processor = EduMateDocumentProcessor.create_balanced()
         self.chunking_processor = IntelligentVietnameseChunkingProcessor(
             output_dir="temp_chunking", 
             min_quality=0.65
         )
         
-        # Performance tracking
-        self.performance_stats = {
-            "db_search_time": 0,
-            "coverage_eval_time": 0,
-            "external_search_time": 0,
-            "content_extraction_time": 0,
-            "total_time": 0
-        }
+        # Performance tracking: mỗi lần retrieve đo trong dict riêng (nhiều job chạy song song
+        # trên cùng instance), ở đây chỉ cộng dồn tổng thời gian + số lần chạy
+        self.performance_stats = {"runs": 0, **dict.fromkeys(PHASES, 0.0)}
+        self._stats_lock = threading.Lock()
 
-    def retrieve(self, user_prompt: str, subtopics: List[str]) -> List[dict]:
-        """🚀 OPTIMIZED main retrieval function"""
+    @property
+    def document_processor(self):
+        """Document processor dùng chung trong process (tạo khi cần)"""
+        return get_document_processor()
+
+    def retrieve(self, user_prompt: str, subtopics: List[str], prefetched: Dict[str, List] = None) -> List[dict]:
+        """🚀 OPTIMIZED main retrieval function (prefetched: {query: results} đã search trước)"""
         start_time = time.time()
+        stats = dict.fromkeys(PHASES, 0.0)
         
         print(f"\n🚀 Starting OPTIMIZED DeepRetrieval for {len(subtopics)} subtopics...")
         
         try:
             # Phase 1: Optimized Database Retrieval
-            db_chunks = self._optimized_db_retrieval(subtopics)
+            db_chunks = self._optimized_db_retrieval(subtopics, prefetched, stats)
             
             # Phase 2: Fast Coverage Assessment
-            coverage_result = self._fast_coverage_assessment(user_prompt, subtopics, db_chunks)
+            coverage_result = self._fast_coverage_assessment(user_prompt, subtopics, db_chunks, stats)
             
             if coverage_result.level in [CoverageLevel.ADEQUATE, CoverageLevel.COMPREHENSIVE]:
                 print("✅ DB coverage sufficient. Skipping external search.")
-                total_time = time.time() - start_time
-                self._log_performance(total_time, db_only=True)
+                stats["total_time"] = time.time() - start_time
+                self._log_performance(stats, db_only=True)
                 return self._standardize_db_chunks(db_chunks)
             
             # Phase 3: Optimized External Search
-            external_chunks = self._optimized_external_search(user_prompt, subtopics)
+            external_chunks = self._optimized_external_search(user_prompt, subtopics, stats)
             
             # Phase 4: Merge and return
             all_chunks = self._merge_chunks(db_chunks, external_chunks)
             
-            total_time = time.time() - start_time
-            self._log_performance(total_time, db_only=False)
+            stats["total_time"] = time.time() - start_time
+            self._log_performance(stats, db_only=False)
             
             return all_chunks
             
@@ -116,32 +130,104 @@ class OptimizedDeepRetrieval:
             # Fallback to original method
             return self._fallback_retrieval(user_prompt, subtopics)
 
-    def _optimized_db_retrieval(self, subtopics: List[str]) -> List:
-        """🚀 Phase 1: Sequential database search với VectorSearcher gốc"""
+    # ----- API theo nhánh (flow song song: upload / DB / search ngoài chạy cùng lúc) -----
+    def retrieve_db(self, subtopics: List[str], prefetched: Dict[str, List] = None) -> List[dict]:
+        """Chỉ truy vấn vector DB, trả về chunks đã chuẩn hóa (retrieved_from="db")"""
+        return self._standardize_db_chunks(self._optimized_db_retrieval(subtopics, prefetched))
+
+    def retrieve_external(self, user_prompt: str, subtopics: List[str]) -> List[dict]:
+        """Chỉ search ngoài + trích xuất nội dung (retrieved_from="search")"""
+        return self._optimized_external_search(user_prompt, subtopics)
+
+    def merge_branches(self, user_prompt: str, subtopics: List[str], uploaded_chunks: List[dict],
+                       db_chunks: List[dict], external_chunks: List[dict]) -> dict:
+        """
+        Gộp kết quả các nhánh song song. Coverage được đánh giá trên upload + DB:
+        đủ thì bỏ kết quả search ngoài (như retrieve() tuần tự), sau đó dedupe + chấm điểm.
+        """
+        start_time = time.time()
+        local_chunks = list(uploaded_chunks or []) + list(db_chunks or [])
+        coverage = self._fast_coverage_assessment(user_prompt, subtopics, local_chunks)
+
+        use_external = coverage.level not in (CoverageLevel.ADEQUATE, CoverageLevel.COMPREHENSIVE)
+        external = list(external_chunks or []) if use_external else []
+        if not use_external and external_chunks:
+            print(f"✅ Upload + DB coverage sufficient. Bỏ {len(external_chunks)} external chunks.")
+
+        chunks = self._dedupe_and_score(local_chunks + external)
+        record("timing", name="retrieval.merge", seconds=time.time() - start_time)
+
+        print(f"\n📦 Merged: {len(uploaded_chunks or [])} upload + {len(db_chunks or [])} DB + "
+              f"{len(external)} external → {len(chunks)} unique chunks")
+        return {
+            "chunks": chunks,
+            "search_chunks": external,
+            "coverage": {
+                "level": coverage.level.value,
+                "score": coverage.score,
+                "missing_topics": coverage.missing_topics,
+                "used_external": use_external
+            }
+        }
+
+    def _dedupe_and_score(self, chunks: List[dict]) -> List[dict]:
+        """Bỏ chunk trùng / gần trùng nội dung (giữ bản điểm cao hơn), sắp xếp theo merge_score"""
+        scored = [
+            {**chunk, "merge_score": round(chunk_score(chunk) + SOURCE_PRIORITY.get(chunk.get("retrieved_from"), 0.0), 4)}
+            for chunk in chunks
+        ]
+        return dedupe_near_duplicates(scored, score=lambda c: c["merge_score"])
+
+    def _track(self, stats: Optional[Dict[str, float]], phase: str, seconds: float):
+        """Thời gian đo thật của một phase → stats của lần gọi này + trace của node / histogram trên /metrics"""
+        if stats is not None:
+            stats[phase] = seconds
+        record("timing", name=f"retrieval.{phase[:-len('_time')]}", seconds=seconds)
+
+    def _optimized_db_retrieval(self, subtopics: List[str], prefetched: Dict[str, List] = None,
+                                stats: Dict[str, float] = None) -> List:
+        """
+        🚀 Phase 1: Database search cho mọi subtopic trong một lượt (VectorSearcher.search_many).
+        prefetched: kết quả search chạy trước (speculation) — query trùng subtopic thì
+        không search lại, phần còn lại được thêm vào làm ứng viên.
+        """
         start_time = time.time()
         
         print(f"\n📊 Phase 1: DB search for {len(subtopics)} subtopics...")
         
         try:
-            # ✅ SỬA: Dùng sequential search thay vì batch_search
             all_chunks_raw = []
+            prefetched = {normalize_key(query): list(results or []) for query, results in (prefetched or {}).items()}
+            pending = [topic for topic in subtopics if normalize_key(topic) not in prefetched]
+            
+            # ✅ Một lần encode cho mọi subtopic + các aggregate chạy song song;
+            # batch: subtopic trùng giữa các bài cùng môn chỉ search một lần
+            try:
+                searched = memoized_many("db_search", pending, self.vector_searcher.search_many) if pending else {}
+            except Exception as e:
+                print(f"⚠️ Batch search error: {e}")
+                searched = {}
             
             for topic in subtopics:
-                try:
-                    chunks = self.vector_searcher.search(topic)  # Method có sẵn
-                    if chunks:
-                        print(f"✅ {topic}: {len(chunks)} chunks")
-                        all_chunks_raw.extend(chunks[:MAX_CHUNKS_PER_TOPIC])
-                    else:
-                        print(f"❌ {topic}: no chunks found")
-                except Exception as e:
-                    print(f"⚠️ Search error for '{topic}': {e}")
+                if normalize_key(topic) in prefetched:
+                    chunks = prefetched.pop(normalize_key(topic))
+                else:
+                    chunks = list(searched.get(topic) or [])
+                if chunks:
+                    print(f"✅ {topic}: {len(chunks)} chunks")
+                    all_chunks_raw.extend(chunks[:MAX_CHUNKS_PER_TOPIC])
+                else:
+                    print(f"❌ {topic}: no chunks found")
+            
+            for query, chunks in prefetched.items():
+                print(f"🏃 {query}: +{len(chunks)} chunks (search chạy trước)")
+                all_chunks_raw.extend(chunks[:MAX_CHUNKS_PER_TOPIC])
             
             # Efficient cleaning and deduplication
             unique_chunks = self._fast_clean_and_dedupe(all_chunks_raw)
             
             search_time = time.time() - start_time
-            self.performance_stats["db_search_time"] = search_time
+            self._track(stats, "db_search_time", search_time)
             
             print(f"📦 DB search completed: {len(unique_chunks)} unique chunks in {search_time:.2f}s")
             return unique_chunks
@@ -167,7 +253,8 @@ class OptimizedDeepRetrieval:
         print(f"🧹 Cleaned: {len(chunks)} → {len(valid_chunks)} → {len(unique_chunks)} chunks")
         return unique_chunks
 
-    def _fast_coverage_assessment(self, user_prompt: str, subtopics: List[str], chunks: List):
+    def _fast_coverage_assessment(self, user_prompt: str, subtopics: List[str], chunks: List,
+                                  stats: Dict[str, float] = None):
         """🚀 Phase 2: Fast coverage assessment with heuristics"""
         start_time = time.time()
         
@@ -177,7 +264,7 @@ class OptimizedDeepRetrieval:
             coverage_assessment = self.coverage_evaluator.run(user_prompt, subtopics, chunks)
             
             assessment_time = time.time() - start_time
-            self.performance_stats["coverage_eval_time"] = assessment_time
+            self._track(stats, "coverage_eval_time", assessment_time)
             
             print(f"📊 Coverage: {coverage_assessment.level.value} (score: {coverage_assessment.score:.2f}) "
                   f"in {assessment_time:.2f}s")
@@ -195,7 +282,8 @@ class OptimizedDeepRetrieval:
                 covered_topics=[]
             )
 
-    def _optimized_external_search(self, user_prompt: str, subtopics: List[str]) -> List[dict]:
+    def _optimized_external_search(self, user_prompt: str, subtopics: List[str],
+                                   stats: Dict[str, float] = None) -> List[dict]:
         """🚀 Phase 3: Parallel external search and extraction"""
         start_time = time.time()
         
@@ -218,13 +306,13 @@ class OptimizedDeepRetrieval:
                 return []
             
             # Parallel content extraction
-            extracted_content = self._parallel_content_extraction([link.url for link in final_links])
+            extracted_content = self._parallel_content_extraction([link.url for link in final_links], stats)
             
             # Process extracted content
             processed_chunks = self._process_extracted_content(extracted_content)
             
             search_time = time.time() - start_time
-            self.performance_stats["external_search_time"] = search_time
+            self._track(stats, "external_search_time", search_time)
             
             print(f"🌐 External search completed: {len(processed_chunks)} chunks in {search_time:.2f}s")
             return processed_chunks
@@ -233,7 +321,7 @@ class OptimizedDeepRetrieval:
             print(f"⚠️ External search error: {e}")
             return []
 
-    def _parallel_content_extraction(self, urls: List[str]) -> List[tuple]:
+    def _parallel_content_extraction(self, urls: List[str], stats: Dict[str, float] = None) -> List[tuple]:
         """🚀 Parallel content extraction using async"""
         start_time = time.time()
         
@@ -263,7 +351,7 @@ class OptimizedDeepRetrieval:
                     print(f"⚠️ Error processing result for {url}: {e}")
             
             extraction_time = time.time() - start_time
-            self.performance_stats["content_extraction_time"] = extraction_time
+            self._track(stats, "content_extraction_time", extraction_time)
             
             print(f"📄 Content extraction: {len(successful)}/{len(urls)} successful in {extraction_time:.2f}s")
             return successful
@@ -403,35 +491,30 @@ class OptimizedDeepRetrieval:
         # Combine and sort by relevance/score
         all_chunks = db_standardized + external_chunks
         
-        # Sort by score if available
-        all_chunks.sort(key=lambda x: x.get('score', 0), reverse=True)
+        # Sort by score, bỏ bản gần trùng giữa DB và web (giữ bản điểm cao hơn)
+        all_chunks = dedupe_near_duplicates(all_chunks, score=lambda x: x.get('score', 0))
         
-        print(f"\n📦 Final result: {len(db_standardized)} DB + {len(external_chunks)} external = {len(all_chunks)} total chunks")
+        print(f"\n📦 Final result: {len(db_standardized)} DB + {len(external_chunks)} external = {len(all_chunks)} unique chunks")
         
         return all_chunks
 
-    def _log_performance(self, total_time: float, db_only: bool = False):
-        """Log performance statistics"""
-        self.performance_stats["total_time"] = total_time
-        
+    def _log_performance(self, stats: Dict[str, float], db_only: bool = False):
+        """Log performance statistics của một lần retrieve (các phase đã record khi đo)"""
         print(f"\n⏱️ Performance Summary:")
-        print(f"   DB Search: {self.performance_stats['db_search_time']:.2f}s")
-        print(f"   Coverage Eval: {self.performance_stats['coverage_eval_time']:.2f}s")
+        print(f"   DB Search: {stats['db_search_time']:.2f}s")
+        print(f"   Coverage Eval: {stats['coverage_eval_time']:.2f}s")
         
         if not db_only:
-            print(f"   External Search: {self.performance_stats['external_search_time']:.2f}s")
-            print(f"   Content Extraction: {self.performance_stats['content_extraction_time']:.2f}s")
-        
-        print(f"   Total Time: {total_time:.2f}s")
+            print(f"   External Search: {stats['external_search_time']:.2f}s")
+            print(f"   Content Extraction: {stats['content_extraction_time']:.2f}s")
         
-        # Calculate speedup estimate
-        if db_only:
-            estimated_old_time = total_time * 3  # Conservative estimate
-        else:
-            estimated_old_time = total_time * 2
-            
-        speedup = estimated_old_time / total_time
-        print(f"   Estimated Speedup: {speedup:.1f}x faster")
+        print(f"   Total Time: {stats['total_time']:.2f}s")
+        record("timing", name="retrieval.total", seconds=stats["total_time"])
+
+        with self._stats_lock:
+            self.performance_stats["runs"] += 1
+            for phase in PHASES:
+                self.performance_stats[phase] += stats[phase]
 
     def _fallback_retrieval(self, user_prompt: str, subtopics: List[str]) -> List[dict]:
         """Fallback to original method if optimized fails"""
@@ -446,8 +529,9 @@ class OptimizedDeepRetrieval:
             return []
 
     def get_performance_stats(self) -> dict:
-        """Get detailed performance statistics"""
-        stats = self.performance_stats.copy()
+        """Get detailed performance statistics (tổng thời gian từng phase qua mọi lần retrieve)"""
+        with self._stats_lock:
+            stats = self.performance_stats.copy()
         
         # Add component-specific stats
         stats.update({
@@ -0,0 +1,125 @@
+import os
+import re
+import zlib
+import unicodedata
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+# Jaccard (trên shingle từ) từ ngưỡng này coi là trùng
+NEAR_DUP_THRESHOLD = float(os.environ.get("NEAR_DUP_THRESHOLD", "0.8"))
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+def _content(item: Any) -> str:
+    """Nội dung của chunk (dict hoặc QueryResult / SearchResult)"""
+    return (item.get("content", "") if isinstance(item, dict) else getattr(item, "content", "")) or ""
+
+
+def _normalize(text: str) -> List[str]:
+    """Chuẩn hóa để khác biệt khoảng trắng / dấu câu / hoa thường không ảnh hưởng"""
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return _PUNCTUATION.sub(" ", text).split()
+
+
+def _lsh_params(threshold: float, num_perm: int, min_recall: float = 0.9) -> tuple:
+    """
+    Chọn (bands, rows) với bands * rows = num_perm: rows lớn nhất (ít ứng viên
+    thừa nhất) mà cặp có Jaccard = threshold vẫn thành ứng viên với xác suất
+    1 - (1 - t^r)^b ≥ min_recall. Ngưỡng LSH (1/b)^(1/r) vì vậy nằm khá thấp hơn
+    threshold (0.8 → b=16, r=8, ngưỡng ≈ 0.71); ứng viên thừa bị loại ở bước so chữ ký.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if 1.0 - (1.0 - threshold ** rows) ** bands >= min_recall:
+            best = (bands, rows)
+    return best
+
+
+class NearDuplicateDetector:
+    """
+    Phát hiện chunk gần trùng bằng MinHash LSH: mỗi văn bản → chữ ký `num_perm`
+    giá trị min-hash trên shingle `shingle_size` từ, chia thành band để tìm ứng
+    viên trong thời gian tuyến tính, rồi kiểm tra Jaccard ước lượng ≥ threshold.
+    Cùng một đoạn sách đến từ upload, DB và web (khác khoảng trắng / dấu câu)
+    chỉ còn một bản.
+    """
+
+    def __init__(self, threshold: float = None, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        self.threshold = NEAR_DUP_THRESHOLD if threshold is None else threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _lsh_params(self.threshold, num_perm)
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._buckets: List[Dict[bytes, List[Hashable]]] = [{} for _ in range(self.bands)]
+        self._signatures: Dict[Hashable, np.ndarray] = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _normalize(text)
+        n = self.shingle_size
+        return self._minhash({" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))})
+
+    def _minhash(self, shingles: set) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # h_i(x) = (a_i * x + b_i) mod p; a, x < 2^32 nên không tràn uint64
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+    def _bands(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def similarity(self, a: np.ndarray, b: np.ndarray) -> float:
+        """Jaccard ước lượng từ hai chữ ký"""
+        return float(np.mean(a == b))
+
+    def query(self, text: str = None, signature: np.ndarray = None) -> Optional[Hashable]:
+        """Key của văn bản đã thêm gần trùng với `text` (None nếu không có)"""
+        signature = self.signature(text) if signature is None else signature
+        seen = set()
+        for band, bucket_key in zip(self._buckets, self._bands(signature)):
+            for key in band.get(bucket_key, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                if self.similarity(signature, self._signatures[key]) >= self.threshold:
+                    return key
+        return None
+
+    def add(self, key: Hashable, text: str) -> Optional[Hashable]:
+        """Thêm văn bản nếu chưa có bản gần trùng; trả về key của bản đã có (văn bản mới không được thêm)"""
+        signature = self.signature(text)
+        duplicate = self.query(signature=signature)
+        if duplicate is not None:
+            return duplicate
+        self._signatures[key] = signature
+        for band, bucket_key in zip(self._buckets, self._bands(signature)):
+            band.setdefault(bucket_key, []).append(key)
+        return None
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+
+def dedupe_near_duplicates(items: List[Any], score: Callable[[Any], float] = None,
+                           text: Callable[[Any], str] = _content, threshold: float = None) -> List[Any]:
+    """
+    Bỏ các item gần trùng nội dung, mỗi cụm giữ bản có `score` cao nhất
+    (không có score → giữ bản xuất hiện trước). Kết quả theo thứ tự score giảm
+    dần (hoặc thứ tự ban đầu); item không có nội dung được giữ nguyên (không so trùng).
+    """
+    if score is not None:
+        items = sorted(items, key=score, reverse=True)
+    detector = NearDuplicateDetector(threshold)
+    kept = []
+    for item in items:
+        content = (text(item) or "").strip()
+        if not content or detector.add(len(kept), content) is None:
+            kept.append(item)
+    return kept
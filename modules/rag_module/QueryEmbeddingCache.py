@@ -0,0 +1,164 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+from utils.ModelRegistry import get_shared
+from utils.telemetry import record
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+# Đường dẫn SQLite để giữ cache qua các lần restart ("" = chỉ trong bộ nhớ)
+QUERY_EMBEDDING_CACHE_PATH = os.environ.get("QUERY_EMBEDDING_CACHE_PATH", "")
+
+
+class QueryEmbeddingCache:
+    """
+    Cache text → embedding (float32, contiguous, read-only) dùng chung trong process
+    cho một model: LRU giới hạn `max_entries`, an toàn nhiều luồng. Có db_path thì
+    ghi xuống SQLite, miss trong RAM sẽ tra đĩa trước khi encode lại.
+    Subtopic / câu truy vấn lặp lại giữa các giáo viên chỉ encode một lần.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = QUERY_EMBEDDING_CACHE_SIZE,
+                 db_path: str = QUERY_EMBEDDING_CACHE_PATH, max_disk_entries: int = 200000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._writes = 0
+
+        self._conn = None
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    model TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (model, text)
+                )
+                """
+            )
+
+    @staticmethod
+    def _freeze(vector) -> np.ndarray:
+        array = np.ascontiguousarray(vector, dtype=np.float32)
+        if array is vector:
+            array = array.copy()
+        array.setflags(write=False)
+        return array
+
+    def _remember(self, text: str, vector: np.ndarray):
+        self._entries[text] = vector
+        self._entries.move_to_end(text)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load_from_disk(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        if self._conn is None or not texts:
+            return {}
+        found = {}
+        for start in range(0, len(texts), 500):
+            batch = texts[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT text, vector FROM query_embeddings WHERE model = ? AND text IN ({','.join('?' * len(batch))})",
+                (self.model_name, *batch)
+            ).fetchall()
+            for text, blob in rows:
+                found[text] = self._freeze(np.frombuffer(blob, dtype=np.float32))
+        return found
+
+    def _save_to_disk(self, vectors: Dict[str, np.ndarray]):
+        if self._conn is None or not vectors:
+            return
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO query_embeddings (model, text, vector, created_at) VALUES (?, ?, ?, ?)",
+            [(self.model_name, text, vector.tobytes(), now) for text, vector in vectors.items()]
+        )
+        self._writes += len(vectors)
+        if self._writes >= 1000:
+            self._writes = 0
+            self._conn.execute(
+                """
+                DELETE FROM query_embeddings WHERE rowid IN (
+                    SELECT rowid FROM query_embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_disk_entries,)
+            )
+
+    def get_many(self, texts: Sequence[str], encode: Callable[[List[str]], Sequence]) -> List[np.ndarray]:
+        """Embedding của từng text; các text chưa có được encode chung một lần `encode(list)`"""
+        results: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for text in texts:
+                vector = self._entries.get(text)
+                if vector is not None:
+                    self._entries.move_to_end(text)
+                    results[text] = vector
+            missing = list(dict.fromkeys(text for text in texts if text not in results))
+            hits = len(texts) - sum(1 for text in texts if text in missing)
+            self.hits += hits
+
+            on_disk = self._load_from_disk(missing)
+            for text, vector in on_disk.items():
+                self._remember(text, vector)
+            self.disk_hits += len(on_disk)
+        results.update(on_disk)
+
+        to_encode = [text for text in missing if text not in on_disk]
+        if to_encode:
+            encoded = {text: self._freeze(vector) for text, vector in zip(to_encode, encode(to_encode))}
+            with self._lock:
+                self.misses += len(to_encode)
+                for text, vector in encoded.items():
+                    self._remember(text, vector)
+                self._save_to_disk(encoded)
+            results.update(encoded)
+
+        for _ in range(hits + len(on_disk)):
+            record("cache", cache="query_embedding", hit=True)
+        for _ in to_encode:
+            record("cache", cache="query_embedding", hit=False)
+        return [results[text] for text in texts]
+
+    def get(self, text: str, encode: Callable[[List[str]], Sequence]) -> np.ndarray:
+        return self.get_many([text], encode)[0]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries = len(self._entries)
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0,
+        }
+
+    def clear(self):
+        """Xóa cache trong bộ nhớ (bản trên đĩa giữ nguyên)"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+
+def get_query_embedding_cache(model_name: str) -> QueryEmbeddingCache:
+    """Cache dùng chung trong process cho model `model_name` (mọi VectorSearcher / SemanticChunkFilter)"""
+    return get_shared(("query_embedding_cache", model_name), lambda: QueryEmbeddingCache(model_name))
@@ -0,0 +1,157 @@
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from utils.telemetry import record
+
+# Memo của lần chạy hiện tại (vd: các bài cùng môn trong một batch); None → không memo
+_current_memo: contextvars.ContextVar[Optional["RetrievalMemo"]] = contextvars.ContextVar("retrieval_memo", default=None)
+
+
+def normalize_key(text: Any) -> str:
+    return " ".join(str(text or "").lower().split())
+
+
+class RetrievalMemo:
+    """
+    Memo dùng chung giữa nhiều lần chạy flow: kết quả truy vấn (vd: vector search
+    theo subtopic) chỉ được tính một lần. Các luồng cùng hỏi một key đang được
+    tính sẽ chờ kết quả thay vì gọi lại (single-flight).
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._values: Dict[Hashable, Any] = {}
+        self._inflight: Dict[Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        return self._resolve(key, compute)[0]
+
+    def _resolve(self, key: Hashable, compute: Callable[[], Any]) -> tuple:
+        """Trả về (value, hit)"""
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                return self._values[key], True
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+                self.misses += 1
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                if key in self._values:
+                    self.hits += 1
+                    return self._values[key], True
+            # Luồng tính trước đó bị lỗi → tự tính
+            return compute(), False
+
+        try:
+            value = compute()
+            with self._lock:
+                self._values[key] = value
+            return value, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _resolve_many(self, keys: List[Hashable], compute_many: Callable[[List[Hashable]], Dict[Hashable, Any]]) -> Dict[Hashable, tuple]:
+        """Như _resolve cho nhiều key: các key chưa có (và chưa ai tính) được tính trong một lần compute_many"""
+        resolved, waiting, owned = {}, {}, []
+        with self._lock:
+            for key in keys:
+                if key in self._values:
+                    self.hits += 1
+                    resolved[key] = (self._values[key], True)
+                elif key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                else:
+                    self._inflight[key] = threading.Event()
+                    self.misses += 1
+                    owned.append(key)
+
+        if owned:
+            try:
+                values = compute_many(owned)
+                with self._lock:
+                    for key in owned:
+                        if key in values:
+                            self._values[key] = values[key]
+                for key in owned:
+                    resolved[key] = (values.get(key), False)
+            finally:
+                with self._lock:
+                    events = [self._inflight.pop(key, None) for key in owned]
+                for event in events:
+                    if event is not None:
+                        event.set()
+
+        for key, event in waiting.items():
+            event.wait()
+            with self._lock:
+                if key in self._values:
+                    self.hits += 1
+                    resolved[key] = (self._values[key], True)
+                    continue
+            # Luồng tính trước đó bị lỗi → tự tính
+            resolved[key] = (compute_many([key]).get(key), False)
+        return resolved
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._values),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+@contextmanager
+def use_memo(memo: Optional[RetrievalMemo]):
+    """Bật memo cho mọi truy vấn trong khối with (theo context, an toàn với nhiều luồng)"""
+    token = _current_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _current_memo.reset(token)
+
+
+def memoized(namespace: str, key: Any, compute: Callable[[], Any]) -> Any:
+    """Tính `compute()` qua memo hiện tại (nếu có), key được chuẩn hóa theo namespace"""
+    memo = _current_memo.get()
+    if memo is None:
+        return compute()
+    value, hit = memo._resolve((namespace, normalize_key(key)), compute)
+    record("cache", cache=f"memo:{namespace}", hit=hit)
+    return value
+
+
+def memoized_many(namespace: str, keys: List[str], compute_many: Callable[[List[str]], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Như memoized() cho nhiều key: chỉ các key chưa có trong memo được tính, trong
+    một lần `compute_many(keys_thiếu)` → {key: value}. Trả về {key: value} cho mọi key.
+    """
+    memo = _current_memo.get()
+    if memo is None:
+        return compute_many(list(keys))
+
+    originals = {}
+    for key in keys:
+        originals.setdefault((namespace, normalize_key(key)), key)
+
+    def compute(memo_keys):
+        values = compute_many([originals[key] for key in memo_keys])
+        return {key: values[originals[key]] for key in memo_keys if originals[key] in values}
+
+    resolved = memo._resolve_many(list(originals), compute)
+    for value, hit in resolved.values():
+        record("cache", cache=f"memo:{namespace}", hit=hit)
+    return {key: resolved[(namespace, normalize_key(key))][0] for key in keys}
@@ -1,12 +1,14 @@
 import numpy as np
 from typing import List, Dict, Union
-from functools import lru_cache
-from sentence_transformers import SentenceTransformer, util
+from utils.ModelRegistry import LazySentenceTransformer
+from modules.rag_module.QueryEmbeddingCache import get_query_embedding_cache
 import logging
 
 class SemanticChunkFilter:
     def __init__(self, model_name: str = "keepitreal/vietnamese-sbert", cache_size: int = 1000):
-        self.model = SentenceTransformer(model_name)
+        self.model = LazySentenceTransformer(model_name)
+        # Cache embedding truy vấn dùng chung trong process (cùng model với VectorSearcher)
+        self.query_cache = get_query_embedding_cache(model_name)
         self.cache_size = cache_size
         self.chunk_embeddings_cache = {} 
         self.logger = logging.getLogger(__name__)
@@ -15,11 +17,13 @@ class SemanticChunkFilter:
         self.cache_hits = 0
         self.cache_misses = 0
 
-    @lru_cache(maxsize=500)
-    def _get_query_embedding(self, query: str) -> tuple:
-        """Cache query embeddings. Return tuple để hashable."""
-        embedding = self.model.encode([query], convert_to_tensor=False)[0]
-        return tuple(embedding.tolist())
+    def _get_query_embedding(self, query: str) -> np.ndarray:
+        """Embedding float32 (read-only) của query, qua cache dùng chung"""
+        return self.query_cache.get(query, lambda texts: self.model.encode(texts, convert_to_tensor=False))
+
+    def _encode_chunk(self, text: str) -> np.ndarray:
+        """Embedding của nội dung chunk, encode trực tiếp (không qua cache truy vấn dùng chung)"""
+        return np.asarray(self.model.encode([text], convert_to_tensor=False)[0], dtype=np.float32)
 
     def precompute_chunk_embeddings(self, chunks: List[dict], batch_size: int = 32):
         """🚀 Pre-compute embeddings cho chunks để avoid runtime computation"""
@@ -101,7 +105,7 @@ class SemanticChunkFilter:
         # Get query embeddings (cached)
         query_embeddings = []
         for query in queries:
-            query_emb = list(self._get_query_embedding(query))
+            query_emb = self._get_query_embedding(query)
             query_embeddings.append(query_emb)
             self.cache_hits += 1
         
@@ -127,7 +131,7 @@ class SemanticChunkFilter:
             else:
                 # Fallback: compute on the fly
                 chunk_text = chunk['content']
-                chunk_emb = list(self._get_query_embedding(chunk_text))
+                chunk_emb = self._encode_chunk(chunk_text)
                 
                 max_score = 0.0
                 for query_emb in query_embeddings:
@@ -165,6 +169,7 @@ class SemanticChunkFilter:
                 chunk_embeddings = self.model.encode(batch_texts, convert_to_tensor=True)
                 
                 # Calculate similarities
+                from sentence_transformers import util
                 cosine_scores = util.cos_sim(query_embeddings, chunk_embeddings)
                 max_scores = cosine_scores.max(dim=0).values  # Max across queries
                 
@@ -191,11 +196,11 @@ class SemanticChunkFilter:
         """Fallback single chunk filtering"""
         try:
             chunk_text = chunk['content']
-            chunk_emb = list(self._get_query_embedding(chunk_text))
+            chunk_emb = self._encode_chunk(chunk_text)
             
             max_score = 0.0
             for query in queries:
-                query_emb = list(self._get_query_embedding(query))
+                query_emb = self._get_query_embedding(query)
                 score = self._cosine_similarity(query_emb, chunk_emb)
                 max_score = max(max_score, score)
             
@@ -244,12 +249,13 @@ class SemanticChunkFilter:
             "cache_hits": self.cache_hits,
             "cache_misses": self.cache_misses,
             "hit_rate": hit_rate,
-            "precomputed_chunks": len(self.chunk_embeddings_cache)
+            "precomputed_chunks": len(self.chunk_embeddings_cache),
+            "query_embeddings": self.query_cache.stats()
         }
 
     def clear_cache(self):
         """Clear all caches"""
-        self._get_query_embedding.cache_clear()
+        self.query_cache.clear()
         self.chunk_embeddings_cache.clear()
         self.cache_hits = 0
         self.cache_misses = 0
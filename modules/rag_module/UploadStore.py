@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from utils.telemetry import record
+
+
+# Hash đã tính sẵn (vd: trong lúc stream upload), key theo (path, size, mtime) để file đổi thì tính lại
+_known_digests: "OrderedDict[tuple, str]" = OrderedDict()
+_digests_lock = threading.Lock()
+_MAX_KNOWN_DIGESTS = 4096
+
+
+def _stat_key(path: str) -> tuple:
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def remember_sha256(path: str, sha256: str):
+    """Ghi nhớ hash đã tính khi stream file xuống đĩa để không phải đọc lại file lớn"""
+    key = _stat_key(path)
+    with _digests_lock:
+        _known_digests[key] = sha256
+        while len(_known_digests) > _MAX_KNOWN_DIGESTS:
+            _known_digests.popitem(last=False)
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 nội dung file (đọc theo block, không nạp cả file vào RAM)"""
+    key = _stat_key(path)
+    with _digests_lock:
+        known = _known_digests.get(key)
+    if known:
+        return known
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    remember_sha256(path, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def _pack(data: Any) -> bytes:
+    return zlib.compress(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _unpack(blob: Optional[bytes]) -> Any:
+    return json.loads(zlib.decompress(blob).decode("utf-8")) if blob else None
+
+
+class UploadStore:
+    """
+    Kho upload theo nội dung (SHA-256): markdown đã parse, chunks chuẩn hóa và
+    id các chunk đã embedding + lưu Mongo. Cùng một file (vd: sách giáo khoa
+    được nhiều giáo viên tải lên) chỉ parse / chunking / embedding một lần.
+    """
+
+    def __init__(self, db_path: str = "cache/upload_store.sqlite"):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                sha256 TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                markdown BLOB,
+                chunks BLOB,
+                embedding_ids TEXT,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get_chunks(self, sha256: str) -> Optional[List[Dict[str, Any]]]:
+        """Chunks đã có của file (None nếu chưa từng xử lý)"""
+        with self._lock:
+            row = self._conn.execute("SELECT chunks FROM uploads WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None or row[0] is None:
+                self.misses += 1
+                record("cache", cache="upload", hit=False)
+                return None
+            self._conn.execute(
+                "UPDATE uploads SET last_access = ?, hits = hits + 1 WHERE sha256 = ?", (time.time(), sha256)
+            )
+            self.hits += 1
+        record("cache", cache="upload", hit=True)
+        return _unpack(row[0])
+
+    def get_markdown(self, sha256: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT markdown FROM uploads WHERE sha256 = ?", (sha256,)).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def put_parsed(self, sha256: str, file_name: str, markdown: str, chunks: List[Dict[str, Any]]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO uploads (sha256, file_name, markdown, chunks, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(sha256) DO UPDATE SET
+                    file_name = excluded.file_name, markdown = excluded.markdown,
+                    chunks = excluded.chunks, last_access = excluded.last_access
+                """,
+                (sha256, file_name, _pack(markdown), _pack(chunks), now, now)
+            )
+
+    def embedding_ids(self, sha256: str) -> Optional[List[str]]:
+        """Id (Mongo) các chunk đã embedding của file; None nếu chưa embedding"""
+        with self._lock:
+            row = self._conn.execute("SELECT embedding_ids FROM uploads WHERE sha256 = ?", (sha256,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def set_embedding_ids(self, sha256: str, ids: List[Any]):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE uploads SET embedding_ids = ? WHERE sha256 = ?",
+                (json.dumps([str(i) for i in ids]), sha256)
+            )
+
+    def forget_embeddings(self, sha256: str = None):
+        """Bỏ đánh dấu đã embedding (vd: collection Mongo bị xóa / tạo lại)"""
+        with self._lock:
+            if sha256 is None:
+                self._conn.execute("UPDATE uploads SET embedding_ids = NULL")
+            else:
+                self._conn.execute("UPDATE uploads SET embedding_ids = NULL WHERE sha256 = ?", (sha256,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            files, embedded, reused = self._conn.execute(
+                "SELECT COUNT(*), COUNT(embedding_ids), COALESCE(SUM(hits), 0) FROM uploads"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "files": files,
+            "embedded_files": embedded,
+            "total_reuses": reused,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
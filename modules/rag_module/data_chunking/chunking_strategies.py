@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 from typing import List, Dict, Any, Optional, Tuple
 import re
 import logging
+import importlib.util
 from dataclasses import dataclass
 
 try:
@@ -12,10 +13,10 @@ except ImportError:
     logging.warning("LangChain text splitters not available. Using fallback implementations.")
 
 try:
-    from sentence_transformers import SentenceTransformer
     import numpy as np
     from sklearn.metrics.pairwise import cosine_similarity
-    SENTENCE_TRANSFORMERS_AVAILABLE = True
+    # Chỉ kiểm tra có cài đặt; sentence_transformers (kéo theo torch) được import khi load model
+    SENTENCE_TRANSFORMERS_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
 except ImportError:
     SENTENCE_TRANSFORMERS_AVAILABLE = False
     logging.warning("SentenceTransformers not available. Semantic chunking will be limited.")
@@ -218,14 +219,20 @@ class SemanticStrategy(ChunkingStrategy):
         self.similarity_threshold = similarity_threshold
         self.target_size = target_size
         self.max_chunk_size = max_chunk_size
-        self.model = None
+        self._model = None
+        self._model_failed = not SENTENCE_TRANSFORMERS_AVAILABLE
         
-        if SENTENCE_TRANSFORMERS_AVAILABLE:
+    @property
+    def model(self):
+        """Model dùng chung trong process, chỉ load khi chia văn bản lần đầu"""
+        if self._model is None and not self._model_failed:
             try:
-                self.model = SentenceTransformer(model_name)
+                from utils.ModelRegistry import get_sentence_transformer
+                self._model = get_sentence_transformer(self.model_name)
             except Exception as e:
                 logging.error(f"Failed to load SentenceTransformer model: {e}")
-                self.model = None
+                self._model_failed = True
+        return self._model
         
     def split_text(self, text: str, **kwargs) -> List[ChunkResult]:
         """Chia văn bản theo ngữ nghĩa."""
@@ -1,16 +1,15 @@
 # modules/rag_module/data_embedding/embedding_processor.py
 
-from sentence_transformers import SentenceTransformer
+from utils.ModelRegistry import LazySentenceTransformer
 import json
 from pathlib import Path
-import torch
 from typing import List, Dict, Any
 
 class VietnameseEmbeddingProcessor:
     def __init__(self, model_name: str = "keepitreal/vietnamese-sbert", device: str = None):
-        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = SentenceTransformer(model_name, device=self.device)
-        print(f"✅ Loaded embedding model: {model_name} on {self.device}")
+        self.device = device
+        # Model dùng chung trong process (tạo processor mới không load lại model)
+        self.model = LazySentenceTransformer(model_name, device=device)
 
     def load_chunks(self, file_path: str) -> List[Dict[str, Any]]:
         with open(file_path, "r", encoding="utf-8") as f:
@@ -20,39 +19,48 @@ class VietnameseEmbeddingProcessor:
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(chunks, f, ensure_ascii=False, indent=2)
 
-    def run(self, file_path: str, save_results: bool = False, output_path: str = None) -> Dict[str, Any]:
-        chunks = self.load_chunks(file_path)
+    def embed_chunks(self, chunks: List[Dict[str, Any]], batch_size: int = 32) -> Dict[str, Any]:
+        """Embedding trực tiếp trong bộ nhớ (theo batch), gắn `embedding` vào từng chunk"""
         total_chunks = len(chunks)
-        successful = 0
-
         print(f"🧠 Processing {total_chunks} chunks...")
 
+        texts, indices = [], []
         for i, chunk in enumerate(chunks):
+            if "metadata" not in chunk:
+                chunk["metadata"] = {}
+            chunk["embedding"] = []
             text = chunk.get("content", "").strip()
-            
-            if not text:
-                if "metadata" not in chunk:
-                    chunk["metadata"] = {}
-                chunk["embedding"] = []
-                continue
+            if text:
+                texts.append(text)
+                indices.append(i)
 
+        successful = 0
+        for start in range(0, len(texts), batch_size):
+            batch_indices = indices[start:start + batch_size]
             try:
-                embedding = self.model.encode(text, convert_to_numpy=True).tolist()
-                if "metadata" not in chunk:
-                    chunk["metadata"] = {}
-                chunk["embedding"] = embedding
-                successful += 1
+                vectors = self.model.encode(texts[start:start + batch_size], batch_size=batch_size,
+                                            convert_to_numpy=True).tolist()
             except Exception as e:
-                print(f"❌ Error embedding chunk {i}: {e}")
-                if "metadata" not in chunk:
-                    chunk["metadata"] = {}
-                chunk["embedding"] = []
+                print(f"❌ Error embedding batch {start // batch_size}: {e}")
+                continue
+            for i, vector in zip(batch_indices, vectors):
+                chunks[i]["embedding"] = vector
+                successful += 1
 
-            # Progress
-            if (i + 1) % 50 == 0 or (i + 1) == total_chunks:
-                print(f"📊 Progress: {i + 1}/{total_chunks} chunks")
+            print(f"📊 Progress: {min(start + batch_size, len(texts))}/{len(texts)} chunks")
 
         print(f"✅ Completed: {successful}/{total_chunks} chunks embedded successfully")
+        return {
+            "statistics": {
+                "total_chunks": total_chunks,
+                "successful_embeddings": successful
+            },
+            "chunks": chunks
+        }
+
+    def run(self, file_path: str, save_results: bool = False, output_path: str = None) -> Dict[str, Any]:
+        chunks = self.load_chunks(file_path)
+        result = self.embed_chunks(chunks)
 
         if save_results:
             # Tạo thư mục embedding_output
@@ -69,10 +77,4 @@ class VietnameseEmbeddingProcessor:
         else:
             print("⚠️ Results not saved (save_results=False)")
 
-        return {
-            "statistics": {
-                "total_chunks": total_chunks,
-                "successful_embeddings": successful
-            },
-            "chunks": chunks
-        }
\ No newline at end of file
+        return result
\ No newline at end of file
@@ -8,4 +8,7 @@ class QueryResult:
     score: float
     source_file: str
     page_number: Optional[int] = None
-    subtopic: Optional[str] = None
\ No newline at end of file
+    subtopic: Optional[str] = None
+    # Search hybrid: score vẫn là điểm vector; text_score là BM25, rrf_score chỉ dùng để xếp thứ tự
+    text_score: Optional[float] = None
+    rrf_score: Optional[float] = None
\ No newline at end of file
@@ -4,7 +4,7 @@ from modules.rag_module.datatypes.SearchResult import SearchResult
 from modules.agents.SearchQueryGeneratorAgent import SearchQueryGeneratorAgent
 from modules.agents.FinalLinkSelectorAgent import FinalLinkSelectorAgent
 from modules.rag_module.deepsearch.ContentExtractor import ContentExtractor
-from sentence_transformers import SentenceTransformer
+from utils.ModelRegistry import LazySentenceTransformer
 import numpy as np
 
 class DeepSearchPipeline:
@@ -12,7 +12,7 @@ class DeepSearchPipeline:
         self.query_agent = SearchQueryGeneratorAgent(llm_client)
         self.selector_agent = FinalLinkSelectorAgent(llm_client)
         self.extractor = ContentExtractor() 
-        self.embedder = SentenceTransformer(embedding_model)
+        self.embedder = LazySentenceTransformer(embedding_model)
         self.api_key = api_key
         self.cse_id = cse_id
         
@@ -20,6 +20,7 @@ from .pdf_processor import PDFProcessor
 from .office_processor import DOCXProcessor, PPTXProcessor, XLSXProcessor
 from .image_processor import ImageProcessor
 from .formula_extractor import AdvancedFormulaExtractor
+from ..UploadStore import file_sha256
 
 
 class DocumentProcessingSystem:
@@ -68,8 +69,9 @@ class DocumentProcessingSystem:
             self.config.chunk_size = 1000
             logging.warning("Invalid chunk_size, set to default: 1000")
     
-    def process_file(self, file_path: Union[str, Path], use_cache: bool = True) -> ProcessingResult:
-        """Process a single file with caching"""
+    def process_file(self, file_path: Union[str, Path], use_cache: bool = True,
+                     sha256: str = None) -> ProcessingResult:
+        """Process a single file with caching (sha256: digest đã tính lúc upload, nếu có)"""
         file_path = Path(file_path)
         
         if not file_path.exists():
@@ -81,7 +83,7 @@ class DocumentProcessingSystem:
             )
         
         # Check cache
-        cache_key = self._get_cache_key(file_path)
+        cache_key = self._get_cache_key(file_path, sha256)
         if use_cache and cache_key in self.cache:
             self.stats["cache_hits"] += 1
             logging.info(f"Cache hit for {file_path.name}")
@@ -267,11 +269,11 @@ class DocumentProcessingSystem:
         
         logging.info(f"Results saved to {output_path}")
     
-    def _get_cache_key(self, file_path: Path) -> str:
+    def _get_cache_key(self, file_path: Path, sha256: str = None) -> str:
         """Generate cache key for file"""
-        # Use file path, size, and modification time for cache key
-        stat = file_path.stat()
-        key_data = f"{file_path}_{stat.st_size}_{stat.st_mtime}_{asdict(self.config)}"
+        # Theo nội dung file (cùng file tải lên nhiều lần → cùng key dù đường dẫn tạm khác nhau);
+        # dùng lại digest đã tính lúc upload thay vì đọc lại file
+        key_data = f"{sha256 or file_sha256(str(file_path))}_{asdict(self.config)}"
         return hashlib.md5(key_data.encode()).hexdigest()
     
     def _update_stats(self, file_path: Path, processing_time: float, success: bool):
@@ -435,9 +437,10 @@ class EduMateDocumentProcessor:
         """Create custom processing instance"""
         return cls(create_custom_processor(**kwargs))
     
-    def process_file(self, file_path: Union[str, Path], use_cache: bool = True) -> ProcessingResult:
+    def process_file(self, file_path: Union[str, Path], use_cache: bool = True,
+                     sha256: str = None) -> ProcessingResult:
         """Process a single file"""
-        return self._processor.process_file(file_path, use_cache)
+        return self._processor.process_file(file_path, use_cache, sha256)
     
     def process_files(self, file_paths: List[Union[str, Path]], 
                      use_cache: bool = True,
@@ -68,8 +68,7 @@ class QueryEvaluationPipeline:
 
         # Vector search
         all_chunks = []
-        for sub in subtopics:
-            results = self.vector_searcher.search(sub)
+        for sub, results in self.vector_searcher.search_many(subtopics).items():
             all_chunks.extend(results)
             self.logger.info(f"Found {len(results)} chunks for: {sub}")
 
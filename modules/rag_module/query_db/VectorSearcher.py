@@ -1,91 +1,196 @@
 # modules/agents/vector_searcher.py
-import torch
+import os
+import time
+import hashlib
 import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from pymongo import MongoClient
-from sentence_transformers import SentenceTransformer
+from utils.ModelRegistry import LazySentenceTransformer
 from modules.rag_module.datatypes.QueryResult import QueryResult
+from modules.rag_module.QueryEmbeddingCache import get_query_embedding_cache
+from modules.rag_module.NearDuplicateDetector import dedupe_near_duplicates
+from modules.rag_module.query_db.VectorStore import VectorStore, create_vector_store
+from utils.telemetry import record
+
+
+def _result_key(r: dict) -> str:
+    """Key gộp kết quả giữa hai nhánh: _id nếu store trả về, không thì hash nội dung"""
+    if r.get("_id") is not None:
+        return str(r["_id"])
+    return hashlib.md5((r.get("content") or "").strip().encode("utf-8")).hexdigest()
+
 
 class VectorSearcher:
     def __init__(self, mongo_uri: str, db_name: str, collection_name: str,
                  embedding_model: str = "keepitreal/vietnamese-sbert",
                  search_index: str = "default",
                  top_k: int = 10,
-                 relevance_threshold: float = 0.2):
+                 relevance_threshold: float = 0.2,
+                 max_concurrency: int = None,
+                 store: VectorStore = None,
+                 hybrid: bool = None):
 
         self.client = MongoClient(mongo_uri)
-        self.collection = self.client[db_name][collection_name]
+        # Số truy vấn chạy song song trong search_many (Atlas: dùng chung pool kết nối của client)
+        self.max_concurrency = max_concurrency or int(os.environ.get("VECTOR_SEARCH_CONCURRENCY", "8"))
+        # Không có db (vd: chạy offline với store local) → không có collection
+        self.collection = self.client[db_name][collection_name] if db_name else None
 
         self.top_k = top_k
         self.search_index = search_index
         self.relevance_threshold = relevance_threshold
+        # Atlas $search (mặc định) hoặc index local chạy offline (VECTOR_STORE=local)
+        self.store = store or create_vector_store(self.collection, search_index)
+        # Hybrid (tùy chọn): thêm nhánh lexical (BM25 trên keywords / content), thứ tự gộp bằng RRF
+        self.hybrid = hybrid if hybrid is not None else os.environ.get("VECTOR_SEARCH_HYBRID", "0") == "1"
+        self.rrf_k = int(os.environ.get("RRF_K", "60"))
+        self._executor = None
+        # Pool riêng cho search_many: task của nó submit nhánh lexical vào _executor,
+        # dùng chung một pool giới hạn có thể deadlock
+        self._search_executor = None
+        self._executor_lock = threading.Lock()
 
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = SentenceTransformer(embedding_model, device=device)
+        # Model dùng chung trong process, chỉ load khi embed lần đầu (device: EMBEDDING_DEVICE hoặc tự chọn)
+        self.model = LazySentenceTransformer(embedding_model)
+        # Subtopic lặp lại giữa các request chỉ encode một lần (cache dùng chung theo model)
+        self.query_cache = get_query_embedding_cache(embedding_model)
 
         self.logger = logging.getLogger(__name__)
-        self.logger.info(f"VectorSearcher initialized on {device}")
+        self.logger.info(f"VectorSearcher initialized ({embedding_model})")
+
+    def _encode(self, texts: list[str]):
+        return self.model.encode(texts, convert_to_tensor=False, batch_size=max(1, len(texts)))
 
     def embed_text(self, text: str) -> list[float]:
         try:
-            return self.model.encode(text, convert_to_tensor=False).tolist()
+            return self.query_cache.get(text, self._encode).tolist()
         except Exception as e:
             self.logger.error(f"Embedding error: {e}")
             raise
 
-    def search(self, subtopic: str) -> list[QueryResult]:
+    def _submit(self, fn, *args):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="text-search")
+        return self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _timed(self, leg: str, fn, *args) -> list[dict]:
+        start_time = time.time()
+        try:
+            return fn(*args)
+        finally:
+            seconds = time.time() - start_time
+            record("timing", name=f"vector_search.{leg}", seconds=seconds)
+            self.logger.debug(f"{leg} leg: {seconds * 1000:.1f}ms")
+
+    def _fuse(self, dense: list[dict], lexical: list[dict]) -> list[dict]:
+        """
+        Reciprocal-rank fusion: rrf_score = Σ 1 / (rrf_k + rank), chỉ dùng để sắp xếp.
+        "score" giữ nguyên điểm vector (cùng thang cosine như khi không hybrid).
+        """
+        fused = {}
+        for leg, results in (("vector", dense), ("text", lexical)):
+            for rank, r in enumerate(results, start=1):
+                key = _result_key(r)
+                entry = fused.setdefault(key, {**r, "score": None, "text_score": None, "rrf_score": 0.0})
+                entry["rrf_score"] += 1.0 / (self.rrf_k + rank)
+                if leg == "vector":
+                    entry["score"] = r.get("score")
+                else:
+                    entry["text_score"] = r.get("score")
+        return sorted(fused.values(), key=lambda e: e["rrf_score"], reverse=True)
+
+    def _query(self, subtopic: str, vector: list[float], filters: dict = None) -> list[QueryResult]:
+        hybrid = self.hybrid and self.store.supports_text_search
+        if hybrid:
+            lexical_future = self._submit(self._timed, "text", self.store.text_search, subtopic, self.top_k, filters)
+        results = self._timed("dense", self.store.search, vector, self.top_k, filters)
+
+        if hybrid:
+            try:
+                lexical = lexical_future.result()
+            except Exception as e:
+                self.logger.error(f"Text search error for subtopic '{subtopic}': {e}")
+                lexical = []
+            results = self._fuse(results, lexical)
+            # Kết quả chỉ có ở nhánh lexical: lấy điểm vector để áp cùng ngưỡng relevance
+            missing = [str(r["_id"]) for r in results if r["score"] is None and r.get("_id") is not None]
+            if missing:
+                scores = self.store.vector_scores(vector, missing)
+                for r in results:
+                    if r["score"] is None and r.get("_id") is not None:
+                        r["score"] = scores.get(str(r["_id"]))
+            results = [r for r in results if r["score"] is not None][:self.top_k]
+
+        # Ngưỡng relevance (thang cosine) áp cho mọi kết quả
+        return [
+            QueryResult(
+                chunk_id=r.get("chunk_id", ""),
+                content=r.get("content", ""),
+                score=r["score"],
+                source_file=r.get("source_file", ""),
+                page_number=r.get("page_number"),
+                subtopic=subtopic,
+                text_score=r.get("text_score"),
+                rrf_score=r.get("rrf_score")
+            )
+            for r in results
+            if r.get("score", 0) >= self.relevance_threshold
+        ]
+
+    def search(self, subtopic: str, filters: dict = None) -> list[QueryResult]:
+        """filters: lọc theo source_file / subject / grade, vd: {"grade": "10"}"""
         try:
-            vector = self.embed_text(subtopic)
-            pipeline = [
-                {
-                    "$search": {
-                        "index": self.search_index,
-                        "knnBeta": {
-                            "vector": vector,
-                            "path": "embedding",
-                            "k": self.top_k
-                        }
-                    }
-                },
-                {
-                    "$project": {
-                        "chunk_id": 1,
-                        "content": 1,
-                        "score": {"$meta": "searchScore"},
-                        "source_file": 1,
-                        "page_number": 1
-                    }
-                }
-            ]
-            results = list(self.collection.aggregate(pipeline))
-
-            output = []
-            for r in results:
-                if r.get("score", 0) >= self.relevance_threshold:
-                    output.append(QueryResult(
-                        chunk_id=r.get("chunk_id", ""),
-                        content=r.get("content", ""),
-                        score=r.get("score", 0.0),
-                        source_file=r.get("source_file", ""),
-                        page_number=r.get("page_number"),
-                        subtopic=subtopic
-                    ))
-            return output
+            return self._query(subtopic, self.embed_text(subtopic), filters)
         except Exception as e:
             self.logger.error(f"Search error for subtopic '{subtopic}': {e}")
             return []
 
-    def deduplicate(self, chunks: list[QueryResult]) -> list[QueryResult]:
-        if not chunks:
-            return []
+    def search_many(self, subtopics: list[str], filters: dict = None) -> dict[str, list[QueryResult]]:
+        """
+        Search nhiều subtopic cùng lúc: các subtopic chưa có trong cache được encode chung một lần (batch),
+        rồi chạy các truy vấn song song trên store (Atlas: pool kết nối của MongoClient).
+        Trả về {subtopic: kết quả} (mỗi QueryResult gắn subtopic của nó);
+        subtopic lỗi → [] như search().
+        """
+        topics = list(dict.fromkeys(t for t in subtopics if t))
+        if not topics:
+            return {}
+
+        try:
+            # Chỉ các subtopic chưa có trong cache được encode (chung một batch)
+            vectors = [vector.tolist() for vector in self.query_cache.get_many(topics, self._encode)]
+        except Exception as e:
+            self.logger.error(f"Batch embedding error: {e}")
+            return {topic: [] for topic in topics}
 
-        chunks.sort(key=lambda x: x.score, reverse=True)
-        seen = set()
-        unique = []
+        def run(topic, vector):
+            try:
+                return self._query(topic, vector, filters)
+            except Exception as e:
+                self.logger.error(f"Search error for subtopic '{topic}': {e}")
+                return []
 
-        for c in chunks:
-            h = hash(c.content.strip())
-            if h not in seen:
-                seen.add(h)
-                unique.append(c)
+        if len(topics) == 1:
+            return {topics[0]: run(topics[0], vectors[0])}
+        with self._executor_lock:
+            if self._search_executor is None:
+                self._search_executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                           thread_name_prefix="vector-search")
+        futures = [self._search_executor.submit(contextvars.copy_context().run, run, topic, vector)
+                   for topic, vector in zip(topics, vectors)]
+        return dict(zip(topics, [future.result() for future in futures]))
 
-        return unique
+    def get_cache_stats(self) -> dict:
+        return self.query_cache.stats()
+
+    def clear_cache(self):
+        self.query_cache.clear()
+
+    def deduplicate(self, chunks: list[QueryResult]) -> list[QueryResult]:
+        """Bỏ chunk gần trùng (MinHash LSH, NEAR_DUP_THRESHOLD), giữ bản xếp hạng cao nhất (RRF nếu hybrid)"""
+        if not chunks:
+            return []
+        return dedupe_near_duplicates(chunks, score=lambda c: (c.rrf_score or 0.0, c.score))
@@ -0,0 +1,743 @@
+# query_db/VectorStore.py
+import os
+import re
+import glob
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from utils.ModelRegistry import get_shared
+
+logger = logging.getLogger(__name__)
+
+# Các trường lọc được khi search (đọc ở chunk hoặc chunk["metadata"])
+FILTER_FIELDS = ("source_file", "subject", "grade")
+RESULT_FIELDS = ("chunk_id", "content", "source_file", "page_number")
+# Trọng số BM25 của nhánh lexical: keywords (do chunking sinh ra) nặng hơn nội dung
+KEYWORDS_BOOST = float(os.environ.get("TEXT_SEARCH_KEYWORDS_BOOST", "2.0"))
+
+LOCAL_STORE_PATH = os.environ.get("VECTOR_STORE_PATH", "cache/vector_store")
+# Dưới ngưỡng này search exact trên cả ma trận (đã đủ nhanh), từ ngưỡng này mới train IVF
+IVF_MIN_ROWS = int(os.environ.get("VECTOR_STORE_IVF_MIN_ROWS", "20000"))
+IVF_NPROBE = int(os.environ.get("VECTOR_STORE_NPROBE", "8"))
+
+
+def _field(doc: Dict[str, Any], name: str) -> str:
+    value = doc.get(name)
+    metadata = doc.get("metadata")
+    if value in (None, "") and isinstance(metadata, dict):
+        value = metadata.get(name)
+    return "" if value is None else str(value)
+
+
+def _doc_id(doc: Dict[str, Any]) -> str:
+    """Id của chunk trong store: _id của Mongo nếu có, không thì hash nội dung + nguồn"""
+    if doc.get("_id") is not None:
+        return str(doc["_id"])
+    key = f"{_field(doc, 'source_file')}\n{doc.get('chunk_id', '')}\n{doc.get('content', '')}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _keywords(doc: Dict[str, Any]) -> str:
+    keywords = doc.get("keywords") or ""
+    return " ".join(str(k) for k in keywords) if isinstance(keywords, (list, tuple)) else str(keywords)
+
+
+def _filter_values(filters: Optional[Dict[str, Any]]) -> Dict[str, List[str]]:
+    values = {}
+    for name, value in (filters or {}).items():
+        if name not in FILTER_FIELDS:
+            raise ValueError(f"Không lọc được theo '{name}' (hỗ trợ: {', '.join(FILTER_FIELDS)})")
+        if value in (None, "", []):
+            continue
+        values[name] = [str(v) for v in value] if isinstance(value, (list, tuple, set)) else [str(value)]
+    return values
+
+
+class VectorStore(ABC):
+    """
+    Nơi lưu + tìm vector của các chunk. VectorSearcher chỉ nói chuyện với store
+    qua interface này; kết quả là dict gồm RESULT_FIELDS + "_id" + "score".
+    """
+
+    @abstractmethod
+    def search(self, vector: List[float], k: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def text_search(self, query: str, k: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Tìm lexical (BM25) trên keywords + content; score càng lớn càng khớp"""
+        ...
+
+    @property
+    def supports_text_search(self) -> bool:
+        return True
+
+    @abstractmethod
+    def vector_scores(self, vector: List[float], doc_ids: Iterable[str]) -> Dict[str, float]:
+        """Điểm vector (cùng thang với search) của các chunk theo _id, vd: kết quả chỉ có ở nhánh lexical"""
+        ...
+
+    @abstractmethod
+    def add(self, docs: Iterable[Dict[str, Any]]) -> int:
+        """Thêm chunk đã có "embedding"; trả về số chunk đã thêm"""
+        ...
+
+    @abstractmethod
+    def delete(self, doc_ids: Iterable[str]) -> int:
+        ...
+
+
+class AtlasVectorStore(VectorStore):
+    """
+    Store trên MongoDB Atlas: $search knnBeta (index do Atlas tự cập nhật khi insert / delete).
+    Text search cần một Atlas Search index có map keywords / content (ATLAS_TEXT_INDEX);
+    không cấu hình thì không có nhánh lexical.
+    """
+
+    def __init__(self, collection, search_index: str = "default", text_index: str = None):
+        self.collection = collection
+        self.search_index = search_index
+        self.text_index = os.environ.get("ATLAS_TEXT_INDEX", "") if text_index is None else text_index
+
+    @property
+    def supports_text_search(self) -> bool:
+        return bool(self.text_index)
+
+    def _run(self, search_stage: Dict[str, Any], k: int, filters: Dict[str, Any] = None,
+             index: str = None) -> List[Dict[str, Any]]:
+        pipeline = [
+            {"$search": {"index": index or self.search_index, **search_stage}},
+            {
+                "$project": {
+                    "chunk_id": 1,
+                    "content": 1,
+                    "score": {"$meta": "searchScore"},
+                    "source_file": 1,
+                    "page_number": 1,
+                    "subject": 1,
+                    "grade": 1,
+                    "metadata": 1
+                }
+            }
+        ]
+        values = _filter_values(filters)
+        if values:
+            # Lọc sau $search: knn có thể trả về ít hơn k kết quả
+            pipeline.append({"$match": {"$and": [
+                {"$or": [{name: {"$in": allowed}}, {f"metadata.{name}": {"$in": allowed}}]}
+                for name, allowed in values.items()
+            ]}})
+        pipeline.append({"$limit": k})
+        return list(self.collection.aggregate(pipeline))
+
+    def search(self, vector: List[float], k: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        return self._run({"knnBeta": {"vector": vector, "path": "embedding", "k": k}}, k, filters)
+
+    def text_search(self, query: str, k: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        if not self.text_index:
+            return []
+        return self._run({"compound": {"should": [
+            {"text": {"query": query, "path": "keywords", "score": {"boost": {"value": KEYWORDS_BOOST}}}},
+            {"text": {"query": query, "path": "content"}},
+        ]}}, k, filters, index=self.text_index)
+
+    def vector_scores(self, vector: List[float], doc_ids: Iterable[str]) -> Dict[str, float]:
+        from bson import ObjectId
+        ids = [ObjectId(i) if ObjectId.is_valid(i) else i for i in doc_ids]
+        if not ids:
+            return {}
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        scores = {}
+        for doc in self.collection.find({"_id": {"$in": ids}}, {"embedding": 1}):
+            embedding = np.asarray(doc.get("embedding") or [], dtype=np.float32)
+            if embedding.shape != query.shape:
+                continue
+            cosine = float(embedding @ query) / max(float(np.linalg.norm(embedding)), 1e-12)
+            # Cùng thang với knnBeta trên index cosine: (1 + cos) / 2
+            scores[str(doc["_id"])] = (1.0 + cosine) / 2.0
+        return scores
+
+    def add(self, docs: Iterable[Dict[str, Any]]) -> int:
+        docs = list(docs)
+        if not docs:
+            return 0
+        return len(self.collection.insert_many(docs).inserted_ids)
+
+    def delete(self, doc_ids: Iterable[str]) -> int:
+        from bson import ObjectId
+        ids = [ObjectId(i) if ObjectId.is_valid(i) else i for i in doc_ids]
+        return self.collection.delete_many({"_id": {"$in": ids}}).deleted_count
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Store trong process, không cần mạng: vector float32 (đã chuẩn hóa) trong file
+    memory-mapped, metadata + nội dung chunk trong SQLite. Ít chunk thì search
+    exact; từ IVF_MIN_ROWS chunk thì train IVF (k-means cầu) và chỉ quét
+    `nprobe` cụm gần nhất. Thêm / xóa từng chunk được (xóa = đánh dấu).
+    Score = (1 + cosine) / 2, cùng thang với Atlas knnBeta (cosine).
+
+    Nhiều process (worker gunicorn, CLI sync) dùng chung một thư mục được: mỗi lần
+    ghi giữ khóa ghi của SQLite (BEGIN IMMEDIATE), cấp dòng mới từ MAX(row) trên
+    đĩa và gắn số version; process khác thấy PRAGMA data_version đổi thì đọc lại
+    các dòng có version mới hơn. Chỉ process đang giữ khóa ghi mới nới file vector.
+    """
+
+    def __init__(self, path: str = LOCAL_STORE_PATH, nprobe: int = IVF_NPROBE, ivf_min_rows: int = IVF_MIN_ROWS):
+        self.path = path
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._writing = False
+        self._conn = sqlite3.connect(os.path.join(path, "chunks.sqlite"), timeout=60,
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                chunk_id TEXT,
+                content TEXT,
+                source_file TEXT,
+                page_number INTEGER,
+                subject TEXT,
+                grade TEXT,
+                list_id INTEGER NOT NULL DEFAULT -1,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        if "version" not in columns:
+            # Store tạo trước khi hỗ trợ nhiều process
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks (doc_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_version ON chunks (version)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._fts = self._create_fts()
+
+        self._sync_thread: Optional[threading.Thread] = None
+        self._load()
+
+    def _create_fts(self) -> bool:
+        """Index lexical (SQLite FTS5, rowid = row); giữ nguyên dấu tiếng Việt khi tách từ"""
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5("
+                "keywords, content, tokenize = 'unicode61 remove_diacritics 0')"
+            )
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite không hỗ trợ FTS5, tắt text search local: {e}")
+            return False
+        # Store tạo trước khi có FTS → index lại nội dung các chunk đang có
+        if self._conn.execute("SELECT 1 FROM chunks_fts LIMIT 1").fetchone() is None:
+            self._conn.execute(
+                "INSERT INTO chunks_fts (rowid, keywords, content) SELECT row, '', content FROM chunks WHERE deleted = 0"
+            )
+        return True
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _centroids_path(self) -> str:
+        return os.path.join(self.path, "centroids.npy")
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: Any):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load(self):
+        """Đọc lại trạng thái trong bộ nhớ (cờ còn sống, cụm IVF, trường lọc) từ SQLite"""
+        with self._lock:
+            self.dim = 0
+            self._version = 0
+            self._ivf_version = None
+            self._centroids: Optional[np.ndarray] = None
+            self._count = 0
+            self._capacity = 0
+            self._vectors: Optional[np.memmap] = None
+            self._alive = np.zeros(0, dtype=bool)
+            self._lists = np.zeros(0, dtype=np.int32)
+            self._fields = {name: np.zeros(0, dtype=object) for name in FILTER_FIELDS}
+            self._rows: Dict[str, int] = {}
+            self._masks: Dict[tuple, np.ndarray] = {}
+            self._seen_data_version = self._data_version()
+            # Đọc trong một transaction → snapshot nhất quán dù process khác đang ghi
+            self._conn.execute("BEGIN")
+            try:
+                self._refresh()
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _refresh(self):
+        """Cập nhật trạng thái trong bộ nhớ theo các dòng có version mới hơn lần đọc trước"""
+        if not self.dim:
+            self.dim = int(self.get_meta("dim") or 0)
+        ivf_version = self.get_meta("ivf_version")
+        if ivf_version != self._ivf_version:
+            self._ivf_version = ivf_version
+            self._centroids = np.load(self._centroids_path) if os.path.exists(self._centroids_path) else None
+
+        changed = self._conn.execute(
+            f"SELECT row, doc_id, list_id, deleted, version, {', '.join(FILTER_FIELDS)} FROM chunks "
+            f"WHERE version > ? OR row >= ? ORDER BY row",
+            (self._version, self._count)
+        ).fetchall()
+        self._version = max([self._version, int(self.get_meta("version") or 0)] + [r[4] for r in changed])
+        if not changed:
+            return
+        self._count = max(self._count, changed[-1][0] + 1)
+        self._reserve(self._count, grow=False)
+        for row, doc_id, list_id, deleted, _, *fields in changed:
+            self._alive[row] = not deleted
+            self._lists[row] = list_id
+            for name, value in zip(FILTER_FIELDS, fields):
+                self._fields[name][row] = value or ""
+            if not deleted:
+                self._rows[doc_id] = row
+            elif self._rows.get(doc_id) == row:
+                del self._rows[doc_id]
+        self._masks.clear()
+
+    def _sync(self):
+        """Gọi trước mỗi lần đọc: process khác vừa ghi thì đọc lại phần thay đổi"""
+        data_version = self._data_version()
+        if data_version != self._seen_data_version:
+            self._seen_data_version = data_version
+            self._conn.execute("BEGIN")
+            try:
+                self._refresh()
+            finally:
+                self._conn.execute("COMMIT")
+
+    @contextmanager
+    def _write(self):
+        """Khóa ghi giữa các process (BEGIN IMMEDIATE) + giữa các luồng; commit khi xong"""
+        with self._lock:
+            if self._writing:
+                yield
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._writing = True
+            try:
+                self._refresh()
+                self._write_version = self._version + 1
+                yield
+                if self._vectors is not None:
+                    self._vectors.flush()
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                                   (str(self._write_version),))
+                self._conn.execute("COMMIT")
+                self._version = self._write_version
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                # Trạng thái trong bộ nhớ có thể đã đổi một nửa → đọc lại từ đầu
+                self._writing = False
+                self._load()
+                raise
+            finally:
+                self._writing = False
+                self._seen_data_version = self._data_version()
+
+    def _file_rows(self) -> int:
+        if not self.dim or not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // (self.dim * 4)
+
+    def _reserve(self, rows: int, grow: bool = True):
+        """
+        Map file vector đủ `rows` dòng. Chỉ writer (đang giữ khóa ghi) được nới file
+        (gấp đôi); process chỉ đọc map theo kích thước file writer đã tạo
+        """
+        if rows <= self._capacity or not self.dim:
+            return
+        file_rows = self._file_rows()
+        if file_rows >= rows:
+            capacity = file_rows
+        elif grow:
+            capacity = max(rows, file_rows * 2, 1024)
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(capacity * self.dim * 4)
+        else:
+            raise RuntimeError(f"File vector có {file_rows} dòng, store cần {rows} dòng")
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._alive = np.concatenate([self._alive, np.zeros(capacity - self._capacity, dtype=bool)])
+        self._lists = np.concatenate([self._lists, np.full(capacity - self._capacity, -1, dtype=np.int32)])
+        for name in FILTER_FIELDS:
+            self._fields[name] = np.concatenate([self._fields[name], np.full(capacity - self._capacity, "", dtype=object)])
+        self._capacity = capacity
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._rows)
+
+    def add(self, docs: Iterable[Dict[str, Any]]) -> int:
+        docs = [doc for doc in docs if doc.get("embedding") is not None]
+        if not docs:
+            return 0
+
+        vectors = np.asarray([doc["embedding"] for doc in docs], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1.0)
+
+        with self._write():
+            if not self.dim:
+                self.dim = vectors.shape[1]
+                self.set_meta("dim", self.dim)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector {vectors.shape[1]} chiều, store đang dùng {self.dim} chiều")
+
+            # Chunk đã có (cùng doc_id) → thay bằng bản mới
+            self.delete([_doc_id(doc) for doc in docs])
+
+            # Dòng mới cấp từ trạng thái trên đĩa (process khác có thể vừa thêm)
+            start = self._conn.execute("SELECT COALESCE(MAX(row), -1) + 1 FROM chunks").fetchone()[0]
+            self._reserve(start + len(docs))
+            self._vectors[start:start + len(docs)] = vectors
+            lists = self._assign(vectors)
+
+            records = []
+            for offset, doc in enumerate(docs):
+                row = start + offset
+                doc_id = _doc_id(doc)
+                fields = {name: _field(doc, name) for name in FILTER_FIELDS}
+                page = doc.get("page_number")
+                records.append((
+                    row, doc_id, str(doc.get("chunk_id", "")), doc.get("content", ""),
+                    page if isinstance(page, int) else None,
+                    fields["source_file"], fields["subject"], fields["grade"], int(lists[offset]),
+                    self._write_version
+                ))
+                self._alive[row] = True
+                self._lists[row] = lists[offset]
+                for name, value in fields.items():
+                    self._fields[name][row] = value
+                self._rows[doc_id] = row
+            self._conn.executemany(
+                "INSERT INTO chunks (row, doc_id, chunk_id, content, page_number, source_file, subject, grade, "
+                "list_id, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records
+            )
+            if self._fts:
+                self._conn.executemany(
+                    "INSERT INTO chunks_fts (rowid, keywords, content) VALUES (?, ?, ?)",
+                    [(start + offset, _keywords(doc), doc.get("content", "")) for offset, doc in enumerate(docs)]
+                )
+            self._count = start + len(docs)
+            self._masks.clear()
+
+            trained_rows = int(self.get_meta("trained_rows") or 0)
+            if len(self._rows) >= self.ivf_min_rows and (self._centroids is None or len(self._rows) > 4 * trained_rows):
+                self.train()
+        return len(docs)
+
+    def delete(self, doc_ids: Iterable[str]) -> int:
+        with self._write():
+            rows = [self._rows.pop(doc_id) for doc_id in set(doc_ids) if doc_id in self._rows]
+            if not rows:
+                return 0
+            self._alive[rows] = False
+            self._conn.executemany("UPDATE chunks SET deleted = 1, version = ? WHERE row = ?",
+                                   [(self._write_version, row) for row in rows])
+            if self._fts:
+                self._conn.executemany("DELETE FROM chunks_fts WHERE rowid = ?", [(row,) for row in rows])
+            self._masks.clear()
+        return len(rows)
+
+    def doc_ids(self) -> List[str]:
+        with self._lock:
+            self._sync()
+            return list(self._rows)
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.full(len(vectors), -1, dtype=np.int32)
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def train(self, nlist: int = None, sample: int = 50000, iterations: int = 10, seed: int = 0):
+        """Train IVF (k-means cầu) trên mẫu các vector còn sống rồi gán cụm cho toàn bộ"""
+        with self._write():
+            alive = np.flatnonzero(self._alive[:self._count])
+            if len(alive) == 0:
+                return
+            nlist = nlist or max(1, int(4 * np.sqrt(len(alive))))
+            rng = np.random.default_rng(seed)
+            data = np.asarray(self._vectors[rng.choice(alive, size=min(sample, len(alive)), replace=False)])
+            nlist = min(nlist, len(data))
+
+            centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = np.argmax(data @ centroids.T, axis=1)
+                for i in range(nlist):
+                    members = data[assignment == i]
+                    if len(members):
+                        centroids[i] = members.sum(axis=0)
+                centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+            self._centroids = centroids.astype(np.float32)
+            # Ghi file tạm rồi rename → process khác không đọc phải file ghi dở
+            tmp_path = f"{self._centroids_path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, self._centroids)
+            os.replace(tmp_path, self._centroids_path)
+            self._ivf_version = str(self._write_version)
+            self.set_meta("ivf_version", self._ivf_version)
+
+            lists = np.full(self._count, -1, dtype=np.int32)
+            for start in range(0, len(alive), 8192):
+                block = alive[start:start + 8192]
+                lists[block] = self._assign(np.asarray(self._vectors[block]))
+            self._lists[:self._count] = lists
+            self._conn.executemany(
+                "UPDATE chunks SET list_id = ?, version = ? WHERE row = ?",
+                [(int(lists[row]), self._write_version, int(row)) for row in alive]
+            )
+            self.set_meta("trained_rows", len(alive))
+            print(f"🧭 Vector store: train IVF {nlist} cụm trên {len(data)} vector")
+
+    def _mask(self, filters: Dict[str, List[str]]) -> np.ndarray:
+        key = tuple(sorted((name, tuple(values)) for name, values in filters.items()))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._alive[:self._count].copy()
+            for name, values in filters.items():
+                mask &= np.isin(self._fields[name][:self._count], values)
+            self._masks[key] = mask
+        return mask
+
+    def search(self, vector: List[float], k: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+
+        with self._lock:
+            self._sync()
+            if not self._rows:
+                return []
+            mask = self._mask(_filter_values(filters))
+            if self._centroids is not None:
+                probe = np.argsort(self._centroids @ query)[-self.nprobe:]
+                candidates = np.flatnonzero(mask & np.isin(self._lists[:self._count], probe))
+                # Cụm gần nhất không đủ k chunk hợp lệ (vd: bộ lọc hẹp) → quét hết phần hợp lệ
+                if len(candidates) < k:
+                    candidates = np.flatnonzero(mask)
+            else:
+                candidates = np.flatnonzero(mask)
+            if len(candidates) == 0:
+                return []
+
+            scores = self._vectors[candidates] @ query
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            rows = [int(candidates[i]) for i in top]
+            found = {
+                row: values for row, *values in self._conn.execute(
+                    f"SELECT row, doc_id, {', '.join(RESULT_FIELDS)} FROM chunks "
+                    f"WHERE row IN ({','.join('?' * len(rows))})", rows
+                )
+            }
+
+        results = []
+        for i, row in zip(top, rows):
+            result = dict(zip(("_id",) + RESULT_FIELDS, found[row]))
+            result["score"] = (1.0 + float(scores[i])) / 2.0
+            results.append(result)
+        return results
+
+    @property
+    def supports_text_search(self) -> bool:
+        return self._fts
+
+    def vector_scores(self, vector: List[float], doc_ids: Iterable[str]) -> Dict[str, float]:
+        query = np.asarray(vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            self._sync()
+            rows = {doc_id: self._rows[doc_id] for doc_id in doc_ids if doc_id in self._rows}
+            if not rows:
+                return {}
+            scores = self._vectors[list(rows.values())] @ query
+        return {doc_id: (1.0 + float(score)) / 2.0 for doc_id, score in zip(rows, scores)}
+
+    def text_search(self, query: str, k: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        terms = list(dict.fromkeys(re.findall(r"\w+", query.lower())))
+        if not self._fts or not terms:
+            return []
+        where, params = ["chunks_fts MATCH ?", "c.deleted = 0"], [" OR ".join(f'"{term}"' for term in terms)]
+        for name, allowed in _filter_values(filters).items():
+            where.append(f"c.{name} IN ({','.join('?' * len(allowed))})")
+            params.extend(allowed)
+
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT c.doc_id, {', '.join('c.' + field for field in RESULT_FIELDS)}, "
+                f"bm25(chunks_fts, ?, 1.0) AS rank "
+                f"FROM chunks_fts JOIN chunks c ON c.row = chunks_fts.rowid "
+                f"WHERE {' AND '.join(where)} ORDER BY rank LIMIT ?",
+                (KEYWORDS_BOOST, *params, k)
+            ).fetchall()
+
+        results = []
+        for doc_id, *values, rank in rows:
+            result = dict(zip(("_id",) + RESULT_FIELDS, [doc_id, *values]))
+            result["score"] = -float(rank)  # bm25() của FTS5: càng âm càng khớp
+            results.append(result)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            return {
+                "chunks": len(self._rows),
+                "deleted_rows": int(self._count - len(self._rows)),
+                "dim": self.dim,
+                "ivf_lists": 0 if self._centroids is None else len(self._centroids),
+                "last_sync": self.get_meta("last_sync"),
+            }
+
+
+def get_local_vector_store(path: str = None) -> LocalVectorStore:
+    """LocalVectorStore dùng chung trong process (search và embed_and_store_chunks cùng một bản)"""
+    path = path or LOCAL_STORE_PATH
+    return get_shared(("vector_store", os.path.abspath(path)), lambda: LocalVectorStore(path))
+
+
+def load_chunk_files(store: VectorStore, pattern: str = "output_chunks/*.json") -> int:
+    """Nạp các file chunk đã embedding (vd: output_chunks/*.json) vào store"""
+    added = 0
+    for file_path in sorted(glob.glob(pattern)):
+        with open(file_path, encoding="utf-8") as f:
+            added += store.add(json.load(f))
+    return added
+
+
+def sync_from_mongo(store: LocalVectorStore, collection, batch_size: int = 1000, prune: bool = True) -> Dict[str, int]:
+    """
+    Đồng bộ store với collection Mongo: thêm các document mới hơn lần sync trước
+    (theo _id), prune=True thì xóa các chunk không còn trong collection
+    """
+    from bson import ObjectId
+
+    query = {"embedding": {"$exists": True}}
+    last_id = store.get_meta("last_mongo_id")
+    if last_id:
+        query["_id"] = {"$gt": ObjectId(last_id)}
+
+    added = 0
+    batch = []
+    for doc in collection.find(query).sort("_id", 1).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            added += store.add(batch)
+            store.set_meta("last_mongo_id", batch[-1]["_id"])
+            batch = []
+    if batch:
+        added += store.add(batch)
+        store.set_meta("last_mongo_id", batch[-1]["_id"])
+
+    removed = 0
+    if prune:
+        remote = {str(doc["_id"]) for doc in collection.find({}, {"_id": 1})}
+        removed = store.delete([doc_id for doc_id in store.doc_ids() if doc_id not in remote])
+
+    store.set_meta("last_sync", time.time())
+    if added or removed:
+        print(f"🔄 Vector store: +{added} / -{removed} chunks từ Mongo")
+    return {"added": added, "removed": removed}
+
+
+def start_periodic_sync(store: LocalVectorStore, collection, interval: float) -> threading.Thread:
+    """Luồng nền sync_from_mongo mỗi `interval` giây (mỗi store chỉ một luồng)"""
+    with store._lock:
+        if store._sync_thread is not None:
+            return store._sync_thread
+
+        def run():
+            while True:
+                try:
+                    sync_from_mongo(store, collection)
+                except Exception as e:
+                    logger.warning(f"Vector store sync failed: {e}")
+                time.sleep(interval)
+
+        store._sync_thread = threading.Thread(target=run, name="vector-store-sync", daemon=True)
+        store._sync_thread.start()
+        return store._sync_thread
+
+
+def create_vector_store(collection=None, search_index: str = "default", kind: str = None) -> VectorStore:
+    """Chọn store theo VECTOR_STORE=atlas|local (local: VECTOR_STORE_SYNC_SECONDS > 0 → sync định kỳ từ Mongo)"""
+    kind = (kind or os.environ.get("VECTOR_STORE", "atlas")).lower()
+    if kind == "atlas":
+        return AtlasVectorStore(collection, search_index)
+    if kind == "local":
+        store = get_local_vector_store()
+        interval = float(os.environ.get("VECTOR_STORE_SYNC_SECONDS", "0"))
+        if interval > 0 and collection is not None:
+            start_periodic_sync(store, collection, interval)
+        return store
+    raise ValueError(f"Unknown VECTOR_STORE: {kind}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build / đồng bộ vector store local")
+    parser.add_argument("--path", default=LOCAL_STORE_PATH)
+    parser.add_argument("--from-files", help="glob các file chunk đã embedding, vd: 'output_chunks/*.json'")
+    parser.add_argument("--from-mongo", action="store_true", help="đồng bộ từ collection lectures")
+    parser.add_argument("--watch", type=float, default=0, help="sync từ Mongo mỗi N giây (chạy liên tục)")
+    parser.add_argument("--train", action="store_true", help="train lại IVF sau khi nạp")
+    args = parser.parse_args()
+
+    store = LocalVectorStore(args.path)
+    if args.from_files:
+        print(f"📂 Đã nạp {load_chunk_files(store, args.from_files)} chunks từ {args.from_files}")
+
+    collection = None
+    if args.from_mongo or args.watch:
+        from pymongo import MongoClient
+        from dotenv import load_dotenv
+        load_dotenv()
+        collection = MongoClient(os.environ.get("MONGO_URI"))[os.environ.get("MONGO_DB_NAME")]["lectures"]
+        sync_from_mongo(store, collection)
+    if args.train:
+        store.train()
+    print(f"📦 {store.stats()}")
+
+    if args.watch:
+        print(f"👀 Sync từ Mongo mỗi {args.watch:.0f}s (Ctrl+C để dừng)")
+        try:
+            while True:
+                time.sleep(args.watch)
+                sync_from_mongo(store, collection)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
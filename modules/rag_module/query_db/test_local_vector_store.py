@@ -0,0 +1,93 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from modules.rag_module.query_db.VectorStore import LocalVectorStore
+
+DIM = 8
+
+
+def _docs(prefix, n, seed):
+    rng = np.random.default_rng(seed)
+    return [
+        {"_id": f"{prefix}-{i}", "content": f"{prefix} chunk {i}", "source_file": f"{prefix}.pdf",
+         "embedding": rng.normal(size=DIM).tolist()}
+        for i in range(n)
+    ]
+
+
+def _writer(path, prefix, seed, n, batch):
+    store = LocalVectorStore(path)
+    docs = _docs(prefix, n, seed)
+    for start in range(0, n, batch):
+        store.add(docs[start:start + batch])
+
+
+def test_add_search_delete(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    docs = _docs("a", 50, 0)
+    assert store.add(docs) == 50
+
+    hit = store.search(docs[7]["embedding"], k=3)[0]
+    assert hit["_id"] == "a-7" and hit["score"] == pytest.approx(1.0, abs=1e-5)
+    assert store.search(docs[7]["embedding"], k=3, filters={"source_file": "other.pdf"}) == []
+
+    assert store.delete(["a-7"]) == 1
+    assert "a-7" not in {r["_id"] for r in store.search(docs[7]["embedding"], k=3)}
+
+    # Mở lại từ đĩa: giữ đúng trạng thái
+    reopened = LocalVectorStore(str(tmp_path))
+    assert len(reopened) == 49
+    assert reopened.search(docs[8]["embedding"], k=1)[0]["_id"] == "a-8"
+
+
+def test_readd_replaces_existing_chunk(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    doc = _docs("a", 1, 0)[0]
+    store.add([doc])
+    store.add([dict(doc, content="bản mới")])
+    assert len(store) == 1
+    assert store.search(doc["embedding"], k=5)[0]["content"] == "bản mới"
+
+
+def test_ivf_search_finds_exact_neighbour(tmp_path):
+    store = LocalVectorStore(str(tmp_path), nprobe=4, ivf_min_rows=200)
+    docs = _docs("a", 300, 1)
+    store.add(docs)
+    assert store.stats()["ivf_lists"] > 0
+    assert store.search(docs[123]["embedding"], k=1)[0]["_id"] == "a-123"
+
+
+def test_concurrent_writer_processes(tmp_path):
+    path = str(tmp_path)
+    reader = LocalVectorStore(path)
+    ctx = multiprocessing.get_context("spawn")
+    writers = [ctx.Process(target=_writer, args=(path, prefix, seed, 120, 7))
+               for prefix, seed in (("p", 1), ("q", 2), ("r", 3))]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(120)
+        assert writer.exitcode == 0
+
+    # Reader mở trước khi ghi vẫn thấy đủ chunk, mỗi chunk một dòng riêng, vector đúng
+    assert len(reader) == 360
+    rows = reader._conn.execute("SELECT COUNT(DISTINCT row), COUNT(*) FROM chunks").fetchone()
+    assert rows == (360, 360)
+    for prefix, seed in (("p", 1), ("q", 2), ("r", 3)):
+        docs = _docs(prefix, 120, seed)
+        for i in (0, 59, 119):
+            assert reader.search(docs[i]["embedding"], k=1)[0]["_id"] == f"{prefix}-{i}"
+
+    # Xóa ở process khác cũng được thấy
+    deleter = ctx.Process(target=_delete, args=(path, ["p-0", "q-59"]))
+    deleter.start()
+    deleter.join(60)
+    assert deleter.exitcode == 0
+    assert len(reader) == 358
+    assert "p-0" not in set(reader.doc_ids())
+
+
+def _delete(path, doc_ids):
+    LocalVectorStore(path).delete(doc_ids)
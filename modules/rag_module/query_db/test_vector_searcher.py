@@ -0,0 +1,69 @@
+import types
+
+import numpy as np
+import pytest
+
+from modules.rag_module.query_db.VectorSearcher import VectorSearcher
+from modules.rag_module.query_db.VectorStore import LocalVectorStore
+
+QUERY = "Bài 12 quang hợp"
+QUERY_VECTOR = [1.0, 0.0, 0.0, 0.0]
+
+DOCS = [
+    {"_id": "a", "content": "Khái niệm diệp lục ở lá cây xanh", "embedding": [1.0, 0.0, 0.0, 0.0]},
+    {"_id": "b", "content": "Bài 12 quang hợp và hô hấp", "keywords": ["bài 12"], "embedding": [0.6, 0.8, 0.0, 0.0]},
+    # Khớp lexical nhưng vector ngược hướng → phải bị ngưỡng relevance loại
+    {"_id": "c", "content": "Bài 12 lịch sử thế giới cận đại", "embedding": [-1.0, 0.05, 0.0, 0.0]},
+    {"_id": "d", "content": "Hóa học hữu cơ cơ bản", "embedding": [0.0, 1.0, 0.0, 0.0]},
+]
+
+
+def _expected_score(doc_id):
+    vector = np.asarray(next(d["embedding"] for d in DOCS if d["_id"] == doc_id))
+    cosine = float(vector @ np.asarray(QUERY_VECTOR)) / float(np.linalg.norm(vector))
+    return (1.0 + cosine) / 2.0
+
+
+@pytest.fixture
+def searcher(tmp_path, request):
+    store = LocalVectorStore(str(tmp_path / "store"))
+    store.add([dict(doc) for doc in DOCS])
+    searcher = VectorSearcher(None, None, "lectures", embedding_model=f"test-model-{request.node.name}",
+                              top_k=3, relevance_threshold=0.2, store=store, hybrid=True)
+    searcher.model = types.SimpleNamespace(encode=lambda texts, **kwargs: np.asarray([QUERY_VECTOR] * len(texts)))
+    return searcher
+
+
+def test_hybrid_keeps_vector_similarity_in_score(searcher):
+    results = searcher.search(QUERY)
+
+    assert results
+    for result in results:
+        doc_id = next(d["_id"] for d in DOCS if d["content"] == result.content)
+        assert result.score == pytest.approx(_expected_score(doc_id), abs=1e-5)
+        assert result.rrf_score is not None
+
+
+def test_hybrid_orders_by_rrf_and_applies_threshold_to_lexical_hits(searcher):
+    results = searcher.search(QUERY)
+    contents = [r.content for r in results]
+
+    assert [r.rrf_score for r in results] == sorted((r.rrf_score for r in results), reverse=True)
+    # b khớp cả hai nhánh → đứng đầu dù điểm vector thấp hơn a
+    assert contents[0] == DOCS[1]["content"]
+    assert DOCS[2]["content"] not in contents
+    assert all(r.score >= searcher.relevance_threshold for r in results)
+
+
+def test_hybrid_is_opt_in(monkeypatch, tmp_path):
+    monkeypatch.delenv("VECTOR_SEARCH_HYBRID", raising=False)
+    searcher = VectorSearcher(None, None, "lectures", store=LocalVectorStore(str(tmp_path / "store")))
+    assert searcher.hybrid is False
+
+
+def test_atlas_text_leg_needs_text_index():
+    from modules.rag_module.query_db.VectorStore import AtlasVectorStore
+
+    store = AtlasVectorStore(collection=None, text_index="")
+    assert store.supports_text_search is False
+    assert store.text_search("Bài 12", 5) == []
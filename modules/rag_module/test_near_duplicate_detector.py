@@ -0,0 +1,49 @@
+import numpy as np
+
+from modules.rag_module.NearDuplicateDetector import NearDuplicateDetector, _lsh_params, dedupe_near_duplicates
+
+TEXT = ("Quang hợp là quá trình cây xanh sử dụng năng lượng ánh sáng để tổng hợp chất hữu cơ "
+        "từ khí cacbonic và nước, đồng thời giải phóng khí oxi ra môi trường xung quanh lá cây")
+
+
+def test_band_split_favours_recall():
+    bands, rows = _lsh_params(0.8, 128)
+    assert (bands, rows) == (16, 8)
+    assert (1.0 / bands) ** (1.0 / rows) < 0.8 - 0.05
+
+
+def test_lsh_recall_at_configured_threshold():
+    detector = NearDuplicateDetector(threshold=0.8)
+    rng = np.random.default_rng(0)
+    caught = 0
+    trials = 300
+    for trial in range(trials):
+        # Jaccard đúng bằng 0.8: 80 shingle chung, mỗi bên 10 shingle riêng
+        common = {f"{trial}-c{i}" for i in range(80)}
+        a = common | {f"{trial}-a{i}-{rng.integers(1 << 30)}" for i in range(10)}
+        b = common | {f"{trial}-b{i}-{rng.integers(1 << 30)}" for i in range(10)}
+        bands_a = detector._bands(detector._minhash(a))
+        bands_b = detector._bands(detector._minhash(b))
+        caught += any(x == y for x, y in zip(bands_a, bands_b))
+    assert caught / trials >= 0.85
+
+
+def test_formatting_variants_are_near_duplicates():
+    detector = NearDuplicateDetector()
+    assert detector.add("upload", TEXT) is None
+    variant = "  " + TEXT.upper().replace(",", " ,").replace(" và ", "   và\n") + "."
+    assert detector.add("web", variant) == "upload"
+    assert detector.add("other", "Hô hấp tế bào diễn ra ở ti thể và giải phóng năng lượng ATP cho tế bào") is None
+    assert len(detector) == 2
+
+
+def test_dedupe_keeps_highest_score_and_empty_items():
+    items = [
+        {"content": TEXT, "score": 0.5, "id": 1},
+        {"content": TEXT + " ", "score": 0.9, "id": 2},
+        {"content": "", "score": 0.1, "id": 3},
+        {"content": None, "score": 0.2, "id": 4},
+        {"content": "Một đoạn hoàn toàn khác về lịch sử Việt Nam thời Lý Trần", "score": 0.3, "id": 5},
+    ]
+    kept = dedupe_near_duplicates(items, score=lambda x: x["score"])
+    assert [item["id"] for item in kept] == [2, 5, 4, 3]
@@ -34,12 +34,155 @@ setTimeout(() => {
         addAIMessage("Không nhận được dữ liệu từ form. Vui lòng thử lại.");
     }
 
-    statusIndicator.textContent = "Sẵn sàng chat";
+    // Lấy job id của flow đang chạy nền
+    const jobElement = document.getElementById("eduJob");
+    const jobId = jobElement ? JSON.parse(jobElement.textContent) : "";
+
+    if (jobId) {
+        statusIndicator.textContent = "Đang xử lý...";
+        if (window.EventSource) {
+            streamJobEvents(jobId);
+        } else {
+            pollJob(jobId);
+        }
+    } else {
+        statusIndicator.textContent = "Sẵn sàng chat";
+    }
+
     inputField.disabled = false;
     inputField.placeholder = "Nhập tin nhắn của bạn...";
     sendBtn.disabled = false;
 }, 3000);
 
+const NODE_LABELS = {
+    generate_prompt: "Phân tích yêu cầu",
+    semantic_cache_lookup: "Tra cứu yêu cầu tương tự",
+    generate_subtopics: "Sinh các chủ đề con",
+    process_file: "Xử lý tài liệu đính kèm",
+    agent_retrieval: "Tìm kiếm tài liệu (CSDL + web)",
+    embed_store_uploaded: "Lưu tài liệu đính kèm",
+    embed_store_searched: "Lưu tài liệu tìm kiếm",
+    filter_chunks: "Lọc nội dung liên quan",
+    generate_lesson_plan: "Viết kế hoạch bài giảng",
+    semantic_cache_store: "Lưu kết quả cho lần sau"
+};
+
+// Nhận tiến độ trực tiếp qua SSE (/jobs/<id>/events)
+function streamJobEvents(jobId) {
+    const statusIndicator = document.querySelector(".status-indicator span");
+    const source = new EventSource(`/jobs/${jobId}/events`);
+    const parse = (e) => JSON.parse(e.data);
+
+    source.addEventListener("node_started", (e) => {
+        const data = parse(e);
+        statusIndicator.textContent = `${NODE_LABELS[data.node] || data.node}...`;
+    });
+
+    source.addEventListener("node_finished", (e) => {
+        const data = parse(e);
+        const partial = data.partial || {};
+        let detail = "";
+        if (partial.subtopics) {
+            detail = `<ul>${partial.subtopics.map((t) => `<li>${escapeHtml(t)}</li>`).join("")}</ul>`;
+        } else if (partial.filtered_chunks_count !== undefined) {
+            detail = ` (${partial.filtered_chunks_count} đoạn tài liệu)`;
+        }
+        addAIMessage(`✅ ${NODE_LABELS[data.node] || data.node} — ${data.duration.toFixed(1)}s${detail}`);
+    });
+
+    source.addEventListener("node_failed", (e) => {
+        const data = parse(e);
+        addAIMessage(`⚠️ ${NODE_LABELS[data.node] || data.node} lỗi: ${escapeHtml(data.error || "")}`);
+    });
+
+    source.addEventListener("outline_ready", (e) => {
+        addAIMessage(`<strong>Khung kế hoạch bài giảng:</strong><pre class="lesson-plan">${escapeHtml(parse(e).outline)}</pre>`);
+    });
+
+    // Mỗi phần bài giảng có 1 khung riêng, được điền dần theo token
+    const sectionBoxes = {};
+    const sectionBox = (section) => {
+        if (!sectionBoxes[section]) {
+            const message = addAIMessage(`<strong>${escapeHtml(section)}</strong><pre class="lesson-plan"></pre>`);
+            sectionBoxes[section] = message.querySelector(".lesson-plan");
+        }
+        return sectionBoxes[section];
+    };
+
+    source.addEventListener("section_started", (e) => {
+        sectionBox(parse(e).section);
+    });
+
+    source.addEventListener("section_delta", (e) => {
+        const data = parse(e);
+        const box = sectionBox(data.section);
+        box.textContent += data.text;
+        const chatMessages = document.getElementById("chatMessages");
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    });
+
+    source.addEventListener("section_completed", (e) => {
+        const data = parse(e);
+        sectionBox(data.section).textContent = data.content;
+    });
+
+    // Job chạy ở worker khác: chỉ nhận được trạng thái (queued → running), không có tiến độ từng node
+    source.addEventListener("job_status", (e) => {
+        statusIndicator.textContent = parse(e).status === "running" ? "Đang xử lý..." : "Đang chờ xử lý...";
+    });
+
+    const finish = () => {
+        source.close();
+        pollJob(jobId);
+    };
+    source.addEventListener("run_finished", finish);
+    source.addEventListener("run_failed", finish);
+
+    // Mất kết nối SSE (vd: job chạy ở worker khác) → quay lại poll
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            pollJob(jobId);
+        }
+    };
+}
+
+// Poll /jobs/<id>/result cho tới khi flow xử lý xong
+async function pollJob(jobId, interval = 3000) {
+    const statusIndicator = document.querySelector(".status-indicator span");
+    try {
+        const response = await fetch(`/jobs/${jobId}/result`);
+        const data = await response.json();
+
+        if (response.status === 202) {
+            setTimeout(() => pollJob(jobId, interval), interval);
+            return;
+        }
+
+        if (!response.ok) {
+            addAIMessage(`<strong>Có lỗi xảy ra:</strong> ${escapeHtml(data.details || data.error || "")}`);
+            statusIndicator.textContent = "Lỗi xử lý";
+            return;
+        }
+
+        const lessonPlan = data.lesson_plan || {};
+        if (lessonPlan.complete_markdown) {
+            addAIMessage(`<strong>Kế hoạch bài giảng đã sẵn sàng!</strong><pre class="lesson-plan">${escapeHtml(lessonPlan.complete_markdown)}</pre>`);
+        } else {
+            addAIMessage(`<strong>Không tạo được kế hoạch bài giảng.</strong> ${escapeHtml(lessonPlan.error || "")}`);
+        }
+        statusIndicator.textContent = "Sẵn sàng chat";
+    } catch (error) {
+        console.error("Lỗi khi lấy kết quả job:", error);
+        setTimeout(() => pollJob(jobId, interval), interval);
+    }
+}
+
+function escapeHtml(text) {
+    const div = document.createElement("div");
+    div.textContent = text;
+    return div.innerHTML;
+}
+
 function addAIMessage(content) {
     const chatMessages = document.getElementById("chatMessages");
     const messageDiv = document.createElement("div");
@@ -50,6 +193,7 @@ function addAIMessage(content) {
     `;
     chatMessages.appendChild(messageDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageDiv;
 }
 
 function addUserMessage(content) {
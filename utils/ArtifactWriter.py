@@ -0,0 +1,116 @@
+import os
+import uuid
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+ARTIFACT_FORMATS = ("msgpack", "json")
+
+
+def _to_plain(obj: Any) -> Any:
+    """Kiểu không serialize được (ObjectId...) → chuỗi"""
+    return str(obj)
+
+
+class ArtifactWriter:
+    """
+    Ghi artefact (vd: chunks đã embedding) ở luồng nền, định dạng gọn:
+    - msgpack: vector float32 dạng bytes (`embedding_dtype` / `embedding_dim` đi kèm)
+    - json: orjson, vector float32 dạng list số
+    Node không phải chờ ghi file; quá `max_pending` lượt ghi đang chờ thì bỏ qua lượt mới.
+    """
+
+    def __init__(self, output_dir: str = "output_chunks", fmt: str = "msgpack", max_pending: int = 4):
+        if fmt not in ARTIFACT_FORMATS:
+            raise ValueError(f"Định dạng artefact không hỗ trợ: {fmt} (chọn: {', '.join(ARTIFACT_FORMATS)})")
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._futures = set()
+        self._lock = threading.Lock()
+        self.written = 0
+        self.skipped = 0
+
+    def submit(self, name: str, chunks: List[Dict[str, Any]]) -> str:
+        """Xếp lịch ghi, trả về đường dẫn file sẽ được tạo ("" nếu bỏ qua)"""
+        if not self._slots.acquire(blocking=False):
+            self.skipped += 1
+            print(f"⚠️ Artefact writer đang bận, bỏ qua {name}")
+            return ""
+
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(self.output_dir, f"{name}_{timestamp}_{uuid.uuid4().hex[:6]}.{self.fmt}")
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifacts")
+            future = self._executor.submit(self._write, path, list(chunks))
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return path
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        self._slots.release()
+
+    def _encode(self, chunks: List[Dict[str, Any]]) -> bytes:
+        if self.fmt == "msgpack":
+            import msgpack
+            records = []
+            for chunk in chunks:
+                record = dict(chunk)
+                vector = np.asarray(record.pop("embedding", None) or [], dtype=np.float32)
+                record["embedding"] = vector.tobytes()
+                record["embedding_dtype"] = "float32"
+                record["embedding_dim"] = int(vector.shape[0])
+                records.append(record)
+            return msgpack.packb(records, default=_to_plain, use_bin_type=True)
+
+        import orjson
+        records = []
+        for chunk in chunks:
+            record = dict(chunk)
+            record["embedding"] = np.asarray(record.get("embedding") or [], dtype=np.float32)
+            records.append(record)
+        return orjson.dumps(records, default=_to_plain, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def _write(self, path: str, chunks: List[Dict[str, Any]]):
+        try:
+            data = self._encode(chunks)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.written += 1
+            print(f"\n📦 Đã lưu artefact: {path} ({len(data) / 1024:.0f} KB)")
+        except Exception as e:
+            print(f"⚠️ Không ghi được artefact {path}: {e}")
+
+    def flush(self, timeout: float = None) -> bool:
+        """Chờ các lượt ghi đang chờ (vd: trước khi tắt worker); True nếu đã xong hết"""
+        with self._lock:
+            futures = list(self._futures)
+        done, pending = wait(futures, timeout=timeout)
+        return not pending
+
+
+def load_artifact(path: str) -> List[Dict[str, Any]]:
+    """Đọc lại artefact (embedding trả về dạng list float)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".msgpack"):
+        import msgpack
+        records = msgpack.unpackb(data, raw=False)
+        for record in records:
+            dtype = record.pop("embedding_dtype", "float32")
+            record.pop("embedding_dim", None)
+            record["embedding"] = np.frombuffer(record["embedding"], dtype=dtype).tolist()
+        return records
+
+    import orjson
+    return orjson.loads(data)
@@ -0,0 +1,124 @@
+import os
+import time
+from typing import AsyncIterator, Iterator
+from openai import AsyncAzureOpenAI
+from utils.async_llm import get_runtime, current_deadline, call_with_retries, estimate_tokens, open_stream
+from utils.telemetry import current_recorder, record
+
+class AsyncGPTClient:
+    """
+    Azure OpenAI client bất đồng bộ: dùng chung connection pool, retry với
+    backoff cho 429/5xx (tôn trọng Retry-After), semaphore + token bucket
+    toàn process và truyền deadline xuống từng lời gọi.
+
+    Có cả interface sync (chat/call/chat_stream) giống GPTClient để các agent
+    dùng trực tiếp; mọi lời gọi đều chạy trên event loop nền dùng chung.
+    """
+
+    provider = "azure"
+
+    def __init__(self, api_key, endpoint, model, api_version, max_retries: int = None):
+        self.model = model
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get("LLM_MAX_RETRIES", "5"))
+        self._client_kwargs = dict(api_key=api_key, api_version=api_version, azure_endpoint=endpoint)
+        self._client = None
+
+    @property
+    def client(self) -> AsyncAzureOpenAI:
+        # Tạo lười trên loop nền để gắn với httpx pool dùng chung
+        if self._client is None:
+            self._client = AsyncAzureOpenAI(
+                **self._client_kwargs,
+                http_client=get_runtime().http_client(),
+                max_retries=0  # retry do call_with_retries đảm nhận
+            )
+        return self._client
+
+    async def _achat(self, messages, temperature, max_tokens, timeout, deadline, recorder=None):
+        async def make_call(call_timeout):
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=call_timeout
+            )
+            usage = getattr(response, "usage", None)
+            record("llm_usage", recorder, provider=self.provider, model=self.model,
+                   tokens_in=getattr(usage, "prompt_tokens", 0) or 0,
+                   tokens_out=getattr(usage, "completion_tokens", 0) or 0)
+            return response.choices[0].message.content.strip()
+
+        return await call_with_retries(
+            make_call,
+            get_runtime().limiter(self.provider),
+            estimate_tokens(messages, max_tokens),
+            deadline,
+            timeout,
+            max_retries=self.max_retries
+        )
+
+    async def _achat_stream(self, messages, temperature, max_tokens, timeout, deadline, recorder=None) -> AsyncIterator[str]:
+        async def make_call(call_timeout):
+            return await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=call_timeout,
+                stream=True
+            )
+
+        # Chỉ retry khi mở stream; khi đã nhận token thì lỗi được trả thẳng cho caller.
+        # Slot semaphore được giữ tới khi stream đọc hết / bị đóng
+        limiter = get_runtime().limiter(self.provider)
+        output_chars = 0
+        async with open_stream(make_call, limiter, estimate_tokens(messages, max_tokens), deadline, timeout,
+                               max_retries=self.max_retries) as stream:
+            try:
+                async for chunk in stream:
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise TimeoutError("LLM stream deadline exceeded")
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        output_chars += len(delta)
+                        yield delta
+            finally:
+                # Đóng kết nối khi xong / lỗi / caller bỏ dở
+                await stream.close()
+                # Stream không trả usage → ước lượng (≈ 4 ký tự / token)
+                record("llm_usage", recorder, provider=self.provider, model=self.model,
+                       tokens_in=estimate_tokens(messages, 0), tokens_out=output_chars // 4, estimated=True)
+
+    # ----- async API -----
+    async def achat(self, messages, temperature=0.3, max_tokens=1500, timeout=30, deadline=None):
+        deadline = deadline if deadline is not None else current_deadline()
+        return await get_runtime().run_async(self._achat(messages, temperature, max_tokens, timeout, deadline, current_recorder()))
+
+    async def acall(self, prompt: str, temperature=0.3, max_tokens=1500, timeout=30, deadline=None):
+        return await self.achat([{"role": "user", "content": prompt}], temperature, max_tokens, timeout, deadline)
+
+    async def achat_stream(self, messages, temperature=0.3, max_tokens=1500, timeout=30, deadline=None) -> AsyncIterator[str]:
+        deadline = deadline if deadline is not None else current_deadline()
+        async for delta in get_runtime().aiterate(self._achat_stream(messages, temperature, max_tokens, timeout, deadline, current_recorder())):
+            yield delta
+
+    # ----- sync API (tương thích GPTClient) -----
+    def chat(self, messages, temperature=0.3, max_tokens=1500, timeout=30, deadline=None):
+        deadline = deadline if deadline is not None else current_deadline()
+        return get_runtime().run(self._achat(messages, temperature, max_tokens, timeout, deadline, current_recorder()))
+
+    def chat_stream(self, messages, temperature=0.3, max_tokens=1500, timeout=30, deadline=None) -> Iterator[str]:
+        deadline = deadline if deadline is not None else current_deadline()
+        return get_runtime().iterate(self._achat_stream(messages, temperature, max_tokens, timeout, deadline, current_recorder()))
+
+    def call(self, prompt: str, temperature=0.3, max_tokens=1500, timeout=30, deadline=None):
+        return self.chat(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            deadline=deadline
+        )
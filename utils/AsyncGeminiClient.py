@@ -0,0 +1,109 @@
+import os
+import time
+from typing import List, Dict, AsyncIterator, Iterator
+from utils.GeminiClient import GeminiClient
+from utils.async_llm import get_runtime, current_deadline, call_with_retries, estimate_tokens, open_stream
+from utils.telemetry import current_recorder, record
+
+class AsyncGeminiClient(GeminiClient):
+    """
+    Gemini client bất đồng bộ, cùng cơ chế với AsyncGPTClient: retry/backoff
+    cho 429/5xx, semaphore + token bucket riêng của provider "gemini" và deadline.
+    """
+
+    provider = "gemini"
+
+    def __init__(self, api_key: str, model: str = "gemini-2.5-flash", max_retries: int = None):
+        super().__init__(api_key=api_key, model=model)
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get("LLM_MAX_RETRIES", "5"))
+
+    async def _achat(self, messages, temperature, max_tokens, timeout, deadline, recorder=None):
+        async def make_call(call_timeout):
+            response = await self.model.generate_content_async(
+                self._to_gemini_messages(messages),
+                generation_config=self._generation_config(temperature, max_tokens),
+                request_options={"timeout": call_timeout}
+            )
+            usage = getattr(response, "usage_metadata", None)
+            record("llm_usage", recorder, provider=self.provider, model=self.model.model_name,
+                   tokens_in=getattr(usage, "prompt_token_count", 0) or 0,
+                   tokens_out=getattr(usage, "candidates_token_count", 0) or 0)
+            return response.text.strip()
+
+        try:
+            return await call_with_retries(
+                make_call,
+                get_runtime().limiter(self.provider),
+                estimate_tokens(messages, max_tokens),
+                deadline,
+                timeout,
+                max_retries=self.max_retries
+            )
+        except Exception as e:
+            raise Exception(f"Gemini API error: {str(e)}")
+
+    async def _achat_stream(self, messages, temperature, max_tokens, timeout, deadline, recorder=None) -> AsyncIterator[str]:
+        async def make_call(call_timeout):
+            return await self.model.generate_content_async(
+                self._to_gemini_messages(messages),
+                generation_config=self._generation_config(temperature, max_tokens),
+                request_options={"timeout": call_timeout},
+                stream=True
+            )
+
+        # Slot semaphore được giữ tới khi stream đọc hết / bị đóng
+        limiter = get_runtime().limiter(self.provider)
+        output_chars = 0
+        async with open_stream(make_call, limiter, estimate_tokens(messages, max_tokens), deadline, timeout,
+                               max_retries=self.max_retries) as response:
+            try:
+                async for chunk in response:
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise TimeoutError("LLM stream deadline exceeded")
+                    text = self._chunk_text(chunk)
+                    if text:
+                        output_chars += len(text)
+                        yield text
+            finally:
+                usage = getattr(response, "usage_metadata", None)
+                record("llm_usage", recorder, provider=self.provider, model=self.model.model_name,
+                       tokens_in=getattr(usage, "prompt_token_count", 0) or estimate_tokens(messages, 0),
+                       tokens_out=getattr(usage, "candidates_token_count", 0) or output_chars // 4,
+                       estimated=not usage)
+
+    # ----- async API -----
+    async def achat(self, messages: List[Dict[str, str]], temperature: float = 0.3,
+                    max_tokens: int = 1500, timeout: int = 30, deadline: float = None) -> str:
+        deadline = deadline if deadline is not None else current_deadline()
+        return await get_runtime().run_async(self._achat(messages, temperature, max_tokens, timeout, deadline, current_recorder()))
+
+    async def acall(self, prompt: str, temperature: float = 0.3,
+                    max_tokens: int = 1500, timeout: int = 30, deadline: float = None) -> str:
+        return await self.achat([{"role": "user", "content": prompt}], temperature, max_tokens, timeout, deadline)
+
+    async def achat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.3,
+                           max_tokens: int = 1500, timeout: int = 30, deadline: float = None) -> AsyncIterator[str]:
+        deadline = deadline if deadline is not None else current_deadline()
+        async for delta in get_runtime().aiterate(self._achat_stream(messages, temperature, max_tokens, timeout, deadline, current_recorder())):
+            yield delta
+
+    # ----- sync API (tương thích GeminiClient) -----
+    def chat(self, messages: List[Dict[str, str]], temperature: float = 0.3,
+             max_tokens: int = 1500, timeout: int = 30, deadline: float = None) -> str:
+        deadline = deadline if deadline is not None else current_deadline()
+        return get_runtime().run(self._achat(messages, temperature, max_tokens, timeout, deadline, current_recorder()))
+
+    def chat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.3,
+                    max_tokens: int = 1500, timeout: int = 30, deadline: float = None) -> Iterator[str]:
+        deadline = deadline if deadline is not None else current_deadline()
+        return get_runtime().iterate(self._achat_stream(messages, temperature, max_tokens, timeout, deadline, current_recorder()))
+
+    def call(self, prompt: str, temperature: float = 0.3,
+             max_tokens: int = 1500, timeout: int = 30, deadline: float = None) -> str:
+        return self.chat(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            deadline=deadline
+        )
@@ -1,4 +1,5 @@
-from openai import AzureOpenAI
+from typing import AsyncIterator, Iterator
+from openai import AzureOpenAI, AsyncAzureOpenAI
 
 class GPTClient:
     def __init__(self, api_key, endpoint, model, api_version):
@@ -8,6 +9,8 @@ class GPTClient:
             azure_endpoint=endpoint
         )
         self.model = model
+        self._client_kwargs = dict(api_key=api_key, api_version=api_version, azure_endpoint=endpoint)
+        self._async_client = None
 
     def chat(self, messages, temperature=0.3, max_tokens=1500, timeout=30):
         response = self.client.chat.completions.create(
@@ -19,6 +22,43 @@ class GPTClient:
         )
         return response.choices[0].message.content.strip()
 
+    def chat_stream(self, messages, temperature=0.3, max_tokens=1500, timeout=30) -> Iterator[str]:
+        """Như chat() nhưng yield từng đoạn text ngay khi model sinh ra"""
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            stream=True
+        )
+        for chunk in stream:
+            # Azure có thể gửi chunk rỗng (vd: kết quả content filter)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    async def achat_stream(self, messages, temperature=0.3, max_tokens=1500, timeout=30) -> AsyncIterator[str]:
+        """Phiên bản async iterator của chat_stream()"""
+        if self._async_client is None:
+            self._async_client = AsyncAzureOpenAI(**self._client_kwargs)
+        stream = await self._async_client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            stream=True
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
     def call(self, prompt: str, temperature=0.3, max_tokens=1500, timeout=30):
         return self.chat(
             messages=[{"role": "user", "content": prompt}],
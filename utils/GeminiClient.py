@@ -1,39 +1,98 @@
 import google.generativeai as genai
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
 
 class GeminiClient:
     def __init__(self, api_key: str, model: str = "gemini-2.5-flash"):
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model)
     
+    def _to_gemini_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        # Convert OpenAI format to Gemini format
+        # Gemini không có role "system" trong contents → ghép system prompt vào đầu lượt user đầu tiên
+        system_prompt = "\n\n".join(msg["content"] for msg in messages if msg["role"] == "system" and msg["content"])
+        gemini_messages = []
+        for msg in messages:
+            if msg["role"] == "user":
+                content = msg["content"]
+                if system_prompt:
+                    content = f"{system_prompt}\n\n{content}"
+                    system_prompt = ""
+                gemini_messages.append({
+                    "role": "user",
+                    "parts": [content]
+                })
+            elif msg["role"] == "assistant":
+                gemini_messages.append({
+                    "role": "model", 
+                    "parts": [msg["content"]]
+                })
+        if system_prompt:
+            # Chỉ có system prompt (không có lượt user) → gửi như một lượt user
+            gemini_messages.insert(0, {"role": "user", "parts": [system_prompt]})
+        return gemini_messages
+
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """
+        Text của một chunk khi stream. Không dùng chunk.text: nó raise ValueError khi
+        chunk không có Part hợp lệ (chunk rỗng cuối stream, candidate bị chặn vì an toàn)
+        """
+        candidates = getattr(chunk, "candidates", None) or []
+        if not candidates:
+            return ""
+        parts = getattr(getattr(candidates[0], "content", None), "parts", None) or []
+        return "".join(getattr(part, "text", "") or "" for part in parts)
+
+    def _generation_config(self, temperature: float, max_tokens: int):
+        return genai.types.GenerationConfig(
+            temperature=temperature,
+            max_output_tokens=max_tokens,
+        )
+
     def chat(self, messages: List[Dict[str, str]], temperature: float = 0.3, 
              max_tokens: int = 1500, timeout: int = 30) -> str:
         try:
-            # Convert OpenAI format to Gemini format
-            gemini_messages = []
-            for msg in messages:
-                if msg["role"] == "user":
-                    gemini_messages.append({
-                        "role": "user",
-                        "parts": [msg["content"]]
-                    })
-                elif msg["role"] == "assistant":
-                    gemini_messages.append({
-                        "role": "model", 
-                        "parts": [msg["content"]]
-                    })
             response = self.model.generate_content(
-                gemini_messages,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperature,
-                    max_output_tokens=max_tokens,
-                )
+                self._to_gemini_messages(messages),
+                generation_config=self._generation_config(temperature, max_tokens)
             )
             
             return response.text.strip()
             
         except Exception as e:
             raise Exception(f"Gemini API error: {str(e)}")
+
+    def chat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.3,
+                    max_tokens: int = 1500, timeout: int = 30) -> Iterator[str]:
+        """Như chat() nhưng yield từng đoạn text ngay khi model sinh ra"""
+        try:
+            response = self.model.generate_content(
+                self._to_gemini_messages(messages),
+                generation_config=self._generation_config(temperature, max_tokens),
+                stream=True
+            )
+            for chunk in response:
+                text = self._chunk_text(chunk)
+                if text:
+                    yield text
+        except Exception as e:
+            raise Exception(f"Gemini API error: {str(e)}")
+
+    async def achat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.3,
+                           max_tokens: int = 1500, timeout: int = 30) -> AsyncIterator[str]:
+        """Phiên bản async iterator của chat_stream()"""
+        try:
+            response = await self.model.generate_content_async(
+                self._to_gemini_messages(messages),
+                generation_config=self._generation_config(temperature, max_tokens),
+                stream=True
+            )
+            async for chunk in response:
+                text = self._chunk_text(chunk)
+                if text:
+                    yield text
+        except Exception as e:
+            raise Exception(f"Gemini API error: {str(e)}")
     
     def call(self, prompt: str, temperature: float = 0.3, 
              max_tokens: int = 1500, timeout: int = 30) -> str:
@@ -42,4 +101,4 @@ class GeminiClient:
             temperature=temperature,
             max_tokens=max_tokens,
             timeout=timeout
-        )
\ No newline at end of file
+        )
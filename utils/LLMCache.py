@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+from utils.telemetry import record
+
+
+def _model_name(llm) -> str:
+    """Tên model của client (GPTClient.model là str, GeminiClient.model là GenerativeModel)"""
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+    if isinstance(model, str):
+        return model
+    return getattr(model, "model_name", None) or type(llm).__name__
+
+
+class LLMCache:
+    """
+    Cache prompt → response trên đĩa (SQLite), key là hash ổn định của
+    model + messages + temperature + max_tokens. Có TTL và giới hạn dung
+    lượng: khi vượt quá sẽ xóa các entry ít được dùng gần đây nhất (LRU).
+    Số entry / dung lượng được cộng dồn theo từng lần ghi (không COUNT/SUM mỗi
+    lần set); entry hết hạn được dọn và bộ đếm đồng bộ lại với đĩa mỗi
+    `evict_interval` giây (nhiều process có thể ghi chung một file).
+    """
+
+    def __init__(self, db_path: str = "cache/llm_cache.sqlite", ttl: float = 7 * 24 * 3600,
+                 max_entries: int = 20000, max_bytes: int = 200 * 1024 * 1024, evict_interval: float = 300):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache (last_access)")
+
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+        with self._lock:
+            self._sweep()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        payload = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, namespace: str = "default") -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                self._delete([key])
+                row = None
+            if row is None:
+                self._misses[namespace] += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._hits[namespace] += 1
+            return row[0]
+
+    def set(self, key: str, response: str, model: str = ""):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            if old is None:
+                self._count += 1
+                self._size += size
+            else:
+                self._size += size - old[0]
+
+            if now - self._last_sweep >= self.evict_interval:
+                self._sweep()
+            self._evict()
+
+    def _delete(self, keys: List[str]):
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            count, size = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache WHERE key IN ({placeholders})", batch
+            ).fetchone()
+            self._conn.execute(f"DELETE FROM llm_cache WHERE key IN ({placeholders})", batch)
+            self._count -= count
+            self._size -= size
+
+    def _sweep(self):
+        """Xóa entry hết hạn và đọc lại số entry / dung lượng thật trên đĩa"""
+        self._last_sweep = time.time()
+        if self.ttl:
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (self._last_sweep - self.ttl,))
+        self._count, self._size = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()
+
+    def _over_limit(self) -> bool:
+        return bool((self.max_entries and self._count > self.max_entries)
+                    or (self.max_bytes and self._size > self.max_bytes))
+
+    def _evict(self):
+        """Xóa theo LRU cho tới khi nằm trong giới hạn"""
+        while self._over_limit():
+            if self.max_entries and self._count > self.max_entries:
+                # Xóa dư thêm 1% để các lần set tiếp theo không phải evict ngay
+                batch = self._count - self.max_entries + self.max_entries // 100
+            else:
+                batch = 4
+            rows = self._conn.execute(
+                "SELECT key FROM llm_cache ORDER BY last_access LIMIT ?", (batch,)
+            ).fetchall()
+            if not rows:
+                self._count = self._size = 0
+                break
+            self._delete([r[0] for r in rows])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+            namespaces = sorted(set(self._hits) | set(self._misses))
+            per_namespace = {
+                ns: {"hits": self._hits[ns], "misses": self._misses[ns]} for ns in namespaces
+            }
+        hits = sum(v["hits"] for v in per_namespace.values())
+        misses = sum(v["misses"] for v in per_namespace.values())
+        return {
+            "entries": count,
+            "size_bytes": total_size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "namespaces": per_namespace,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._count = self._size = 0
+            self._hits.clear()
+            self._misses.clear()
+
+
+class CachedLLMClient:
+    """
+    Bọc GPTClient/GeminiClient với cùng interface chat/call/chat_stream.
+    Mỗi agent dùng một namespace riêng để đếm hit/miss.
+    """
+
+    def __init__(self, llm, cache: LLMCache, namespace: str = "default"):
+        self.llm = llm
+        self.cache = cache
+        self.namespace = namespace
+        self.model_name = _model_name(llm)
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def chat(self, messages, temperature=0.3, max_tokens=1500, timeout=30):
+        key = self.cache.make_key(self.model_name, messages, temperature, max_tokens)
+        cached = self.cache.get(key, self.namespace)
+        record("cache", cache="llm", namespace=self.namespace, hit=cached is not None)
+        if cached is not None:
+            return cached
+
+        response = self.llm.chat(messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout)
+        if response:
+            self.cache.set(key, response, self.model_name)
+        return response
+
+    def chat_stream(self, messages, temperature=0.3, max_tokens=1500, timeout=30) -> Iterator[str]:
+        key = self.cache.make_key(self.model_name, messages, temperature, max_tokens)
+        cached = self.cache.get(key, self.namespace)
+        record("cache", cache="llm", namespace=self.namespace, hit=cached is not None)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        for delta in self.llm.chat_stream(messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout):
+            parts.append(delta)
+            yield delta
+
+        response = "".join(parts).strip()
+        if response:
+            self.cache.set(key, response, self.model_name)
+
+    def call(self, prompt: str, temperature=0.3, max_tokens=1500, timeout=30):
+        return self.chat(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout
+        )
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """Cache dùng chung trong process, cấu hình qua LLM_CACHE_PATH / LLM_CACHE_TTL / LLM_CACHE_MAX_MB"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMCache(
+                db_path=os.environ.get("LLM_CACHE_PATH", "cache/llm_cache.sqlite"),
+                ttl=float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+                max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "20000")),
+                max_bytes=int(float(os.environ.get("LLM_CACHE_MAX_MB", "200")) * 1024 * 1024),
+                evict_interval=float(os.environ.get("LLM_CACHE_EVICT_INTERVAL", "300")),
+            )
+        return _shared_cache
+
+
+def cache_enabled_for(namespace: str) -> bool:
+    """
+    LLM_CACHE_AGENTS: danh sách agent bật cache, phân cách bằng dấu phẩy ("*" = tất cả).
+    Mặc định rỗng = tắt: cache trả lại đúng câu trả lời cũ, chỉ bật cho agent chấp nhận điều đó
+    """
+    agents = os.environ.get("LLM_CACHE_AGENTS", "").strip()
+    if not agents:
+        return False
+    if agents == "*":
+        return True
+    return namespace in {a.strip() for a in agents.split(",")}
+
+
+def cached_llm(llm, namespace: str):
+    """Trả về client có cache cho agent `namespace` nếu agent đó được bật, ngược lại trả về llm gốc"""
+    if llm is not None and hasattr(llm, "scoped"):
+        # LLMRouter: thống kê latency / định tuyến riêng cho từng agent
+        llm = llm.scoped(namespace)
+    if llm is None or not cache_enabled_for(namespace):
+        return llm
+    return CachedLLMClient(llm, get_llm_cache(), namespace)
@@ -0,0 +1,276 @@
+import time
+import logging
+import threading
+import contextvars
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderStats:
+    """Cửa sổ trượt các lần gọi gần nhất: latency (giây) và thành công/thất bại"""
+
+    def __init__(self, window: int = 100):
+        self.samples = deque(maxlen=window)
+        self.unhealthy_until = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self.lock:
+            self.samples.append((latency, ok))
+
+    def _latencies(self) -> List[float]:
+        return sorted(latency for latency, ok in self.samples if ok)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self.lock:
+            latencies = self._latencies()
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(q * (len(latencies) - 1))))
+        return latencies[index]
+
+    def error_rate(self) -> float:
+        with self.lock:
+            if not self.samples:
+                return 0.0
+            return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def count(self) -> int:
+        return len(self.samples)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "samples": self.count(),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "error_rate": self.error_rate(),
+            "healthy": time.time() >= self.unhealthy_until,
+        }
+
+
+class LLMRouter:
+    """
+    Client định tuyến giữa nhiều provider (vd: Azure GPT và Gemini) với cùng
+    interface chat/call/chat_stream.
+
+    - Theo dõi p50/p95 latency và tỉ lệ lỗi theo từng provider (và theo scope = agent)
+    - Mỗi lời gọi đi tới provider khỏe nhất có p95 thấp nhất
+    - Provider lỗi nhiều (error_rate >= error_threshold) bị tạm loại trong `cooldown` giây
+    - Hedging (tắt mặc định, tốn gấp đôi token khi kích hoạt): nếu provider đầu chưa
+      trả lời sau latency budget thì gửi thêm một request tới provider thứ hai và lấy
+      kết quả nào về trước; request thua bị hủy nếu chưa chạy, đang chạy thì bỏ kết quả
+    """
+
+    def __init__(self, providers: Dict[str, Any], latency_budget: float = 20.0, hedge: bool = False,
+                 window: int = 100, min_samples: int = 5, error_threshold: float = 0.5,
+                 cooldown: float = 60.0, max_workers: int = 32):
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider")
+        self.providers = dict(providers)
+        self.order = list(self.providers)
+        self.latency_budget = latency_budget
+        self.hedge = hedge and len(self.providers) > 1
+        self.window = window
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.model_name = "router(" + ",".join(self.order) + ")"
+
+        self._stats: Dict[Tuple[str, str], ProviderStats] = defaultdict(lambda: ProviderStats(self.window))
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-router")
+        self.hedged_calls = 0
+        self.hedge_wins = 0
+        self.hedge_abandoned = 0
+
+    # ----- thống kê -----
+    def _get_stats(self, scope: str, provider: str) -> ProviderStats:
+        with self._stats_lock:
+            return self._stats[(scope, provider)]
+
+    def _record(self, scope: Optional[str], provider: str, latency: float, ok: bool):
+        scopes = ["*"] if not scope else ["*", scope]
+        for s in scopes:
+            self._get_stats(s, provider).record(latency, ok)
+
+        overall = self._get_stats("*", provider)
+        if not ok and overall.count() >= self.min_samples and overall.error_rate() >= self.error_threshold:
+            overall.unhealthy_until = time.time() + self.cooldown
+            logger.warning(f"LLMRouter: provider '{provider}' unhealthy for {self.cooldown:.0f}s "
+                           f"(error_rate={overall.error_rate():.2f})")
+
+    def _scope_stats(self, scope: Optional[str], provider: str) -> ProviderStats:
+        """Thống kê theo agent nếu đủ mẫu, ngược lại dùng thống kê chung của provider"""
+        if scope:
+            scoped = self._get_stats(scope, provider)
+            if scoped.count() >= self.min_samples:
+                return scoped
+        return self._get_stats("*", provider)
+
+    def rank(self, scope: Optional[str] = None) -> List[str]:
+        """Provider theo thứ tự ưu tiên: khỏe trước, p95 thấp trước, hòa thì theo thứ tự cấu hình"""
+        now = time.time()
+
+        def key(provider):
+            overall = self._get_stats("*", provider)
+            healthy = now >= overall.unhealthy_until
+            stats = self._scope_stats(scope, provider)
+            p95 = stats.percentile(0.95) if stats.count() >= self.min_samples else None
+            # Provider chưa đủ mẫu được coi như nhanh vừa phải để vẫn được thử
+            latency = p95 if p95 is not None else self.latency_budget / 2
+            return (0 if healthy else 1, latency, self.order.index(provider))
+
+        return sorted(self.order, key=key)
+
+    def _hedge_after(self, scope: Optional[str], provider: str) -> float:
+        """Budget trước khi hedge: p95 của provider (nếu có) nhưng không thấp hơn latency_budget"""
+        stats = self._scope_stats(scope, provider)
+        p95 = stats.percentile(0.95) if stats.count() >= self.min_samples else None
+        return max(self.latency_budget, p95 or 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            keys = list(self._stats.keys())
+        per_scope = defaultdict(dict)
+        for scope, provider in keys:
+            per_scope[scope][provider] = self._get_stats(scope, provider).snapshot()
+        return {
+            "ranking": self.rank(),
+            "hedged_calls": self.hedged_calls,
+            "hedge_wins": self.hedge_wins,
+            "hedge_abandoned": self.hedge_abandoned,
+            "scopes": dict(per_scope),
+        }
+
+    # ----- gọi provider -----
+    def _timed_chat(self, scope: Optional[str], provider: str, messages, kwargs) -> str:
+        start = time.monotonic()
+        try:
+            result = self.providers[provider].chat(messages, **kwargs)
+        except Exception:
+            self._record(scope, provider, time.monotonic() - start, ok=False)
+            raise
+        self._record(scope, provider, time.monotonic() - start, ok=True)
+        return result
+
+    def _submit(self, scope: Optional[str], provider: str, messages, kwargs):
+        # Mỗi request chạy trong bản sao context của caller (giữ deadline LLM của flow)
+        ctx = contextvars.copy_context()
+        return self._executor.submit(ctx.run, self._timed_chat, scope, provider, messages, kwargs)
+
+    def _abandon(self, scope: Optional[str], pending: Dict[Any, str]):
+        """
+        Bỏ các request thua: hủy nếu chưa bắt đầu; đang chạy thì không dừng được, kết
+        quả bị bỏ qua (latency / lỗi vẫn được _timed_chat ghi vào thống kê provider)
+        """
+        for future, provider in pending.items():
+            if future.cancel():
+                continue
+            with self._stats_lock:
+                self.hedge_abandoned += 1
+            logger.info(f"LLMRouter: abandoning in-flight '{scope or '*'}' call on '{provider}'")
+        pending.clear()
+
+    def _chat(self, scope: Optional[str], messages, **kwargs) -> str:
+        ranking = self.rank(scope)
+        primary = ranking[0]
+        fallbacks = ranking[1:]
+
+        pending = {self._submit(scope, primary, messages, kwargs): primary}
+        hedged = False
+        errors = []
+
+        while pending:
+            timeout = None
+            if self.hedge and not hedged and fallbacks:
+                timeout = self._hedge_after(scope, primary)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Provider đầu quá chậm → gửi thêm request dự phòng
+                backup = fallbacks.pop(0)
+                hedged = True
+                with self._stats_lock:
+                    self.hedged_calls += 1
+                logger.info(f"LLMRouter: hedging '{scope or '*'}' call to '{backup}' "
+                            f"after {timeout:.1f}s on '{primary}'")
+                pending[self._submit(scope, backup, messages, kwargs)] = backup
+                continue
+
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(f"{provider}: {e}")
+                    continue
+                if hedged and provider != primary:
+                    with self._stats_lock:
+                        self.hedge_wins += 1
+                self._abandon(scope, pending)
+                return result
+
+            # Tất cả request đang chờ đều lỗi → failover sang provider tiếp theo
+            if not pending and fallbacks:
+                backup = fallbacks.pop(0)
+                hedged = True
+                pending[self._submit(scope, backup, messages, kwargs)] = backup
+
+        raise Exception("All LLM providers failed: " + "; ".join(errors))
+
+    def _chat_stream(self, scope: Optional[str], messages, **kwargs) -> Iterator[str]:
+        """Stream từ provider tốt nhất; chỉ failover khi lỗi trước token đầu tiên"""
+        errors = []
+        for provider in self.rank(scope):
+            client = self.providers[provider]
+            if not hasattr(client, "chat_stream"):
+                continue
+            start = time.monotonic()
+            started = False
+            try:
+                for delta in client.chat_stream(messages, **kwargs):
+                    started = True
+                    yield delta
+            except Exception as e:
+                self._record(scope, provider, time.monotonic() - start, ok=False)
+                if started:
+                    raise
+                errors.append(f"{provider}: {e}")
+                continue
+            self._record(scope, provider, time.monotonic() - start, ok=True)
+            return
+        raise Exception("All LLM providers failed: " + "; ".join(errors))
+
+    # ----- interface giống GPTClient -----
+    def chat(self, messages, temperature=0.3, max_tokens=1500, timeout=30):
+        return self._chat(None, messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout)
+
+    def chat_stream(self, messages, temperature=0.3, max_tokens=1500, timeout=30) -> Iterator[str]:
+        return self._chat_stream(None, messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout)
+
+    def call(self, prompt: str, temperature=0.3, max_tokens=1500, timeout=30):
+        return self.chat([{"role": "user", "content": prompt}], temperature, max_tokens, timeout)
+
+    def scoped(self, scope: str) -> "ScopedRouter":
+        """View của router cho một agent: thống kê và định tuyến riêng theo agent đó"""
+        return ScopedRouter(self, scope)
+
+
+class ScopedRouter:
+    def __init__(self, router: LLMRouter, scope: str):
+        self.router = router
+        self.scope = scope
+        self.model_name = router.model_name
+
+    def chat(self, messages, temperature=0.3, max_tokens=1500, timeout=30):
+        return self.router._chat(self.scope, messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout)
+
+    def chat_stream(self, messages, temperature=0.3, max_tokens=1500, timeout=30) -> Iterator[str]:
+        return self.router._chat_stream(self.scope, messages, temperature=temperature,
+                                        max_tokens=max_tokens, timeout=timeout)
+
+    def call(self, prompt: str, temperature=0.3, max_tokens=1500, timeout=30):
+        return self.chat([{"role": "user", "content": prompt}], temperature, max_tokens, timeout)
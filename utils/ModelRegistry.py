@@ -0,0 +1,132 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+VIETNAMESE_SBERT = "keepitreal/vietnamese-sbert"
+MINILM = "all-MiniLM-L6-v2"
+
+_instances: Dict[Hashable, Any] = {}
+_key_locks: Dict[Hashable, threading.Lock] = {}
+_registry_lock = threading.Lock()
+_load_times: Dict[Hashable, float] = {}
+
+
+def get_shared(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """
+    Singleton trong process cho `key`, tạo bằng factory() ở lần dùng đầu tiên.
+    Mỗi key có lock riêng: hai luồng cùng cần một model chỉ load một lần,
+    còn các model khác nhau vẫn load song song được.
+    """
+    instance = _instances.get(key)
+    if instance is not None:
+        return instance
+
+    with _registry_lock:
+        lock = _key_locks.setdefault(key, threading.Lock())
+    with lock:
+        instance = _instances.get(key)
+        if instance is None:
+            start_time = time.time()
+            instance = factory()
+            _load_times[key] = time.time() - start_time
+            _instances[key] = instance
+            print(f"📦 Đã load {key} ({_load_times[key]:.1f}s)")
+    return instance
+
+
+def default_device() -> str:
+    device = os.environ.get("EMBEDDING_DEVICE")
+    if device:
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def get_sentence_transformer(model_name: str = VIETNAMESE_SBERT, device: str = None):
+    """SentenceTransformer dùng chung theo (model, device)"""
+    device = device or default_device()
+
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device=device)
+
+    return get_shared(("sentence_transformer", model_name, device), load)
+
+
+class LazySentenceTransformer:
+    """
+    Proxy cho SentenceTransformer: chỉ load (qua registry) khi được dùng lần đầu,
+    nên tạo agent / import flow không tốn thời gian load model.
+    """
+
+    def __init__(self, model_name: str = VIETNAMESE_SBERT, device: str = None):
+        self.model_name = model_name
+        self.device = device
+
+    @property
+    def model(self):
+        return get_sentence_transformer(self.model_name, self.device)
+
+    def encode(self, *args, **kwargs):
+        return self.model.encode(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def get_document_processor():
+    """EduMateDocumentProcessor (cấu hình balanced) dùng chung cho cả process"""
+    def load():
+        from modules.rag_module.documents_processing.main_processor import EduMateDocumentProcessor
+        return EduMateDocumentProcessor.create_balanced()
+
+    return get_shared("document_processor", load)
+
+
+def loaded_models() -> Dict[str, float]:
+    """Các model đã load và thời gian load (giây)"""
+    return {str(key): round(seconds, 3) for key, seconds in _load_times.items()}
+
+
+def warm_up(models: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    Load trước các model (vd: khi worker khởi động) để request đầu tiên không phải chờ.
+    models: danh sách tên model / "document_processor"; mặc định đọc MODEL_WARMUP
+    (phân cách bằng dấu phẩy, "*" = vietnamese-sbert + MiniLM + document_processor).
+    """
+    if models is None:
+        value = os.environ.get("MODEL_WARMUP", "").strip()
+        if not value:
+            return {}
+        models = [VIETNAMESE_SBERT, MINILM, "document_processor"] if value == "*" else \
+            [m.strip() for m in value.split(",") if m.strip()]
+
+    for name in models:
+        try:
+            if name == "document_processor":
+                get_document_processor()
+            else:
+                get_sentence_transformer(name)
+        except Exception as e:
+            logger.warning(f"Warm-up failed for {name}: {e}")
+    return loaded_models()
+
+
+def warm_up_inference() -> int:
+    """
+    Chạy thử encode trên mọi SentenceTransformer đã load: thread pool của torch
+    được tạo trong chính process này (vd: worker vừa fork từ master đã preload model)
+    """
+    warmed = 0
+    for key, instance in list(_instances.items()):
+        if isinstance(key, tuple) and key[0] == "sentence_transformer":
+            try:
+                instance.encode(["warm-up"], convert_to_numpy=True)
+                warmed += 1
+            except Exception as e:
+                logger.warning(f"Inference warm-up failed for {key}: {e}")
+    return warmed
@@ -0,0 +1,167 @@
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import tiktoken
+
+# Ngân sách token mặc định cho phần tài liệu tham khảo trong prompt, như nhau cho mọi model
+# (~800 token: cỡ context hiệu dụng trước đây — 3 chunk × 500 ký tự — cộng phần bỏ trùng / cắt gọn;
+# context window của các model đều dư xa nên không chia theo model; tăng ngân sách làm tăng
+# token input của mọi lần gọi viết bài). Ghi đè bằng LLM_CONTEXT_TOKENS
+DEFAULT_CONTEXT_TOKENS = 800
+FALLBACK_ENCODING = "o200k_base"
+
+_SCORE_KEYS = ("semantic_score", "score", "similarity_score", "similarity")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@lru_cache(maxsize=16)
+def get_encoding(model: str = ""):
+    """Encoding tiktoken của model; model không rõ (Gemini, router...) dùng o200k_base để ước lượng"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+
+
+def chunk_score(chunk: Any) -> float:
+    """Điểm liên quan của chunk (dict hoặc SearchResult/QueryResult)"""
+    for key in _SCORE_KEYS:
+        value = getattr(chunk, key, None) if not isinstance(chunk, dict) else chunk.get(key)
+        if isinstance(value, (int, float)):
+            return float(value)
+    return 0.0
+
+
+def chunk_content(chunk: Any) -> str:
+    return (chunk.get("content", "") if isinstance(chunk, dict) else getattr(chunk, "content", "")) or ""
+
+
+def chunk_source(chunk: Any) -> str:
+    if isinstance(chunk, dict):
+        return chunk.get("source_file") or chunk.get("source") or "Unknown"
+    return getattr(chunk, "source_file", None) or getattr(chunk, "source", None) or "Unknown"
+
+
+def _shingles(text: str, size: int = 5) -> Set[int]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {hash(" ".join(words))} if words else set()
+    return {hash(" ".join(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+@dataclass
+class PackResult:
+    text: str
+    tokens: int
+    budget: int
+    included: int = 0
+    truncated: int = 0
+    duplicates: int = 0
+    dropped: int = 0
+    sources: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tokens": self.tokens, "budget": self.budget, "included": self.included,
+            "truncated": self.truncated, "duplicates": self.duplicates, "dropped": self.dropped,
+        }
+
+
+class TokenBudgeter:
+    """
+    Đếm token bằng tiktoken và đóng gói chunk tài liệu vào đúng ngân sách token:
+    chunk điểm cao trước, bỏ chunk trùng lặp nội dung (overlap giữa các chunk
+    liền kề / từ nhiều nguồn), chunk cuối được cắt theo token thay vì theo ký tự.
+    """
+
+    def __init__(self, model: str = "", dedupe_threshold: float = 0.8, min_chunk_tokens: int = 48):
+        self.model = model
+        self.encoding = get_encoding(model)
+        self.dedupe_threshold = dedupe_threshold
+        self.min_chunk_tokens = min_chunk_tokens
+
+        self._usage_lock = threading.Lock()
+        self.usage: Dict[str, int] = {"calls": 0, "prompt_tokens": 0, "context_tokens": 0}
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text or "", disallowed_special=()))
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        # ~4 token overhead cho mỗi message theo định dạng chat
+        return sum(self.count(m.get("content", "")) + 4 for m in messages) + 2
+
+    def truncate(self, text: str, max_tokens: int, suffix: str = "...") -> str:
+        tokens = self.encoding.encode(text or "", disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(0, max_tokens)]).rstrip() + suffix
+
+    def pack(self, chunks: List[Any], budget: int,
+             format_chunk: Optional[Callable[[Any, str], str]] = None,
+             separator: str = "\n\n") -> PackResult:
+        """
+        Chọn chunk theo điểm giảm dần cho tới khi hết `budget` token.
+        format_chunk(chunk, content) → đoạn text đưa vào prompt (mặc định "[Nguồn: ...] content").
+        """
+        format_chunk = format_chunk or (lambda chunk, content: f"[Nguồn: {chunk_source(chunk)}] {content}")
+        result = PackResult(text="", tokens=0, budget=budget)
+        if not chunks or budget <= 0:
+            return result
+
+        separator_tokens = self.count(separator)
+        ordered = sorted(chunks, key=chunk_score, reverse=True)
+        parts: List[str] = []
+        seen: Set[int] = set()
+
+        for index, chunk in enumerate(ordered):
+            content = chunk_content(chunk).strip()
+            if not content:
+                continue
+
+            shingles = _shingles(content)
+            if shingles and len(shingles & seen) / len(shingles) >= self.dedupe_threshold:
+                result.duplicates += 1
+                continue
+
+            remaining = budget - result.tokens - (separator_tokens if parts else 0)
+            snippet = format_chunk(chunk, content)
+            snippet_tokens = self.count(snippet)
+
+            if snippet_tokens > remaining:
+                overhead = snippet_tokens - self.count(content)
+                room = remaining - overhead
+                if room < self.min_chunk_tokens:
+                    result.dropped += len(ordered) - index
+                    break
+                snippet = format_chunk(chunk, self.truncate(content, room - 1))
+                snippet_tokens = self.count(snippet)
+                if snippet_tokens > remaining:
+                    result.dropped += len(ordered) - index
+                    break
+                result.truncated += 1
+
+            parts.append(snippet)
+            seen |= shingles
+            result.tokens += snippet_tokens + (separator_tokens if len(parts) > 1 else 0)
+            result.included += 1
+            source = chunk_source(chunk)
+            if source not in result.sources:
+                result.sources.append(source)
+
+        result.text = separator.join(parts)
+        return result
+
+    def record(self, prompt_tokens: int, context_tokens: int = 0):
+        with self._usage_lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["context_tokens"] += context_tokens
+
+
+def context_budget() -> int:
+    """Ngân sách token cho tài liệu tham khảo: LLM_CONTEXT_TOKENS nếu có, không thì DEFAULT_CONTEXT_TOKENS"""
+    return int(os.environ.get("LLM_CONTEXT_TOKENS") or DEFAULT_CONTEXT_TOKENS)
@@ -0,0 +1,353 @@
+import os
+import time
+import queue
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Deadline tuyệt đối (time.monotonic()) của request hiện tại, truyền xuống mọi lời gọi LLM lồng bên trong
+_current_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def llm_deadline(seconds: float):
+    """Đặt deadline cho mọi lời gọi LLM trong khối with (không nới rộng deadline đang có)"""
+    deadline = time.monotonic() + seconds
+    parent = _current_deadline.get()
+    if parent is not None:
+        deadline = min(deadline, parent)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[float]:
+    return _current_deadline.get()
+
+
+class TokenBucket:
+    """Token bucket async: `rate` token/giây, tối đa `capacity` token dồn lại"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0, deadline: Optional[float] = None):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+                if deadline is not None and now + wait > deadline:
+                    raise DeadlineExceeded("Rate limiter wait would exceed deadline")
+                await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """Giới hạn cho một provider: số request đồng thời + request/phút + token/phút"""
+
+    def __init__(self, max_concurrency: int = 16, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute / 60.0, requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+
+    async def throttle(self, estimated_tokens: int, deadline: Optional[float]):
+        if self.request_bucket is not None:
+            await self.request_bucket.acquire(1, deadline)
+        if self.token_bucket is not None:
+            await self.token_bucket.acquire(estimated_tokens, deadline)
+
+
+def estimate_tokens(messages, max_tokens: int) -> int:
+    """Ước lượng nhanh số token (≈ 4 ký tự / token) để trừ vào bucket token/phút"""
+    chars = sum(len(m.get("content", "")) for m in messages)
+    return chars // 4 + max_tokens
+
+
+def status_code_of(error: Exception) -> Optional[int]:
+    """Lấy HTTP status từ lỗi của openai (status_code) hoặc google api_core (code)"""
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def retry_after_of(error: Exception) -> Optional[float]:
+    """Đọc header Retry-After / retry-after-ms nếu server trả về"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    status = status_code_of(error)
+    if status is not None:
+        return status == 429 or status >= 500 or status == 408
+    # Lỗi mạng / timeout không có status
+    name = type(error).__name__
+    return any(key in name for key in ("Timeout", "Connection", "ServiceUnavailable", "ResourceExhausted"))
+
+
+async def call_with_retries(make_call: Callable[[float], Awaitable[Any]], limiter: RateLimiter,
+                            estimated_tokens: int, deadline: Optional[float], per_call_timeout: float,
+                            max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0,
+                            keep_slot: bool = False) -> Any:
+    """
+    Gọi `make_call(timeout)` với semaphore + rate limit, retry theo exponential
+    backoff (có jitter) cho 429/5xx, ưu tiên Retry-After nếu có. Timeout của từng
+    lần gọi bị cắt theo thời gian còn lại tới deadline.
+    keep_slot=True: thành công thì vẫn giữ slot semaphore, caller phải tự release.
+    """
+    attempt = 0
+    while True:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("LLM call deadline exceeded")
+        timeout = per_call_timeout if remaining is None else min(per_call_timeout, remaining)
+
+        try:
+            await limiter.throttle(estimated_tokens, deadline)
+            await limiter.semaphore.acquire()
+            try:
+                result = await make_call(timeout)
+            except BaseException:
+                limiter.semaphore.release()
+                raise
+            if not keep_slot:
+                limiter.semaphore.release()
+            return result
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt)) * random.uniform(0.8, 1.2)
+            retry_after = retry_after_of(e)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+            attempt += 1
+            logger.warning(f"LLM call failed ({status_code_of(e) or type(e).__name__}), "
+                           f"retry {attempt}/{max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+@asynccontextmanager
+async def open_stream(make_call: Callable[[float], Awaitable[Any]], limiter: RateLimiter,
+                      estimated_tokens: int, deadline: Optional[float], per_call_timeout: float,
+                      max_retries: int = 5):
+    """
+    Mở stream qua call_with_retries (chỉ retry lúc mở) và giữ slot semaphore của
+    provider cho tới khi stream được đọc hết / đóng: giới hạn đồng thời tính cả
+    các completion đang stream, không chỉ lúc mở kết nối
+    """
+    stream = await call_with_retries(make_call, limiter, estimated_tokens, deadline, per_call_timeout,
+                                     max_retries=max_retries, keep_slot=True)
+    try:
+        yield stream
+    finally:
+        limiter.semaphore.release()
+
+
+class LLMRuntime:
+    """
+    Event loop nền dùng chung cho cả process: giữ connection pool HTTP, semaphore
+    và rate limiter của từng provider. Code sync (các agent) gọi vào qua
+    run() / iterate(), code async ở loop khác gọi qua run_async() / aiterate().
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="llm-runtime", daemon=True)
+        self._thread.start()
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._http_client = None
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _in_runtime_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def limiter(self, provider: str) -> RateLimiter:
+        """Rate limiter của provider, cấu hình qua LLM_<PROVIDER>_MAX_CONCURRENCY / _RPM / _TPM"""
+        if provider not in self._limiters:
+            prefix = f"LLM_{provider.upper()}_"
+
+            def env(name, default):
+                return float(os.environ.get(prefix + name, os.environ.get("LLM_" + name, default)))
+
+            self._limiters[provider] = RateLimiter(
+                max_concurrency=int(env("MAX_CONCURRENCY", 16)),
+                requests_per_minute=env("RPM", 0),
+                tokens_per_minute=env("TPM", 0),
+            )
+        return self._limiters[provider]
+
+    def http_client(self):
+        """httpx.AsyncClient dùng chung (keep-alive pool) cho mọi client OpenAI/Azure"""
+        if self._http_client is None:
+            import httpx
+            max_connections = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "64"))
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections // 2),
+                timeout=httpx.Timeout(120.0, connect=10.0),
+            )
+        return self._http_client
+
+    def run(self, coro: Awaitable[Any]) -> Any:
+        """Chạy coroutine trên loop nền và chờ kết quả (gọi từ code sync)"""
+        if self._in_runtime_loop():
+            raise RuntimeError("LLMRuntime.run() cannot be called from the runtime loop; await instead")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def run_async(self, coro: Awaitable[Any]) -> Any:
+        """await từ bất kỳ event loop nào; coroutine luôn chạy trên loop nền"""
+        if self._in_runtime_loop():
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def iterate(self, agen: AsyncIterator[Any]) -> Iterator[Any]:
+        """Duyệt async iterator (chạy trên loop nền) từ code sync"""
+        items: "queue.Queue" = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put(item)
+            except Exception as e:
+                items.put(e)
+            finally:
+                await agen.aclose()
+                items.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                item = items.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Caller bỏ dở (timeout section, cancel_futures...) → dừng stream, không tốn thêm token
+            if not future.done():
+                future.cancel()
+
+    async def aiterate(self, agen: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        """Duyệt async iterator chạy trên loop nền từ một event loop khác"""
+        if self._in_runtime_loop():
+            async for item in agen:
+                yield item
+            return
+
+        caller_loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    caller_loop.call_soon_threadsafe(items.put_nowait, item)
+            except Exception as e:
+                caller_loop.call_soon_threadsafe(items.put_nowait, e)
+            finally:
+                await agen.aclose()
+                caller_loop.call_soon_threadsafe(items.put_nowait, done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                item = await items.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def shutdown(self):
+        if self._http_client is not None:
+            asyncio.run_coroutine_threadsafe(self._http_client.aclose(), self.loop).result(timeout=5)
+            self._http_client = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+_runtime: Optional[LLMRuntime] = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime() -> LLMRuntime:
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = LLMRuntime()
+        return _runtime
+
+
+def reset_runtime():
+    """Bỏ runtime hiện tại (vd: sau fork, thread của loop nền không còn tồn tại)"""
+    global _runtime
+    with _runtime_lock:
+        _runtime = None
+
+
+def warm_up_pool(urls: List[str], timeout: float = 5.0) -> int:
+    """Mở sẵn kết nối keep-alive (TCP + TLS) tới các endpoint LLM trong pool dùng chung; trả về số endpoint đã kết nối"""
+    urls = [url for url in urls if url]
+    if not urls:
+        return 0
+    runtime = get_runtime()
+
+    async def ping(url: str) -> bool:
+        try:
+            # Chỉ cần bắt tay xong, status code không quan trọng
+            await runtime.http_client().head(url, timeout=timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"LLM pool warm-up failed for {url}: {e}")
+            return False
+
+    async def ping_all():
+        return await asyncio.gather(*(ping(url) for url in urls))
+
+    return sum(runtime.run(ping_all()))
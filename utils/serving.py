@@ -0,0 +1,104 @@
+import gc
+import os
+import sys
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+
+from utils.ModelRegistry import default_device, warm_up, warm_up_inference
+from utils.async_llm import get_runtime, reset_runtime, warm_up_pool
+
+SECRET_KEY_FILE = os.environ.get("FLASK_SECRET_KEY_FILE", "cache/flask_secret_key")
+
+
+def load_secret_key() -> str:
+    """
+    Secret key ổn định cho cookie session: FLASK_SECRET_KEY, nếu không có thì
+    đọc / tạo file key dùng chung (mọi worker và mọi lần restart ký cùng một key)
+    """
+    key = os.environ.get("FLASK_SECRET_KEY", "").strip()
+    if key:
+        return key
+
+    if os.path.exists(SECRET_KEY_FILE):
+        with open(SECRET_KEY_FILE) as f:
+            return f.read().strip()
+
+    os.makedirs(os.path.dirname(SECRET_KEY_FILE) or ".", exist_ok=True)
+    tmp_path = f"{SECRET_KEY_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(os.urandom(32).hex())
+    os.chmod(tmp_path, 0o600)
+    try:
+        # link() không ghi đè: nhiều worker khởi động cùng lúc vẫn chỉ một key thắng
+        os.link(tmp_path, SECRET_KEY_FILE)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+    with open(SECRET_KEY_FILE) as f:
+        return f.read().strip()
+
+
+def preload(models: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    Gọi ở master trước khi fork (gunicorn preload_app): load model một lần, các
+    worker dùng chung trang nhớ theo copy-on-write. gc.freeze() để GC của worker
+    không chạm vào (và làm copy) các object đã load.
+    CUDA không dùng được qua fork → trên GPU để từng worker tự load.
+    """
+    if default_device() != "cpu":
+        print("⚠️ Model chạy trên GPU: bỏ qua preload ở master, mỗi worker tự load")
+        return {}
+    loaded = warm_up(models)
+    gc.collect()
+    gc.freeze()
+    print(f"🔥 Preload xong ở master: {', '.join(loaded) or 'không có model'}")
+    return loaded
+
+
+def init_worker(start_workers: Callable[[], None]) -> threading.Thread:
+    """
+    Gọi ở mỗi worker ngay sau fork: tạo lại runtime LLM (thread của loop nền không
+    sống qua fork), chia luồng torch giữa các worker, khởi động job queue rồi warm-up
+    inference + connection pool LLM ở luồng nền
+    """
+    reset_runtime()
+
+    torch_threads = int(os.environ.get("TORCH_THREADS_PER_WORKER", "0"))
+    if torch_threads > 0 and "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(torch_threads)
+
+    start_workers()
+
+    def run():
+        warmed = warm_up_inference()
+        endpoints = [url.strip() for url in os.environ.get(
+            "LLM_POOL_WARMUP", os.environ.get("AZURE_ENDPOINT", "")
+        ).split(",") if url.strip()]
+        connected = warm_up_pool(endpoints)
+        print(f"🔥 [worker {os.getpid()}] Warm-up: {warmed} model, {connected}/{len(endpoints)} endpoint LLM")
+
+    thread = threading.Thread(target=run, name="worker-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def drain(stop_workers: Callable[[float], None], timeout: float = 300.0):
+    """
+    Gọi khi worker thoát: chờ các flow đang chạy xong (tối đa `timeout` giây),
+    ghi nốt artefact đang chờ rồi đóng connection pool LLM
+    """
+    deadline = time.time() + timeout
+    print(f"\n⏹️ [worker {os.getpid()}] Đang dừng, chờ các flow đang chạy (tối đa {timeout:.0f}s)...")
+    stop_workers(timeout)
+
+    flow = sys.modules.get("graph_app.flow")
+    writer = getattr(flow, "chunk_artifacts", None) if flow is not None else None
+    if writer is not None:
+        writer.flush(timeout=max(0.0, deadline - time.time()))
+
+    try:
+        get_runtime().shutdown()
+    except Exception as e:
+        print(f"⚠️ Không đóng được runtime LLM: {e}")
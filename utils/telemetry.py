@@ -0,0 +1,37 @@
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+# Callback nhận (kind, data) của span đang chạy (vd: node của flow); None → bỏ qua
+_current_recorder: contextvars.ContextVar[Optional[Callable[[str, dict], None]]] = \
+    contextvars.ContextVar("telemetry_recorder", default=None)
+
+
+@contextmanager
+def telemetry_recorder(recorder: Callable[[str, dict], None]):
+    """Gửi mọi sự kiện telemetry trong khối with (kể cả luồng con có copy context) tới recorder"""
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+
+def current_recorder() -> Optional[Callable[[str, dict], None]]:
+    return _current_recorder.get()
+
+
+def record(kind: str, recorder: Optional[Callable[[str, dict], None]] = None, **data: Any):
+    """
+    Ghi một sự kiện: "llm_usage" (provider, model, tokens_in, tokens_out),
+    "cache" (cache, hit), "timing" (name, seconds)...
+    recorder: truyền tường minh khi code chạy ngoài context của caller (vd: loop nền của LLMRuntime)
+    """
+    recorder = recorder or _current_recorder.get()
+    if recorder is None:
+        return
+    try:
+        recorder(kind, data)
+    except Exception:
+        # Telemetry không bao giờ được làm hỏng luồng chính
+        pass
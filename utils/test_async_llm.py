@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+from utils.async_llm import LLMRuntime, RateLimiter, open_stream
+
+
+def test_open_stream_holds_slot_until_stream_is_consumed():
+    runtime = LLMRuntime()
+    try:
+        async def scenario():
+            limiter = RateLimiter(max_concurrency=1)
+
+            async def make_call(timeout):
+                return ["a", "b"]
+
+            async with open_stream(make_call, limiter, 10, None, 5) as stream:
+                assert stream == ["a", "b"]
+                assert limiter.semaphore.locked()
+            return limiter.semaphore.locked()
+
+        assert runtime.run(scenario()) is False
+    finally:
+        runtime.shutdown()
+
+
+def test_iterate_stops_stream_when_consumer_abandons_it():
+    runtime = LLMRuntime()
+    closed = threading.Event()
+    produced = []
+    try:
+        async def tokens():
+            try:
+                for i in range(1000):
+                    produced.append(i)
+                    yield i
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.set()
+
+        iterator = runtime.iterate(tokens())
+        assert next(iterator) == 0
+        iterator.close()
+
+        assert closed.wait(2.0)
+        count = len(produced)
+        assert count < 1000
+        runtime.run(asyncio.sleep(0.1))
+        assert len(produced) == count
+    finally:
+        runtime.shutdown()
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from utils.GeminiClient import GeminiClient
+
+
+def _convert(messages):
+    # Không cần model thật để chuyển định dạng message
+    return GeminiClient._to_gemini_messages(object.__new__(GeminiClient), messages)
+
+
+def test_system_prompt_is_prepended_to_first_user_turn():
+    converted = _convert([
+        {"role": "system", "content": "Bạn là giáo viên."},
+        {"role": "user", "content": "Soạn giáo án"},
+        {"role": "assistant", "content": "Được"},
+        {"role": "user", "content": "Thêm bài tập"},
+    ])
+    assert converted == [
+        {"role": "user", "parts": ["Bạn là giáo viên.\n\nSoạn giáo án"]},
+        {"role": "model", "parts": ["Được"]},
+        {"role": "user", "parts": ["Thêm bài tập"]},
+    ]
+
+
+def test_system_only_messages_are_not_dropped():
+    converted = _convert([{"role": "system", "content": "Chỉ có system"}])
+    assert converted == [{"role": "user", "parts": ["Chỉ có system"]}]
+
+
+class _Chunk:
+    """Chunk giả: .text raise ValueError khi không có Part hợp lệ, giống SDK"""
+
+    def __init__(self, *texts):
+        parts = [SimpleNamespace(text=text) for text in texts]
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=parts))] if parts else []
+
+    @property
+    def text(self):
+        if not self.candidates:
+            raise ValueError("The `response.text` quick accessor requires a valid `Part`")
+        return "".join(part.text for part in self.candidates[0].content.parts)
+
+
+def test_stream_skips_chunks_without_valid_parts():
+    client = object.__new__(GeminiClient)
+    chunks = [_Chunk("Mở "), _Chunk(), _Chunk("bài", "!"), _Chunk()]
+    client.model = SimpleNamespace(generate_content=lambda *args, **kwargs: iter(chunks))
+    client._generation_config = lambda temperature, max_tokens: None
+    assert list(client.chat_stream([{"role": "user", "content": "Soạn giáo án"}])) == ["Mở ", "bài!"]
@@ -0,0 +1,83 @@
+import time
+
+from utils.LLMCache import CachedLLMClient, LLMCache, cache_enabled_for, cached_llm
+
+MESSAGES = [{"role": "user", "content": "Soạn giáo án quang hợp"}]
+
+
+class FakeLLM:
+    model = "gpt-test"
+
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, messages, temperature=0.3, max_tokens=1500, timeout=30):
+        self.calls += 1
+        return f"answer {self.calls}"
+
+
+def _disk_totals(cache):
+    return cache._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+
+
+def test_key_depends_on_model_messages_and_sampling():
+    key = LLMCache.make_key("m", MESSAGES, 0.3, 100)
+    assert key == LLMCache.make_key("m", [dict(MESSAGES[0])], 0.3, 100)
+    assert key != LLMCache.make_key("other", MESSAGES, 0.3, 100)
+    assert key != LLMCache.make_key("m", MESSAGES, 0.7, 100)
+    assert key != LLMCache.make_key("m", MESSAGES, 0.3, 200)
+
+
+def test_cached_client_returns_stored_response(tmp_path):
+    llm = FakeLLM()
+    client = CachedLLMClient(llm, LLMCache(str(tmp_path / "c.sqlite")), "Agent")
+    assert client.chat(MESSAGES) == "answer 1"
+    assert client.chat(MESSAGES) == "answer 1"
+    assert llm.calls == 1
+    assert client.cache.stats()["namespaces"]["Agent"] == {"hits": 1, "misses": 1}
+
+
+def test_lru_eviction_tracks_size_incrementally(tmp_path):
+    cache = LLMCache(str(tmp_path / "c.sqlite"), max_entries=3, max_bytes=0)
+    for i in range(3):
+        cache.set(f"k{i}", "x" * 10)
+        time.sleep(0.01)
+    cache.get("k0")  # k0 vừa được dùng → k1 là LRU
+    cache.set("k3", "y" * 10)
+    assert cache.get("k1") is None
+    assert all(cache.get(k) is not None for k in ("k0", "k2", "k3"))
+    assert (cache._count, cache._size) == tuple(_disk_totals(cache)) == (3, 30)
+
+    # Ghi đè cùng key chỉ đổi dung lượng
+    cache.set("k0", "z" * 4)
+    assert (cache._count, cache._size) == tuple(_disk_totals(cache)) == (3, 24)
+
+
+def test_max_bytes_limit(tmp_path):
+    cache = LLMCache(str(tmp_path / "c.sqlite"), max_entries=0, max_bytes=25)
+    for i in range(5):
+        cache.set(f"k{i}", "x" * 10)
+    count, size = _disk_totals(cache)
+    assert size <= 25 and (cache._count, cache._size) == (count, size)
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = LLMCache(str(tmp_path / "c.sqlite"), ttl=60)
+    cache.set("old", "x")
+    cache._conn.execute("UPDATE llm_cache SET created_at = ?", (time.time() - 120,))
+    assert cache.get("old") is None
+    assert (cache._count, cache._size) == (0, 0)
+
+
+def test_cache_is_opt_in_per_agent(monkeypatch):
+    llm = FakeLLM()
+    monkeypatch.delenv("LLM_CACHE_AGENTS", raising=False)
+    assert not cache_enabled_for("ChatAgent")
+    assert cached_llm(llm, "ChatAgent") is llm
+
+    monkeypatch.setenv("LLM_CACHE_AGENTS", "SubtopicGeneratorAgent, LessonPlanOutlineAgent")
+    assert cache_enabled_for("LessonPlanOutlineAgent")
+    assert not cache_enabled_for("ChatAgent")
+
+    monkeypatch.setenv("LLM_CACHE_AGENTS", "*")
+    assert cache_enabled_for("ChatAgent")
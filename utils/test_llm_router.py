@@ -0,0 +1,90 @@
+import threading
+import time
+
+from utils.LLMRouter import LLMRouter
+
+
+class FakeClient:
+    def __init__(self, reply="ok", delay=0.0, fail=False):
+        self.reply = reply
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.finished = threading.Event()
+
+    def chat(self, messages, **kwargs):
+        self.calls += 1
+        try:
+            time.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError("boom")
+            return self.reply
+        finally:
+            self.finished.set()
+
+
+def _warm(router, provider, latency, scope="*", ok=True, n=5):
+    for _ in range(n):
+        router._get_stats(scope, provider).record(latency, ok)
+
+
+def test_rank_prefers_lower_p95_and_healthy_provider():
+    router = LLMRouter({"azure": FakeClient(), "gemini": FakeClient()}, min_samples=5)
+    assert router.rank() == ["azure", "gemini"]
+
+    _warm(router, "azure", 5.0)
+    _warm(router, "gemini", 1.0)
+    assert router.rank() == ["gemini", "azure"]
+
+    router._get_stats("*", "gemini").unhealthy_until = time.time() + 60
+    assert router.rank() == ["azure", "gemini"]
+
+
+def test_rank_uses_per_agent_stats_when_enough_samples():
+    router = LLMRouter({"azure": FakeClient(), "gemini": FakeClient()}, min_samples=5)
+    _warm(router, "azure", 1.0)
+    _warm(router, "gemini", 2.0)
+    _warm(router, "azure", 9.0, scope="writer")
+    _warm(router, "gemini", 2.0, scope="writer")
+    assert router.rank() == ["azure", "gemini"]
+    assert router.rank("writer") == ["gemini", "azure"]
+
+
+def test_failover_to_next_provider_on_error():
+    azure, gemini = FakeClient(fail=True), FakeClient(reply="from gemini")
+    router = LLMRouter({"azure": azure, "gemini": gemini})
+    assert router.call("hi") == "from gemini"
+    assert azure.calls == 1 and gemini.calls == 1
+    assert router.stats()["scopes"]["*"]["azure"]["error_rate"] == 1.0
+
+
+def test_provider_marked_unhealthy_after_errors():
+    azure, gemini = FakeClient(fail=True), FakeClient()
+    router = LLMRouter({"azure": azure, "gemini": gemini}, min_samples=3, error_threshold=0.5)
+    for _ in range(3):
+        router.call("hi")
+    assert router.rank()[0] == "gemini"
+    assert not router.stats()["scopes"]["*"]["azure"]["healthy"]
+
+
+def test_hedging_is_off_by_default():
+    slow, fast = FakeClient(reply="slow", delay=0.2), FakeClient(reply="fast")
+    router = LLMRouter({"azure": slow, "gemini": fast}, latency_budget=0.01)
+    assert router.call("hi") == "slow"
+    assert fast.calls == 0
+    assert router.stats()["hedged_calls"] == 0
+
+
+def test_hedge_abandons_slow_request_and_counts_win():
+    slow, fast = FakeClient(reply="slow", delay=0.3), FakeClient(reply="fast")
+    router = LLMRouter({"azure": slow, "gemini": fast}, latency_budget=0.05, hedge=True)
+    assert router.call("hi") == "fast"
+
+    stats = router.stats()
+    assert stats["hedged_calls"] == 1
+    assert stats["hedge_wins"] == 1
+    assert stats["hedge_abandoned"] == 1
+    # Request thua vẫn chạy xong và latency của nó vẫn được ghi nhận
+    assert slow.finished.wait(2.0)
+    time.sleep(0.05)
+    assert router.stats()["scopes"]["*"]["azure"]["samples"] == 1
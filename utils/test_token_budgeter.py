@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip("tiktoken")
+
+from utils.TokenBudgeter import TokenBudgeter, context_budget
+
+CHUNKS = [
+    {"content": "Quang hợp diễn ra ở lục lạp của tế bào lá cây xanh. " * 20, "score": 0.9, "source_file": "a.pdf"},
+    {"content": "Quang hợp diễn ra ở lục lạp của tế bào lá cây xanh. " * 20, "score": 0.8, "source_file": "b.pdf"},
+    {"content": "Hô hấp tế bào giải phóng năng lượng dưới dạng ATP cho mọi hoạt động sống. " * 20,
+     "score": 0.7, "source_file": "c.pdf"},
+]
+
+
+def test_pack_respects_budget_and_skips_duplicates():
+    budgeter = TokenBudgeter("gpt-4o")
+    packed = budgeter.pack(CHUNKS, 300)
+    assert packed.tokens <= 300
+    assert budgeter.count(packed.text) <= 300
+    assert packed.duplicates == 1
+    assert packed.sources[0] == "a.pdf"
+
+
+def test_pack_truncates_last_chunk_on_token_boundary():
+    budgeter = TokenBudgeter("gpt-4o")
+    full = budgeter.count(f"[Nguồn: a.pdf] {CHUNKS[0]['content'].strip()}")
+    packed = budgeter.pack(CHUNKS[:1], full // 2)
+    assert packed.truncated == 1 and packed.text.endswith("...")
+    assert packed.tokens <= full // 2
+
+
+def test_context_budget_defaults_and_override(monkeypatch):
+    monkeypatch.delenv("LLM_CONTEXT_TOKENS", raising=False)
+    assert context_budget() == 800
+    monkeypatch.setenv("LLM_CONTEXT_TOKENS", "1200")
+    assert context_budget() == 1200
@@ -0,0 +1,166 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+from typing import Dict, List, Optional
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.utils import secure_filename
+
+from modules.rag_module.UploadStore import remember_sha256
+
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_FILE_BYTES = int(float(os.environ.get("MAX_UPLOAD_FILE_MB", "300")) * 1024 * 1024)
+MAX_UPLOAD_TOTAL_BYTES = int(float(os.environ.get("MAX_UPLOAD_TOTAL_MB", "1024")) * 1024 * 1024)
+# Thư mục upload bị bỏ lại (job không chạy / process chết giữa chừng) bị xóa sau thời gian này
+UPLOAD_TTL_SECONDS = float(os.environ.get("UPLOAD_TTL_SECONDS", str(24 * 3600)))
+
+# Định dạng DocumentProcessor hỗ trợ (theo ProcessorFactory)
+BINARY_SIGNATURES = (
+    (b"%PDF-", "pdf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+OFFICE_EXTENSIONS = {"docx", "pptx", "xlsx"}  # đều là file zip (PK\x03\x04)
+TEXT_EXTENSIONS = {"html", "htm", "md", "markdown", "txt"}
+IMAGE_ALIASES = {"jpeg": "jpg", "tif": "tiff"}
+
+
+def detect_format(head: bytes, filename: str) -> Optional[str]:
+    """Định dạng thật của file theo magic bytes (đuôi file chỉ dùng để phân biệt docx/pptx/xlsx và file text)"""
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    ext = IMAGE_ALIASES.get(ext, ext)
+
+    for signature, fmt in BINARY_SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    if head.startswith(b"PK\x03\x04"):
+        return ext if ext in OFFICE_EXTENSIONS else None
+    if ext in TEXT_EXTENSIONS and b"\x00" not in head:
+        return ext
+    return None
+
+
+class SpoolFile:
+    """
+    File đích cho parser multipart: ghi thẳng xuống đĩa theo từng chunk, vừa ghi
+    vừa hash SHA-256 và giữ vài byte đầu để nhận dạng định dạng
+    """
+
+    HEAD_BYTES = 16
+
+    def __init__(self, path: str, filename: str, max_bytes: int):
+        self.path = path
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.head = b""
+        self._sha = hashlib.sha256()
+        self._file = open(path, "w+b")
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self._file.close()
+            raise RequestEntityTooLarge(
+                f"File {self.filename} vượt quá {self.max_bytes // (1024 * 1024)}MB"
+            )
+        if len(self.head) < self.HEAD_BYTES:
+            self.head += bytes(data[:self.HEAD_BYTES - len(self.head)])
+        self._sha.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha.hexdigest()
+
+    def __getattr__(self, name):
+        # seek / read / close... của file thật
+        return getattr(self._file, name)
+
+
+class SpoolingRequest(Request):
+    """
+    Request của Flask: file của /process được stream thẳng vào uploads/<upload_id>/
+    thay vì buffer (werkzeug) rồi copy sang file tạm
+    """
+
+    spool_endpoints = ("process",)
+
+    @property
+    def upload_id(self) -> str:
+        if "_upload_id" not in self.__dict__:
+            self.__dict__["_upload_id"] = uuid.uuid4().hex
+        return self.__dict__["_upload_id"]
+
+    @property
+    def upload_dir(self) -> str:
+        return os.path.join(UPLOAD_DIR, self.upload_id)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint not in self.spool_endpoints:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        os.makedirs(self.upload_dir, exist_ok=True)
+        spooled = self.__dict__.setdefault("_spooled", [])
+        name = secure_filename(filename or "") or "upload"
+        path = os.path.join(self.upload_dir, f"{len(spooled):02d}_{name}")
+        spool = SpoolFile(path, filename or name, MAX_UPLOAD_FILE_BYTES)
+        spooled.append(spool)
+        return spool
+
+
+def finalize_uploads(files) -> List[Dict[str, str]]:
+    """
+    Hoàn tất các file đã stream: kiểm tra magic bytes, đặt đuôi đúng định dạng
+    (ProcessorFactory nhận dạng theo đuôi) → [{"path", "name", "sha256", "format"}].
+    UnsupportedMediaType nếu có file không hỗ trợ.
+    """
+    results = []
+    for storage in files:
+        if not storage.filename:
+            continue
+        spool = storage.stream
+        if not isinstance(spool, SpoolFile):
+            raise ValueError("Upload không được stream qua SpoolingRequest")
+        spool.close()
+
+        fmt = detect_format(spool.head, storage.filename)
+        if fmt is None:
+            raise UnsupportedMediaType(f"Định dạng file không được hỗ trợ: {storage.filename}")
+
+        stem = os.path.splitext(os.path.basename(spool.path))[0]
+        path = os.path.join(os.path.dirname(spool.path), f"{stem}.{fmt}")
+        os.replace(spool.path, path)
+        remember_sha256(path, spool.sha256)
+        results.append({"path": path, "name": storage.filename, "sha256": spool.sha256, "format": fmt})
+    return results
+
+
+def release_uploads(upload_id: str) -> bool:
+    """Xóa thư mục upload của một job (gọi khi job kết thúc, thành công hay lỗi)"""
+    if not upload_id or os.path.basename(upload_id) != upload_id:
+        return False
+    path = os.path.join(UPLOAD_DIR, upload_id)
+    if not os.path.isdir(path):
+        return False
+    shutil.rmtree(path, ignore_errors=True)
+    return True
+
+
+def sweep_stale_uploads(max_age: float = None) -> int:
+    """Xóa thư mục upload cũ hơn max_age giây (job bị bỏ dở); trả về số thư mục đã xóa"""
+    max_age = UPLOAD_TTL_SECONDS if max_age is None else max_age
+    if not os.path.isdir(UPLOAD_DIR):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
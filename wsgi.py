@@ -0,0 +1,6 @@
+import os
+
+# Worker nền của job queue được khởi động trong từng worker gunicorn (post_fork), không phải lúc import
+os.environ.setdefault("DEFER_BACKGROUND_WORKERS", "1")
+
+from app import app  # noqa: E402